@@ -0,0 +1,51 @@
+import numpy as np
+
+from matplotlib.colors import Colormap as MatplotlibColormap
+
+from vispy.color import BaseColormap, get_colormap
+
+__all__ = ['CMAP_LUT_SIZE', 'clim_transform', 'get_colormap_lut']
+
+# The number of colors in the lookup table used for each colormap
+CMAP_LUT_SIZE = 256
+
+
+def get_colormap_lut(cmap, size=256):
+    """
+    Sample a colormap at ``size`` regularly spaced values between 0 and 1 and
+    return the colors as a ``(size, 4)`` float32 array.
+
+    The colormap can be the name of a VisPy colormap, a VisPy or Matplotlib
+    colormap (which includes the glue colormaps), or an array of RGBA colors,
+    which is resampled to the requested size.
+    """
+
+    t = np.linspace(0, 1, size)
+
+    if isinstance(cmap, str):
+        cmap = get_colormap(cmap)
+
+    if isinstance(cmap, BaseColormap):
+        lut = cmap.map(t[:, np.newaxis])
+    elif isinstance(cmap, MatplotlibColormap):
+        lut = cmap(t)
+    else:
+        colors = np.asarray(cmap, dtype=np.float32)
+        if colors.ndim != 2 or colors.shape[1] != 4:
+            raise ValueError("Colors should be given as an (n, 4) array")
+        x = np.linspace(0, 1, len(colors))
+        lut = np.column_stack([np.interp(t, x, colors[:, i]) for i in range(4)])
+
+    return np.asarray(lut, dtype=np.float32).reshape((size, 4))
+
+
+def clim_transform(ref_clim, clim):
+    """
+    Return the ``(scale, offset)`` needed to convert values normalized using
+    the ``ref_clim`` limits to values normalized using the ``clim`` limits.
+    """
+    if ref_clim is None or clim is None or clim[1] == clim[0]:
+        return 1., 0.
+    scale = (ref_clim[1] - ref_clim[0]) / (clim[1] - clim[0])
+    offset = (ref_clim[0] - clim[0]) / (clim[1] - clim[0])
+    return scale, offset
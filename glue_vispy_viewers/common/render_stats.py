@@ -0,0 +1,127 @@
+import time
+from threading import Lock
+from collections import namedtuple
+from contextlib import contextmanager
+
+from vispy.gloo import gl
+
+__all__ = ['OperationStats', 'RenderStats']
+
+OperationStats = namedtuple('OperationStats', ['count', 'time', 'nbytes'])
+
+
+class RenderStats(object):
+    """
+    Keep track of the time taken by, and the number of bytes processed by, the
+    operations needed to render a viewer, such as computing buffers, uploading
+    textures or drawing visuals.
+
+    Operations are recorded with a name and optionally the label of the layer
+    they were carried out for, and are grouped into frames: ``last_frame``
+    gives the operations recorded since the previous frame up to the end of
+    the last frame, while ``totals`` gives all operations since the statistics
+    were last reset. Operations can be recorded from any thread.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._current = {}
+        self._last_frame = {}
+        self._totals = {}
+        self._frame_start = None
+
+        # If True, we wait for the GPU to finish drawing at the end of each
+        # frame so that the frame time includes the time taken on the GPU.
+        self.synchronize = False
+
+    @staticmethod
+    def _add(stats, key, op_time, nbytes):
+        count, total_time, total_nbytes = stats.get(key, (0, 0., 0))
+        stats[key] = OperationStats(count + 1, total_time + op_time, total_nbytes + nbytes)
+
+    def record(self, operation, time=0., nbytes=0, layer=None):
+        """
+        Record an operation that took ``time`` seconds and processed ``nbytes``
+        bytes.
+        """
+        with self._lock:
+            self._add(self._current, (operation, layer), time, nbytes)
+
+    @contextmanager
+    def timer(self, operation, nbytes=0, layer=None):
+        """
+        Record the time taken by the code inside the context manager.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(operation, time.perf_counter() - start, nbytes=nbytes, layer=layer)
+
+    def start_frame(self):
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """
+        Record the time since `start_frame` was called as a ``'frame'``
+        operation, and start grouping operations into a new frame.
+        """
+
+        if self._frame_start is None:
+            return
+
+        if self.synchronize:
+            gl.glFinish()
+
+        frame_time = time.perf_counter() - self._frame_start
+        self._frame_start = None
+
+        with self._lock:
+            self._add(self._current, ('frame', None), frame_time, 0)
+            for key, (count, op_time, nbytes) in self._current.items():
+                total = self._totals.get(key, OperationStats(0, 0., 0))
+                self._totals[key] = OperationStats(total.count + count,
+                                                   total.time + op_time,
+                                                   total.nbytes + nbytes)
+            self._last_frame = self._current
+            self._current = {}
+
+    @property
+    def last_frame(self):
+        """
+        A dictionary mapping ``(operation, layer)`` tuples to `OperationStats`
+        for the last frame.
+        """
+        with self._lock:
+            return dict(self._last_frame)
+
+    @property
+    def totals(self):
+        """
+        A dictionary mapping ``(operation, layer)`` tuples to `OperationStats`
+        for all frames since the statistics were last reset.
+        """
+        with self._lock:
+            return dict(self._totals)
+
+    def by_operation(self, stats=None):
+        """
+        Combine the statistics for all layers, returning a dictionary mapping
+        each operation to `OperationStats`. By default, the statistics for the
+        last frame are used.
+        """
+        if stats is None:
+            stats = self.last_frame
+        combined = {}
+        for (operation, layer), (count, op_time, nbytes) in stats.items():
+            total = combined.get(operation, OperationStats(0, 0., 0))
+            combined[operation] = OperationStats(total.count + count,
+                                                 total.time + op_time,
+                                                 total.nbytes + nbytes)
+        return combined
+
+    def reset(self):
+        with self._lock:
+            self._current = {}
+            self._last_frame = {}
+            self._totals = {}
@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from matplotlib import cm
+
+from ...volume.colors import get_translucent_cmap
+from ..colors import clim_transform, get_colormap_lut
+
+
+def test_colormap_lut():
+
+    lut = get_colormap_lut(get_translucent_cmap(1, 0.5, 0), size=5)
+    assert lut.shape == (5, 4)
+    assert lut.dtype == np.float32
+    assert_allclose(lut[:, :3], [[1, 0.5, 0]] * 5)
+    assert_allclose(lut[:, 3], [0, 0.25, 0.5, 0.75, 1])
+
+    # Matplotlib (and therefore glue) colormaps
+    assert_allclose(get_colormap_lut(cm.gray, size=3)[:, 0], [0, 0.5, 1], atol=0.01)
+
+    # VisPy colormaps
+    assert_allclose(get_colormap_lut('grays', size=3)[:, 0], [0, 0.5, 1], atol=0.01)
+
+    # Arrays of colors are resampled
+    lut = get_colormap_lut([[0, 0, 0, 0], [1, 1, 1, 1]], size=3)
+    assert_allclose(lut, [[0] * 4, [0.5] * 4, [1] * 4])
+
+    with pytest.raises(ValueError) as exc:
+        get_colormap_lut([1, 2, 3])
+    assert exc.value.args[0] == "Colors should be given as an (n, 4) array"
+
+
+def test_clim_transform():
+
+    assert clim_transform(None, (1, 2)) == (1., 0.)
+    assert clim_transform((1, 2), None) == (1., 0.)
+
+    # Values normalized with (2, 4) should be converted to values normalized
+    # with (0, 8), so 0 -> 0.25 and 1 -> 0.5
+    scale, offset = clim_transform((2, 4), (0, 8))
+    assert_allclose([0 * scale + offset, 1 * scale + offset], [0.25, 0.5])
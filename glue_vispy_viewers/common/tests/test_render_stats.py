@@ -0,0 +1,69 @@
+import time
+
+from ..render_stats import OperationStats, RenderStats
+
+
+def test_frames():
+
+    stats = RenderStats()
+
+    # Operations recorded before the first frame are included in that frame
+    stats.record('compute', 0.5, nbytes=100, layer='a')
+
+    stats.start_frame()
+    stats.record('upload', 0.1, nbytes=10, layer='a')
+    stats.record('upload', 0.2, nbytes=20, layer='a')
+    stats.record('upload', 0.3, nbytes=30, layer='b')
+    stats.record('draw', 0.05)
+    stats.end_frame()
+
+    last = stats.last_frame
+    assert last[('compute', 'a')] == OperationStats(1, 0.5, 100)
+    assert last[('upload', 'a')].count == 2
+    assert last[('upload', 'a')].nbytes == 30
+    assert last[('upload', 'b')].nbytes == 30
+    assert last[('draw', None)].count == 1
+    assert last[('frame', None)].count == 1
+
+    combined = stats.by_operation()
+    assert combined['upload'].count == 3
+    assert combined['upload'].nbytes == 60
+    assert abs(combined['upload'].time - 0.6) < 1e-10
+
+    # The last frame only includes the operations since the previous frame,
+    # while the totals include all frames.
+    stats.start_frame()
+    stats.record('draw', 0.05)
+    stats.end_frame()
+
+    assert set(stats.last_frame) == {('draw', None), ('frame', None)}
+    assert stats.totals[('draw', None)].count == 2
+    assert stats.totals[('upload', 'a')].count == 2
+    assert stats.by_operation(stats.totals)['frame'].count == 2
+
+    stats.reset()
+    assert stats.last_frame == {}
+    assert stats.totals == {}
+
+
+def test_end_frame_without_start():
+    stats = RenderStats()
+    stats.record('draw', 0.1)
+    stats.end_frame()
+    assert stats.last_frame == {}
+
+
+def test_timer():
+
+    stats = RenderStats()
+
+    with stats.timer('compute', nbytes=8, layer='a'):
+        time.sleep(0.01)
+
+    stats.start_frame()
+    stats.end_frame()
+
+    count, op_time, nbytes = stats.last_frame[('compute', 'a')]
+    assert count == 1
+    assert op_time >= 0.005
+    assert nbytes == 8
@@ -0,0 +1,76 @@
+from echo import CallbackProperty, delay_callback
+from glue.core.state_objects import State
+from glue.utils.qt import get_qapp
+
+from ..update_scheduler import LayerUpdateScheduler
+
+
+class SimpleState(State):
+    a = CallbackProperty(1)
+    b = CallbackProperty(2)
+
+
+class CallbackRecorder(object):
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, changed):
+        self.calls.append(changed)
+
+
+def test_scheduler():
+
+    get_qapp()
+
+    viewer_state = SimpleState()
+    layer_state1 = SimpleState()
+    layer_state2 = SimpleState()
+
+    scheduler = LayerUpdateScheduler(viewer_state)
+
+    artist1 = object()
+    artist2 = object()
+    callback1 = CallbackRecorder()
+    callback2 = CallbackRecorder()
+
+    scheduler.register(artist1, layer_state1, callback1)
+    scheduler.register(artist2, layer_state2, callback2)
+
+    # Changes are collected until the scheduler is flushed, and each
+    # layer artist is then updated once.
+
+    viewer_state.a = 3
+    viewer_state.b = 4
+    layer_state1.a = 5
+    layer_state1.a = 6
+
+    assert scheduler.pending
+    assert callback1.calls == []
+
+    scheduler.flush()
+
+    assert not scheduler.pending
+    assert callback1.calls == [{'a', 'b'}]
+    assert callback2.calls == [{'a', 'b'}]
+
+    # Delayed callbacks are also collected
+    with delay_callback(layer_state2, 'a', 'b'):
+        layer_state2.a = 7
+        layer_state2.b = 8
+
+    scheduler.flush()
+
+    assert len(callback1.calls) == 1
+    assert callback2.calls[-1] == {'a', 'b'}
+
+    # Once unregistered, layer artists are no longer updated
+
+    layer_state1.b = 9
+    scheduler.unregister(artist1)
+    viewer_state.a = 10
+
+    scheduler.flush()
+
+    assert len(callback1.calls) == 1
+    assert callback2.calls[-1] == {'a'}
@@ -75,6 +75,34 @@ class BaseTestDataViewer(object):
 
         app.close()
 
+    def test_render_stats(self):
+
+        d1 = Data(x=np.random.random((2,) * self.ndim))
+        dc = DataCollection([d1])
+        app = GlueApplication(dc)
+        w = app.new_data_viewer(self.widget_cls, data=d1)
+
+        assert w.render_stats is w._vispy_widget.stats
+
+        w.state.show_stats = True
+        assert w.render_stats.synchronize
+
+        # Simulate a frame rather than drawing the canvas
+        w._vispy_widget._start_frame()
+        w.render_stats.record('upload', 0.002, nbytes=2 * 1024 ** 2, layer='a')
+        w._vispy_widget._end_frame()
+        w._report_render_stats()
+
+        message = w.statusBar().currentMessage()
+        assert message.startswith('frame: ')
+        assert 'upload: 2.0 ms (2.0 MB)' in message
+
+        w.state.show_stats = False
+        assert not w.render_stats.synchronize
+        assert w.statusBar().currentMessage() == ''
+
+        app.close()
+
 
 class TestDataViewerVolume(BaseTestDataViewer):
     widget_cls = VispyVolumeViewer
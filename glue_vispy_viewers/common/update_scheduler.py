@@ -0,0 +1,92 @@
+from qtpy.QtCore import QTimer
+
+__all__ = ['LayerUpdateScheduler']
+
+
+class LayerUpdateScheduler(object):
+    """
+    Collect the names of the viewer and layer state properties that change,
+    and pass them to the layer artists in one go the next time the event loop
+    runs.
+
+    Each layer artist registers a callback which is called with the set of
+    names of the properties that changed since the callback was last called.
+    Changes to the viewer state are passed to all layer artists, while changes
+    to a layer state are only passed to the layer artist for that layer. Any
+    pending changes are also passed on straight away when `flush` is called,
+    for example before the canvas is drawn.
+    """
+
+    def __init__(self, viewer_state):
+
+        self._viewer_state = viewer_state
+        self._viewer_state.add_global_callback(self._viewer_changed)
+
+        # Map each layer artist to the callback used to update it and to the
+        # callback registered with its layer state, so that the latter can be
+        # removed.
+        self._callbacks = {}
+        self._layer_callbacks = {}
+
+        # Map each layer artist to the set of properties changed for it
+        self._pending = {}
+
+        self._timer = QTimer()
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self.flush)
+
+    def register(self, layer_artist, layer_state, callback):
+        """
+        Call ``callback`` with the names of the changed properties whenever
+        the viewer state or ``layer_state`` change.
+        """
+
+        def layer_changed(**kwargs):
+            self._add_changes(layer_artist, kwargs)
+
+        self._callbacks[layer_artist] = callback
+        self._layer_callbacks[layer_artist] = (layer_state, layer_changed)
+        layer_state.add_global_callback(layer_changed)
+
+    def unregister(self, layer_artist):
+        """
+        Stop updating ``layer_artist`` and discard any pending changes for it.
+        """
+        if layer_artist not in self._callbacks:
+            return
+        self._callbacks.pop(layer_artist)
+        layer_state, layer_changed = self._layer_callbacks.pop(layer_artist)
+        layer_state.remove_global_callback(layer_changed)
+        self._pending.pop(layer_artist, None)
+
+    def _viewer_changed(self, **kwargs):
+        for layer_artist in self._callbacks:
+            self._add_changes(layer_artist, kwargs)
+
+    def _add_changes(self, layer_artist, properties):
+        self._pending.setdefault(layer_artist, set()).update(properties)
+        if not self._timer.isActive():
+            self._timer.start()
+
+    @property
+    def pending(self):
+        """
+        Whether any changes are waiting to be passed to the layer artists.
+        """
+        return len(self._pending) > 0
+
+    def flush(self, *args):
+        """
+        Pass all pending changes to the layer artists.
+        """
+
+        self._timer.stop()
+
+        # The callbacks may change properties in turn, in which case these
+        # are collected again and passed on when the event loop next runs.
+        pending, self._pending = self._pending, {}
+
+        for layer_artist, changed in pending.items():
+            if layer_artist in self._callbacks:
+                self._callbacks[layer_artist](changed)
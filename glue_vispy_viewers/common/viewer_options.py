@@ -30,10 +30,30 @@ class VispyOptionsWidget(QtWidgets.QWidget):
         if not hasattr(viewer_state, 'downsample'):
             self.ui.bool_downsample.hide()
 
+        if hasattr(viewer_state, 'target_fps'):
+            viewer_state.add_callback('downsample', self._update_target_fps_enabled)
+            self._update_target_fps_enabled(viewer_state.downsample)
+        else:
+            self.ui.label_target_fps.hide()
+            self.ui.value_target_fps.hide()
+
         if not hasattr(viewer_state, 'resolution'):
             self.ui.label_resolution.hide()
             self.ui.combosel_resolution.hide()
 
+        if hasattr(viewer_state, 'auto_resolution'):
+            viewer_state.add_callback('auto_resolution', self._update_resolution_enabled)
+            self._update_resolution_enabled(viewer_state.auto_resolution)
+        else:
+            self.ui.bool_auto_resolution.hide()
+
+        if not hasattr(viewer_state, 'precision'):
+            self.ui.label_precision.hide()
+            self.ui.combosel_precision.hide()
+
+        if not hasattr(viewer_state, 'packed'):
+            self.ui.bool_packed.hide()
+
         if not hasattr(viewer_state, 'reference_data'):
             self.ui.label_reference_data.hide()
             self.ui.combosel_reference_data.hide()
@@ -42,3 +62,11 @@ class VispyOptionsWidget(QtWidgets.QWidget):
         self.ui.value_line_width.hide()
 
         self._connections = autoconnect_callbacks_to_qt(viewer_state, self.ui, connect_kwargs)
+
+    def _update_target_fps_enabled(self, downsample):
+        # The target frame rate is only used when downsampling
+        self.ui.value_target_fps.setEnabled(downsample)
+
+    def _update_resolution_enabled(self, auto_resolution):
+        # The resolution can't be changed by hand when chosen automatically
+        self.ui.combosel_resolution.setEnabled(not auto_resolution)
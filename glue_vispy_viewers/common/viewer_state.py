@@ -33,6 +33,7 @@ class Vispy3DViewerState(ViewerState):
     clip_data = CallbackProperty(True)
     native_aspect = CallbackProperty(False)
     line_width = CallbackProperty(1.)
+    show_stats = CallbackProperty(False)
 
     layers = ListCallbackProperty()
 
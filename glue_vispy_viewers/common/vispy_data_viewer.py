@@ -4,7 +4,7 @@ from glue.viewers.common.qt.data_viewer_with_state import DataViewerWithState
 from echo import delay_callback
 
 from qtpy import QtWidgets
-from qtpy.QtCore import Qt
+from qtpy.QtCore import Qt, QTimer
 
 from vispy.util import keys
 
@@ -13,6 +13,7 @@ from .viewer_options import VispyOptionsWidget
 from .toolbar import VispyViewerToolbar
 from .viewer_state import Vispy3DViewerState
 from .compat import update_viewer_state
+from .update_scheduler import LayerUpdateScheduler
 
 BROKEN_PYQT5_MESSAGE = ("The version of PyQt5 you are using does not appear to "
                         "support OpenGL. See <a href='http://docs.glueviz.org/en"
@@ -45,6 +46,13 @@ class BaseVispyViewer(DataViewerWithState):
         self._vispy_widget = VispyWidgetHelper(viewer_state=self.state)
         self.setCentralWidget(self._vispy_widget.canvas.native)
 
+        # Changes to the viewer and layer states are passed on to the layer
+        # artists in batches - any pending changes should be applied before
+        # the canvas is drawn.
+        self._update_scheduler = LayerUpdateScheduler(self.state)
+        self._vispy_widget.canvas.events.draw.connect(self._update_scheduler.flush,
+                                                      position='first')
+
         self.state.add_callback('clip_data', self._update_clip)
         self.state.add_callback('x_min', self._update_clip)
         self.state.add_callback('x_max', self._update_clip)
@@ -55,6 +63,10 @@ class BaseVispyViewer(DataViewerWithState):
 
         self.state.add_callback('line_width', self._update_line_width)
 
+        self.state.add_callback('show_stats', self._update_show_stats)
+        self._vispy_widget.canvas.events.draw.connect(self._report_render_stats,
+                                                      position='last')
+
         self.status_label = None
         self._opengl_ok = None
         self._ready_draw = False
@@ -66,6 +78,56 @@ class BaseVispyViewer(DataViewerWithState):
         viewbox.events.mouse_press.connect(self.camera_mouse_press)
         viewbox.events.mouse_release.connect(self.camera_mouse_release)
 
+        # While the user clicks to drag or uses the mouse wheel (or scrolls on
+        # a trackpad), the visual returned by _downsample_target is drawn
+        # at a lower quality, and drawn at full quality again once the
+        # interaction is done.
+
+        canvas = self._vispy_widget.canvas
+
+        canvas.events.mouse_press.connect(self.mouse_press)
+        canvas.events.mouse_wheel.connect(self.mouse_wheel)
+        canvas.events.mouse_release.connect(self.mouse_release)
+
+        self._downsampled = False
+
+        # For the mouse wheel, we receive discrete events so we need to have
+        # a buffer (for now 250ms) before which we consider the mouse wheel
+        # event to have stopped.
+
+        self._downsample_timer = QTimer()
+        self._downsample_timer.setInterval(250)
+        self._downsample_timer.setSingleShot(True)
+        self._downsample_timer.timeout.connect(self.mouse_release)
+
+    def _downsample_target(self):
+        """
+        Return the visual to downsample while interacting with the viewer, or
+        `None` if there is nothing to downsample. The visual should have
+        ``downsample`` and ``upsample`` methods.
+        """
+        return None
+
+    def mouse_press(self, event=None):
+        target = self._downsample_target()
+        if self.state.downsample and target is not None and not self._downsampled:
+            target.downsample()
+            self._downsampled = True
+
+    def mouse_release(self, event=None):
+        # We don't check the downsample setting here so that turning it off
+        # during an interaction doesn't leave the visual downsampled.
+        target = self._downsample_target()
+        if target is not None and self._downsampled:
+            target.upsample()
+            self._downsampled = False
+
+    def mouse_wheel(self, event=None):
+        self.mouse_press()
+        self._downsample_timer.start()
+        if event is not None:
+            event.handled = True
+
     def paintEvent(self, *args, **kwargs):
         super(BaseVispyViewer, self).paintEvent(*args, **kwargs)
         if self._opengl_ok is None:
@@ -89,6 +151,44 @@ class BaseVispyViewer(DataViewerWithState):
         statusbar = self.statusBar()
         statusbar.showMessage(text)
 
+    @property
+    def render_stats(self):
+        """
+        The :class:`~glue_vispy_viewers.common.render_stats.RenderStats`
+        object recording the time taken by the operations needed to render the
+        viewer.
+        """
+        return self._vispy_widget.stats
+
+    def render_stats_message(self):
+        """
+        Summarize the statistics for the last frame, giving the time taken by
+        each operation and the amount of data processed where relevant.
+        """
+        stats = self.render_stats.by_operation()
+        if len(stats) == 0:
+            return ''
+        parts = []
+        for operation in sorted(stats, key=lambda op: (op != 'frame', op)):
+            count, op_time, nbytes = stats[operation]
+            part = '{0}: {1:.1f} ms'.format(operation, op_time * 1000)
+            if nbytes > 0:
+                part += ' ({0:.1f} MB)'.format(nbytes / 1024 ** 2)
+            parts.append(part)
+        return ', '.join(parts)
+
+    def _update_show_stats(self, *args):
+        # We only wait for the GPU at the end of each frame if the statistics
+        # are shown, since this slows down the rendering.
+        self.render_stats.synchronize = self.state.show_stats
+        self.render_stats.reset()
+        if not self.state.show_stats:
+            self.show_status('')
+
+    def _report_render_stats(self, event=None):
+        if self.state.show_stats:
+            self.show_status(self.render_stats_message())
+
     def _update_clip(self, *args):
         for layer_artist in self._layer_artist_container:
             if self.state.clip_data:
@@ -4,6 +4,7 @@ import numpy as np
 
 from vispy import scene
 from .axes import AxesVisual3D
+from .render_stats import RenderStats
 from ..utils import NestedSTTransform
 
 from matplotlib.colors import ColorConverter
@@ -34,6 +35,13 @@ class VispyWidgetHelper(object):
         self.emulate_texture = (sys.platform == 'win32' and
                                 sys.version_info[0] < 3)
 
+        # The timings and sizes of the operations needed to render the canvas,
+        # which are shared by all the data visuals. Frames start and end with
+        # the draw events of the canvas.
+        self.stats = RenderStats()
+        self.canvas.events.draw.connect(self._start_frame, position='first')
+        self.canvas.events.draw.connect(self._end_frame, position='last')
+
         self.scene_transform = scene.STTransform()
         self.limit_transforms = {}
 
@@ -76,8 +84,16 @@ class VispyWidgetHelper(object):
         self.limit_transforms[visual] = NestedSTTransform()
         self._update_limits()
         visual.transform = self.limit_transforms[visual]
+        if hasattr(visual, 'stats'):
+            visual.stats = self.stats
         self.view.add(visual)
 
+    def _start_frame(self, event=None):
+        self.stats.start_frame()
+
+    def _end_frame(self, event=None):
+        self.stats.end_frame()
+
     def _update_from_state(self, force=False, **props):
 
         if force or 'visible_axes' in props:
@@ -82,14 +82,14 @@ class IsosurfaceLayerArtist(VispyLayerArtist):
         # relative_step_size: ray casting performance, recommond 0.5~1.5)
         self.vispy_widget.add_data_visual(self._iso_visual)
 
-        self._viewer_state.add_global_callback(self._update_volume)
-        self.state.add_global_callback(self._update_volume)
+        # Changes to the viewer and layer state are collected by the viewer
+        # and passed on in one go when the event loop next runs.
+        self._scheduler = vispy_viewer._update_scheduler
+        self._scheduler.register(self, self.state, self._update_volume)
 
-        self.reset_cache()
-
-    def reset_cache(self):
-        self._last_viewer_state = {}
-        self._last_layer_state = {}
+        # Whether all properties should be updated the next time the layer
+        # can be shown, which is the case if it couldn't be shown before.
+        self._full_update = True
 
     @property
     def bbox(self):
@@ -109,6 +109,13 @@ class IsosurfaceLayerArtist(VispyLayerArtist):
         """
         self._iso_visual.parent = None
 
+    def remove(self):
+        """
+        Remove the layer artist for good
+        """
+        self._scheduler.unregister(self)
+        self.clear()
+
     def _update_level(self):
         # TODO: set iso clim
         # self._iso_visual.set_data()
@@ -175,32 +182,14 @@ class IsosurfaceLayerArtist(VispyLayerArtist):
         self._clip_limits = limits
         self._update_data()
 
-    def _update_volume(self, force=False, **kwargs):
+    def _update_volume(self, changed=frozenset(), force=False):
 
         if self.state.attribute is None or self.state.layer is None:
+            self._full_update = True
             return
 
-        # Figure out which attributes are different from before. Ideally we shouldn't
-        # need this but currently this method is called multiple times if an
-        # attribute is changed due to x_att changing then hist_x_min, hist_x_max, etc.
-        # If we can solve this so that _update_histogram is really only called once
-        # then we could consider simplifying this. Until then, we manually keep track
-        # of which properties have changed.
-
-        changed = set()
-
-        if not force:
-
-            for key, value in self._viewer_state.as_dict().items():
-                if value != self._last_viewer_state.get(key, None):
-                    changed.add(key)
-
-            for key, value in self.state.as_dict().items():
-                if value != self._last_layer_state.get(key, None):
-                    changed.add(key)
-
-        self._last_viewer_state.update(self._viewer_state.as_dict())
-        self._last_layer_state.update(self.state.as_dict())
+        force = force or self._full_update
+        self._full_update = False
 
         if force or len(changed & DATA_PROPERTIES) > 0:
             self._update_data()
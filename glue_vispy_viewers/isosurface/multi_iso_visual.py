@@ -37,11 +37,14 @@
 # file in this repository.
 
 
+import time
+
 from vispy.gloo import Texture3D, TextureEmulated3D, VertexBuffer, IndexBuffer
 from vispy.visuals.volume import VolumeVisual, Visual
 from vispy.scene.visuals import create_visual_node
 
 import numpy as np
+from ..common.render_stats import RenderStats
 from ..volume.shaders import VERT_SHADER
 from vispy.color import get_colormap
 
@@ -294,6 +297,9 @@ class MultiIsoVisual(VolumeVisual):
         self._clim = None
         self._need_vertex_update = True
 
+        # Timings and sizes of the uploads and draws
+        self.stats = RenderStats()
+
         # Set the colormap
         self._cmap = get_colormap(cmap)
         # self._cmap = TransGrays()
@@ -355,5 +361,15 @@ class MultiIsoVisual(VolumeVisual):
             self.freeze()
         self.update()
 
+    def set_data(self, vol, clim=None, copy=True):
+        start = time.perf_counter()
+        super(MultiIsoVisual, self).set_data(vol, clim=clim, copy=copy)
+        self.stats.record('upload', time.perf_counter() - start, nbytes=self._last_data.nbytes)
+
+    def draw(self):
+        start = time.perf_counter()
+        super(MultiIsoVisual, self).draw()
+        self.stats.record('draw', time.perf_counter() - start)
+
 
 MultiIsoVisual = create_visual_node(MultiIsoVisual)
@@ -1,17 +1,20 @@
 import uuid
+import weakref
 
 import numpy as np
 
+from glue.core.data import Subset
 from glue.core.exceptions import IncompatibleAttribute
 from glue.utils import categorical_ndarray
 
-from .multi_scatter import MultiColorScatter
+from .multi_scatter import MultiColorScatter, lod_ranks
 from .layer_state import ScatterLayerState
 from ..common.layer_artist import VispyLayerArtist
 
-COLOR_PROPERTIES = set(['color_mode', 'cmap_attribute', 'cmap_vmin', 'cmap_vmax', 'cmap', 'color'])
-SIZE_PROPERTIES = set(['size_mode', 'size_attribute', 'size_vmin', 'size_vmax',
-                       'size_scaling', 'size'])
+COLOR_PROPERTIES = set(['color_mode', 'cmap_attribute', 'color'])
+CMAP_PROPERTIES = set(['cmap_vmin', 'cmap_vmax', 'cmap'])
+SIZE_PROPERTIES = set(['size_mode', 'size_attribute', 'size'])
+SIZE_MAPPING_PROPERTIES = set(['size_vmin', 'size_vmax', 'size_scaling'])
 ERROR_PROPERTIES = set(['xerr_visible', 'yerr_visible', 'zerr_visible',
                         'xerr_attribute', 'yerr_attribute', 'zerr_attribute'])
 VECTOR_PROPERTIES = set(['vector_visible', 'vx_attribute', 'vy_attribute', 'vz_attribute',
@@ -21,6 +24,10 @@ ALPHA_PROPERTIES = set(['alpha'])
 DATA_PROPERTIES = set(['layer', 'x_att', 'y_att', 'z_att'])
 VISIBLE_PROPERTIES = set(['visible'])
 
+# The random ordering of the points of each dataset, which is shared by the
+# layer artists for the dataset and its subsets.
+LOD_RANKS = weakref.WeakKeyDictionary()
+
 
 class ScatterLayerArtist(VispyLayerArtist):
     """
@@ -31,8 +38,6 @@ class ScatterLayerArtist(VispyLayerArtist):
 
         super(ScatterLayerArtist, self).__init__(layer)
 
-        self._clip_limits = None
-
         # Set data caches
         self._marker_data = None
         self._color_data = None
@@ -71,16 +76,15 @@ class ScatterLayerArtist(VispyLayerArtist):
         self._multiscat.allocate(self.id)
         self._multiscat.set_zorder(self.id, self.get_zorder)
 
-        # Watch for changes in the viewer state which would require the
-        # layers to be redrawn
-        self._viewer_state.add_global_callback(self._update_scatter)
-        self.state.add_global_callback(self._update_scatter)
-
-        self.reset_cache()
+        # Watch for changes in the viewer and layer state which would require
+        # the layers to be redrawn - the changes are collected by the viewer
+        # and passed on in one go when the event loop next runs.
+        self._scheduler = vispy_viewer._update_scheduler
+        self._scheduler.register(self, self.state, self._update_scatter)
 
-    def reset_cache(self):
-        self._last_viewer_state = {}
-        self._last_layer_state = {}
+        # Whether all properties should be updated the next time the layer
+        # can be shown, which is the case if it couldn't be shown before.
+        self._full_update = True
 
     @property
     def visual(self):
@@ -122,26 +126,27 @@ class ScatterLayerArtist(VispyLayerArtist):
         self._multiscat.deallocate(self.id)
         self._multiscat = None
 
-        self._viewer_state.remove_global_callback(self._update_scatter)
-        self.state.remove_global_callback(self._update_scatter)
+        self._scheduler.unregister(self)
 
     def _update_sizes(self):
         if self.state.size_mode is None:
             pass
         elif self.state.size_mode == 'Fixed':
-            self._multiscat.set_size(self.id, self.state.size * self.state.size_scaling)
+            self._update_size_mapping()
+            self._multiscat.set_size(self.id, self.state.size)
         else:
             data = self.layer[self.state.size_attribute].ravel()
             if isinstance(data, categorical_ndarray):
                 data = data.codes
-            if self.state.size_vmax == self.state.size_vmin:
-                size = np.ones(data.shape) * 10
-            else:
-                size = (20 * (data - self.state.size_vmin) /
-                        (self.state.size_vmax - self.state.size_vmin))
-            size_data = size * self.state.size_scaling
-            size_data[np.isnan(data)] = 0.
-            self._multiscat.set_size(self.id, size_data)
+            # The sizes are computed on the GPU, so the values only need to be
+            # uploaded again if the attribute changes.
+            self._update_size_mapping()
+            self._multiscat.set_size_values(self.id, data)
+
+    def _update_size_mapping(self):
+        if self.state.size_mode == 'Linear':
+            self._multiscat.set_size_limits(self.id, self.state.size_vmin, self.state.size_vmax)
+        self._multiscat.set_size_scaling(self.id, self.state.size_scaling)
 
     def _update_colors(self):
         if self.state.color_mode is None:
@@ -152,14 +157,14 @@ class ScatterLayerArtist(VispyLayerArtist):
             data = self.layer[self.state.cmap_attribute].ravel()
             if isinstance(data, categorical_ndarray):
                 data = data.codes
-            if self.state.cmap_vmax == self.state.cmap_vmin:
-                cmap_data = np.ones(data.shape) * 0.5
-            else:
-                cmap_data = ((data - self.state.cmap_vmin) /
-                             (self.state.cmap_vmax - self.state.cmap_vmin))
-            cmap_data = self.state.cmap(cmap_data)
-            cmap_data[:, 3][np.isnan(data)] = 0.
-            self._multiscat.set_color(self.id, cmap_data)
+            # The colormap is applied on the GPU, so the values only need to
+            # be uploaded again if the attribute changes.
+            self._update_cmap()
+            self._multiscat.set_cmap_values(self.id, data)
+
+    def _update_cmap(self):
+        self._multiscat.set_cmap_limits(self.id, self.state.cmap_vmin, self.state.cmap_vmax)
+        self._multiscat.set_cmap(self.id, self.state.cmap)
 
     def _update_alpha(self):
         self._multiscat.set_alpha(self.id, self.state.alpha)
@@ -189,31 +194,30 @@ class ScatterLayerArtist(VispyLayerArtist):
 
         self._multiscat.set_data_values(self.id, x, y, z)
 
-        # Mask points outside the clip limits
-        if self._clip_limits is None:
-            self._multiscat.set_mask(self.id, None)
-        else:
+        self._update_lod()
 
-            xmin, xmax, ymin, ymax, zmin, zmax = self._clip_limits
+        self.redraw()
 
-            if xmin <= xmax:
-                keep = (x >= xmin) & (x <= xmax)
-            else:
-                keep = (x <= xmin) & (x >= xmax)
+    def _update_lod(self):
 
-            if ymin <= ymax:
-                keep &= (y >= ymin) & (y <= ymax)
-            else:
-                keep &= (y <= ymin) & (y >= ymax)
+        # The points drawn while the viewer is downsampled are picked using
+        # the ranks of the points in the parent dataset, so that subsets show
+        # the same points as the dataset.
 
-            if zmin <= zmax:
-                keep &= (z >= zmin) & (z <= zmax)
-            else:
-                keep &= (z <= zmin) & (z >= zmax)
+        data = self.layer.data
 
-            self._multiscat.set_mask(self.id, keep)
+        if data.size <= self._multiscat.lod_points:
+            self._multiscat.set_lod_ranks(self.id, None, 0)
+            return
 
-        self.redraw()
+        ranks = LOD_RANKS.get(data)
+        if ranks is None or len(ranks) != data.size:
+            ranks = LOD_RANKS[data] = lod_ranks(data.size)
+
+        if isinstance(self.layer, Subset):
+            ranks = ranks[self.layer.to_mask().ravel()]
+
+        self._multiscat.set_lod_ranks(self.id, ranks, data.size)
 
     def _update_errors(self):
         orig_points = self._multiscat.layers[self.id]['data']
@@ -282,38 +286,23 @@ class ScatterLayerArtist(VispyLayerArtist):
         return tuple(np.array([dmin, dmax]).transpose().ravel())
 
     def set_clip(self, limits):
-        self._clip_limits = limits
-        self._update_data()
+        # The points outside the clipping box are hidden in the shaders, so
+        # the data doesn't need to be uploaded again. The clipping box is
+        # the same for all layers in the viewer.
+        if self._multiscat is not None:
+            self._multiscat.set_clip(limits)
 
-    def _update_scatter(self, force=False, **kwargs):
+    def _update_scatter(self, changed=frozenset(), force=False):
 
         if (self._viewer_state.x_att is None or
             self._viewer_state.y_att is None or
             self._viewer_state.z_att is None or
                 self.state.layer is None):
+            self._full_update = True
             return
 
-        # Figure out which attributes are different from before. Ideally we shouldn't
-        # need this but currently this method is called multiple times if an
-        # attribute is changed due to x_att changing then hist_x_min, hist_x_max, etc.
-        # If we can solve this so that _update_histogram is really only called once
-        # then we could consider simplifying this. Until then, we manually keep track
-        # of which properties have changed.
-
-        changed = set()
-
-        if not force:
-
-            for key, value in self._viewer_state.as_dict().items():
-                if value != self._last_viewer_state.get(key, None):
-                    changed.add(key)
-
-            for key, value in self.state.as_dict().items():
-                if value != self._last_layer_state.get(key, None):
-                    changed.add(key)
-
-        self._last_viewer_state.update(self._viewer_state.as_dict())
-        self._last_layer_state.update(self.state.as_dict())
+        force = force or self._full_update
+        self._full_update = False
 
         if force or len(changed & DATA_PROPERTIES) > 0:
             self._update_data()
@@ -321,6 +310,8 @@ class ScatterLayerArtist(VispyLayerArtist):
 
         if force or len(changed & SIZE_PROPERTIES) > 0:
             self._update_sizes()
+        elif len(changed & SIZE_MAPPING_PROPERTIES) > 0 and self.state.size_mode is not None:
+            self._update_size_mapping()
 
         if force or len(changed & ERROR_PROPERTIES) > 0:
             self._update_errors()
@@ -330,6 +321,8 @@ class ScatterLayerArtist(VispyLayerArtist):
 
         if force or len(changed & COLOR_PROPERTIES) > 0:
             self._update_colors()
+        elif len(changed & CMAP_PROPERTIES) > 0 and self.state.color_mode == 'Linear':
+            self._update_cmap()
 
         if force or len(changed & ALPHA_PROPERTIES) > 0:
             self._update_alpha()
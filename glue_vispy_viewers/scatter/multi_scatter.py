@@ -1,26 +1,224 @@
+import time
 from contextlib import contextmanager
 
 import numpy as np
 
 from matplotlib.colors import ColorConverter
 
-from vispy import scene
-from vispy.scene.visuals import Arrow
+from glue.logger import logger
 
+from vispy.gloo import Texture2D, VertexBuffer
+from vispy.visuals import Visual
+from vispy.visuals.filters.clipping_planes import PlanesClipper
+from vispy.scene.visuals import Arrow, create_visual_node
 
-class MultiColorScatter(scene.visuals.Markers):
+from ..common.colors import CMAP_LUT_SIZE, clim_transform, get_colormap_lut
+from ..common.render_stats import RenderStats
+
+__all__ = ['MultiColorScatter', 'lod_ranks']
+
+# Value used in place of NaN values for the colormapped and size attributes.
+# Since the values are normalized before being uploaded, this is far below any
+# value that can be shown.
+NAN_VALUE = -1e30
+
+# The size of the points for values at the upper size limit, before scaling
+SIZE_RANGE = 20.
+
+# The seed used for the random ordering of the points of each dataset
+LOD_SEED = 12345
+
+
+def lod_ranks(n_points):
+    """
+    Return the rank of each of ``n_points`` points in a random ordering of
+    the points. The same ranks are returned for a given number of points.
+    """
+    return np.random.RandomState(LOD_SEED).permutation(n_points)
+
+
+def rank_order(ranks, n_ranks):
+    """
+    Return the indices that sort ``ranks``, which should be unique integers
+    smaller than ``n_ranks``, as well as the sorted ranks.
+    """
+    # This scales with the number of ranks rather than as n log n with the
+    # number of points, which matters for large datasets.
+    index = np.zeros(n_ranks, dtype=np.intp)
+    present = np.zeros(n_ranks, dtype=bool)
+    index[ranks] = np.arange(len(ranks))
+    present[ranks] = True
+    sorted_ranks = np.nonzero(present)[0]
+    return index[sorted_ranks], sorted_ranks
+
+
+# The shaders below draw each point as a disc, in the same way as the 'disc'
+# symbol of the VisPy Markers visual does. The alpha of each layer, the
+# colormapping and the size mapping are applied in the shaders so that changing
+# these doesn't require any data to be uploaded. The values used for the
+# colormapping are normalized using the limits at the time they were uploaded,
+# and u_cmap_transform gives the scale and offset needed to normalize them using
+# the current limits. Likewise, u_size_transform gives the scale and offset
+# needed to convert the size attribute to sizes in pixels. Points outside the
+# clipping box, given in data coordinates by u_clip_min and u_clip_max, are
+# not shown.
+
+VERT_SHADER = """#version 120
+uniform float u_antialias;
+uniform float u_px_scale;
+uniform float u_edge_width;
+uniform vec2 u_cmap_transform;
+uniform vec2 u_size_transform;
+uniform bool u_clip;
+uniform vec3 u_clip_min;
+uniform vec3 u_clip_max;
+
+attribute vec3 a_position;
+attribute vec4 a_color;
+attribute float a_size;
+attribute float a_cmap_value;
+
+varying vec4 v_color;
+varying float v_cmap_value;
+varying float v_size;
+varying float v_edge_width;
+
+void main (void) {
+
+    v_color = a_color;
+
+    if (a_cmap_value < -1e29) {
+        v_cmap_value = -1.;
+    } else {
+        v_cmap_value = clamp(a_cmap_value * u_cmap_transform.x + u_cmap_transform.y, 0., 1.);
+    }
+
+    // Points with NaN sizes or outside the clipping box are not shown
+    bool clipped = u_clip && (any(lessThan(a_position, u_clip_min)) ||
+                              any(greaterThan(a_position, u_clip_max)));
+
+    if (clipped || a_size < -1e29) {
+        v_size = 0.;
+    } else {
+        v_size = (a_size * u_size_transform.x + u_size_transform.y) * u_px_scale;
+    }
+    v_edge_width = u_edge_width * u_px_scale;
+
+    gl_Position = $transform(vec4(a_position, 1));
+
+    // gl_PointSize is the diameter, including the edge and antialiasing
+    gl_PointSize = v_size + 4. * (v_edge_width + 1.5 * u_antialias);
+
+}
+"""
+
+FRAG_SHADER = """#version 120
+uniform float u_antialias;
+uniform float u_alpha;
+uniform bool u_colormap;
+uniform sampler2D u_cmap;
+uniform float u_cmap_size;
+
+varying vec4 v_color;
+varying float v_cmap_value;
+varying float v_size;
+varying float v_edge_width;
+
+void main() {
+
+    if (v_size <= 0.)
+        discard;
+
+    float size = v_size + 4. * (v_edge_width + 1.5 * u_antialias);
+
+    // Distance in pixels from the edge of the disc
+    float r = length((gl_PointCoord.xy - vec2(0.5, 0.5)) * size) - v_size / 2.;
+
+    float edge = 0.5 * v_edge_width;
+
+    if (r > edge + u_antialias)
+        discard;
+
+    float alpha = 1. - smoothstep(edge - u_antialias, edge + u_antialias, r);
+
+    vec4 color;
+
+    if (u_colormap) {
+        // NaN values are not shown
+        if (v_cmap_value < 0.)
+            discard;
+        float x = (v_cmap_value * (u_cmap_size - 1.) + 0.5) / u_cmap_size;
+        color = texture2D(u_cmap, vec2(x, 0.5));
+    } else {
+        color = v_color;
+    }
+
+    gl_FragColor = vec4(color.rgb, color.a * u_alpha * alpha);
+
+}
+"""
+
+
+class MultiColorScatterVisual(Visual):
     """
     This is a helper class to make it easier to show multiple markers at
     specific positions and control exactly which marker should be on top of
     which.
+
+    Each layer has its own vertex buffers on the GPU, and the layers are
+    drawn one after the other in order of zorder. When a property of a layer
+    changes, only the buffers of that layer that depend on the property are
+    uploaded again, and this only happens when the visual is next drawn.
+
+    While the visual is downsampled, for example while interacting with the
+    viewer, at most around ``lod_points`` points are drawn in total. Points
+    are then drawn in a random order set with `set_lod_ranks`, and the
+    buffers are sorted in that order so that only the first points in each
+    buffer need to be drawn.
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, antialias=1., edge_width=1., lod_points=1000000):
+
         self.layers = {}
-        self._combined_data = None
         self._skip_update = False
         self._error_vector_widget = None
-        super(MultiColorScatter, self).__init__(*args, **kwargs)
+
+        # The error bars and vectors of all layers are combined, so we keep
+        # track of whether the 'positions' or only the 'colors' of the lines
+        # need to be updated rather than combining them again every time.
+        self._lines_dirty = set()
+
+        self.lod_points = lod_points
+        self._downsampled = False
+
+        # The error bars and vectors are clipped in the fragment shader, using
+        # clipping planes given in data coordinates.
+        self._line_clipper = PlanesClipper(coord_system='visual')
+
+        # Timings and sizes of the uploads and draws - this is replaced by the
+        # statistics for the whole canvas when the visual is added to a viewer.
+        self.stats = RenderStats()
+
+        Visual.__init__(self, vcode=VERT_SHADER, fcode=FRAG_SHADER)
+
+        self.shared_program['u_antialias'] = antialias
+        self.shared_program['u_edge_width'] = edge_width
+        self.shared_program['u_alpha'] = 1.
+        self.shared_program['u_cmap_size'] = float(CMAP_LUT_SIZE)
+        self.shared_program['u_clip'] = False
+        self.shared_program['u_clip_min'] = 0., 0., 0.
+        self.shared_program['u_clip_max'] = 1., 1., 1.
+
+        # The colormap texture used for layers that don't have a colormap set
+        self._default_cmap = Texture2D(np.zeros((1, CMAP_LUT_SIZE, 4), dtype=np.float32),
+                                       interpolation='linear', wrapping='clamp_to_edge',
+                                       internalformat='rgba32f')
+
+        self.set_gl_state(depth_test=True, blend=True,
+                          blend_func=('src_alpha', 'one_minus_src_alpha'))
+        self._draw_mode = 'points'
+
+        self.freeze()
 
     @contextmanager
     def delay_update(self):
@@ -41,158 +239,396 @@ class MultiColorScatter(scene.visuals.Markers):
                                   'alpha': 1.,
                                   'zorder': lambda: 0,
                                   'size': 10,
-                                  'visible': True}
+                                  'size_values': None,
+                                  'size_limits': (0., 1.),
+                                  'size_ref_limits': None,
+                                  'size_scaling': 1.,
+                                  'visible': True,
+                                  'cmap_values': None,
+                                  'cmap_limits': (0., 1.),
+                                  'cmap_ref_limits': None,
+                                  'cmap_lut': None,
+                                  'cmap_texture': None,
+                                  'lod_ranks': None,
+                                  'lod_n_ranks': 0,
+                                  'lod_order': None,
+                                  'lod_sorted_ranks': None,
+                                  'n_points': 0,
+                                  'buffers': {},
+                                  'dirty': set()}
 
     def deallocate(self, label):
+        self._set_lines_dirty(label, 'positions')
         self.layers.pop(label)
         self._update()
 
+    def _set_dirty(self, label, *attributes):
+        self.layers[label]['dirty'].update(attributes)
+
+    def _set_lines_dirty(self, label, what):
+        # Only layers with error bars or vectors affect the lines
+        if self._has_lines(self.layers[label]):
+            self._lines_dirty.add(what)
+
+    def _update_n_points(self, label):
+        layer = self.layers[label]
+        if layer['data'] is None:
+            layer['n_points'] = 0
+        elif layer['mask'] is None:
+            layer['n_points'] = layer['data'].shape[0]
+        else:
+            layer['n_points'] = int(np.sum(layer['mask']))
+
     def set_data_values(self, label, x, y, z):
         """
         Set the position of the datapoints
         """
-        # TODO: avoid re-allocating an array every time
-        self.layers[label]['data'] = np.array([x, y, z]).transpose()
+        self.layers[label]['data'] = np.array([x, y, z], dtype=np.float32).transpose()
+        self._update_n_points(label)
+        self._set_dirty(label, 'position')
+        self._set_lines_dirty(label, 'positions')
         self._update()
 
     def set_visible(self, label, visible):
         self.layers[label]['visible'] = visible
+        self._set_lines_dirty(label, 'positions')
         self._update()
 
     def set_mask(self, label, mask):
         self.layers[label]['mask'] = mask
+        self._update_n_points(label)
+        self._set_dirty(label, 'position', 'color', 'size', 'cmap_values')
+        self._set_lines_dirty(label, 'positions')
         self._update()
 
+    def set_clip(self, limits):
+        """
+        Set the clipping box for all layers in data coordinates, as
+        ``(x_min, x_max, y_min, y_max, z_min, z_max)``, or `None` to show all
+        points. The limits along each axis can be given in either order.
+        """
+        if limits is None:
+            self.shared_program['u_clip'] = False
+            self._line_clipper.clipping_planes = None
+        else:
+            lower = tuple(float(min(limits[i], limits[i + 1])) for i in (0, 2, 4))
+            upper = tuple(float(max(limits[i], limits[i + 1])) for i in (0, 2, 4))
+            self.shared_program['u_clip'] = True
+            self.shared_program['u_clip_min'] = lower
+            self.shared_program['u_clip_max'] = upper
+            # Each plane is given by a point and a normal pointing inside the box
+            planes = []
+            for axis in range(3):
+                normal = np.zeros(3)
+                normal[axis] = 1
+                planes.append((lower, normal))
+                planes.append((upper, -normal))
+            self._line_clipper.clipping_planes = np.array(planes)
+        self.update()
+
     def set_errors(self, label, error_lines):
+        # The lines need to be updated if the layer had lines before or has
+        # lines now
+        self._set_lines_dirty(label, 'positions')
         self.layers[label]['errors'] = error_lines
+        self._set_lines_dirty(label, 'positions')
         self._update()
 
     def set_vectors(self, label, vectors):
+        # The lines need to be updated if the layer had lines before or has
+        # lines now
+        self._set_lines_dirty(label, 'positions')
         self.layers[label]['vectors'] = vectors
+        self._set_lines_dirty(label, 'positions')
         self._update()
 
     def set_draw_arrows(self, label, draw_arrows):
         self.layers[label]['draw_arrows'] = draw_arrows
+        self._set_lines_dirty(label, 'positions')
         self._update()
 
     def set_size(self, label, size):
         if not np.isscalar(size) and size.ndim > 1:
             raise Exception("size should be a 1-d array")
         self.layers[label]['size'] = size
+        self.layers[label]['size_values'] = None
+        self._set_dirty(label, 'size')
+        self._update()
+
+    def set_size_values(self, label, values):
+        """
+        Set the sizes of the points of a layer by mapping the given values
+        linearly between the limits set with `set_size_limits`, such that
+        points at the lower and upper limits have sizes of 0 and 20 times the
+        scaling set with `set_size_scaling`. The values are only uploaded when
+        they change, while the limits and scaling can be changed without
+        uploading any data.
+        """
+        self.layers[label]['size_values'] = np.asarray(values)
+        self._set_dirty(label, 'size')
+        self._update()
+
+    def set_size_limits(self, label, vmin, vmax):
+        self.layers[label]['size_limits'] = (float(vmin), float(vmax))
+        self._update()
+
+    def set_size_scaling(self, label, scaling):
+        self.layers[label]['size_scaling'] = float(scaling)
         self._update()
 
     def set_color(self, label, rgb):
         if isinstance(rgb, str):
             rgb = ColorConverter().to_rgb(rgb)
         self.layers[label]['color'] = np.asarray(rgb)
+        self.layers[label]['cmap_values'] = None
+        self._set_dirty(label, 'color', 'cmap_values')
+        self._set_lines_dirty(label, 'colors')
+        self._update()
+
+    def set_cmap_values(self, label, values):
+        """
+        Color the points of a layer using the colormap set with `set_cmap`,
+        given the values to map for each point. The values are only uploaded
+        when they change, while the limits and colormap can be changed
+        without uploading any data.
+        """
+        self.layers[label]['cmap_values'] = np.asarray(values)
+        self._set_dirty(label, 'cmap_values')
+        self._set_lines_dirty(label, 'colors')
+        self._update()
+
+    def set_cmap_limits(self, label, vmin, vmax):
+        self.layers[label]['cmap_limits'] = (float(vmin), float(vmax))
+        self._set_lines_dirty(label, 'colors')
+        self._update()
+
+    def set_cmap(self, label, cmap):
+        self.layers[label]['cmap_lut'] = get_colormap_lut(cmap, size=CMAP_LUT_SIZE)
+        self._set_dirty(label, 'cmap')
+        self._set_lines_dirty(label, 'colors')
+        self._update()
+
+    def set_lod_ranks(self, label, ranks, n_ranks):
+        """
+        Set the rank of each point of a layer in a random ordering of
+        ``n_ranks`` points, or `None` to always draw all points. While
+        downsampled, the points drawn for all layers are those with ranks
+        below the same fraction of ``n_ranks``, so that a subset given the
+        ranks of its points in the parent dataset shows the points that are
+        also shown for the dataset.
+        """
+        if ranks is self.layers[label]['lod_ranks']:
+            return
+        self.layers[label]['lod_ranks'] = None if ranks is None else np.asarray(ranks)
+        self.layers[label]['lod_n_ranks'] = n_ranks
+        self._set_dirty(label, 'position', 'color', 'size', 'cmap_values')
         self._update()
 
+    def downsample(self):
+        """
+        Only draw a random sample of the points until `upsample` is called.
+        """
+        self._downsampled = True
+        self.update()
+
+    def upsample(self):
+        self._downsampled = False
+        self.update()
+
     def set_alpha(self, label, alpha):
         self.layers[label]['alpha'] = alpha
+        self._set_lines_dirty(label, 'colors')
         self._update()
 
     def set_zorder(self, label, zorder):
         self.layers[label]['zorder'] = zorder
+        self._set_lines_dirty(label, 'positions')
         self._update()
 
     def update_line_width(self, width):
         if self._error_vector_widget:
             self._error_vector_widget.set_data(width=width)
 
+    def _sorted_layers(self):
+        return sorted(self.layers, key=lambda x: self.layers[x]['zorder']())
+
+    def _is_shown(self, layer):
+        return layer['visible'] and layer['n_points'] > 0
+
+    @staticmethod
+    def _has_lines(layer):
+        return layer['errors'] is not None or layer['vectors'] is not None
+
+    def _masked(self, layer, values):
+        if layer['mask'] is None:
+            return values
+        else:
+            return values[layer['mask']]
+
+    def _ordered(self, layer, values):
+        # The values to upload, in the order in which the points are drawn
+        values = self._masked(layer, values)
+        if layer['lod_order'] is None:
+            return values
+        else:
+            return values[layer['lod_order']]
+
+    def _update_lod_order(self, layer):
+        ranks = layer['lod_ranks']
+        if ranks is None or layer['data'] is None or len(ranks) != len(layer['data']):
+            layer['lod_order'] = layer['lod_sorted_ranks'] = None
+        else:
+            layer['lod_order'], layer['lod_sorted_ranks'] = \
+                rank_order(self._masked(layer, ranks), layer['lod_n_ranks'])
+
+    def _lod_fraction(self):
+        # The fraction of the points to draw for layers with an ordering
+        if not self._downsampled:
+            return 1.
+        n_points = sum(layer['n_points'] for layer in self.layers.values()
+                       if self._is_shown(layer) and layer['lod_order'] is not None)
+        if n_points <= self.lod_points:
+            return 1.
+        return self.lod_points / n_points
+
+    def _n_drawn(self, layer, fraction):
+        # The number of points to draw for a layer - since the buffers are
+        # sorted by rank, these are the first points in the buffers.
+        if fraction >= 1 or layer['lod_sorted_ranks'] is None:
+            return layer['n_points']
+        threshold = fraction * layer['lod_n_ranks']
+        return int(np.searchsorted(layer['lod_sorted_ranks'], threshold))
+
+    @staticmethod
+    def _normalize(values, limits):
+        # Normalize the values so that the limits map to 0 and 1 - if the
+        # limits are the same, the values are only shifted.
+        vmin, vmax = limits
+        scale = 1. if vmax == vmin else vmax - vmin
+        normalized = (values - vmin) / scale
+        normalized[np.isnan(normalized)] = NAN_VALUE
+        return normalized
+
+    @staticmethod
+    def _limits_transform(ref_limits, limits):
+        # Values normalized with equal limits were only shifted, see _normalize
+        if ref_limits[0] == ref_limits[1]:
+            ref_limits = (ref_limits[0], ref_limits[0] + 1.)
+        return clim_transform(ref_limits, limits)
+
+    def _cmap_transform(self, layer):
+        vmin, vmax = layer['cmap_limits']
+        if vmin == vmax:
+            # All points are shown with the color in the middle of the colormap
+            return 0., 0.5
+        return self._limits_transform(layer['cmap_ref_limits'], layer['cmap_limits'])
+
+    def _size_transform(self, layer):
+        scaling = layer['size_scaling']
+        if layer['size_values'] is None:
+            return scaling, 0.
+        vmin, vmax = layer['size_limits']
+        if vmin == vmax:
+            # All points are shown with half the maximum size
+            return 0., 0.5 * SIZE_RANGE * scaling
+        scale, offset = self._limits_transform(layer['size_ref_limits'], layer['size_limits'])
+        return SIZE_RANGE * scaling * scale, SIZE_RANGE * scaling * offset
+
+    def _layer_rgba(self, layer, n_points):
+        if layer['cmap_values'] is not None and layer['cmap_lut'] is not None:
+            # The colors are only needed on the CPU for the error bars and
+            # vectors, so we compute them here rather than keeping them.
+            values = self._masked(layer, layer['cmap_values'].astype(float))
+            vmin, vmax = layer['cmap_limits']
+            if vmin == vmax:
+                normalized = np.full(values.shape, 0.5)
+            else:
+                normalized = np.clip((values - vmin) / (vmax - vmin), 0, 1)
+            indices = np.nan_to_num(normalized * (CMAP_LUT_SIZE - 1)).round().astype(int)
+            rgba = layer['cmap_lut'][indices]
+            rgba[np.isnan(values), 3] = 0.
+        elif layer['color'].ndim == 1:
+            rgba = np.hstack([layer['color'][:3], 1])
+            rgba = np.repeat(rgba, n_points).reshape(4, -1).transpose()
+        else:
+            rgba = self._masked(layer, layer['color']).copy()
+        rgba[:, 3] *= layer['alpha']
+        return rgba
+
     def _update(self):
 
         if self._skip_update:
             return
 
-        data = []
-        colors = []
-        sizes = []
-        lines = []
+        self.visible = any(self._is_shown(layer) for layer in self.layers.values())
+
+        # The lines are hidden along with the visual, so they are only updated
+        # once the visual is visible again.
+        if self.visible and self._lines_dirty:
+            if 'positions' in self._lines_dirty:
+                self._update_lines()
+            else:
+                self._update_line_colors()
+            self._lines_dirty.clear()
+
+        self.update()
+
+    def _line_layers(self):
+        # The layers for which error bars or vectors are drawn, in order
+        return [self.layers[label] for label in self._sorted_layers()
+                if self._is_shown(self.layers[label]) and self._has_lines(self.layers[label])]
+
+    def _line_colors(self):
+
         line_colors = []
-        arrows = []
         arrow_colors = []
 
-        for label in sorted(self.layers, key=lambda x: self.layers[x]['zorder']()):
+        for layer in self._line_layers():
 
-            layer = self.layers[label]
+            rgba = self._layer_rgba(layer, layer['n_points'])
 
-            if not layer['visible'] or layer['data'] is None:
-                continue
+            n_sets = 0 if layer['errors'] is None else len(layer['errors'])
+            if layer['vectors'] is not None:
+                n_sets += 1
+                if layer['draw_arrows']:
+                    arrow_colors.append(rgba)
 
-            input_points = layer['data'].shape[0]
-            if layer['mask'] is None:
-                n_points = input_points
-            else:
-                n_points = np.sum(layer['mask'])
-
-            if input_points > 0 and n_points > 0:
-
-                # Data
-
-                if layer['mask'] is None:
-                    data.append(layer['data'])
-                else:
-                    data.append(layer['data'][layer['mask'], :])
-
-                # Colors
-
-                if layer['color'].ndim == 1:
-                    rgba = np.hstack([layer['color'], 1])
-                    rgba = np.repeat(rgba, n_points).reshape(4, -1).transpose()
-                else:
-                    if layer['mask'] is None:
-                        rgba = layer['color'].copy()
-                    else:
-                        rgba = layer['color'][layer['mask']]
-
-                rgba[:, 3] *= layer['alpha']
-
-                colors.append(rgba)
-
-                # Sizes
-
-                if np.isscalar(layer['size']):
-                    size = np.repeat(layer['size'], n_points)
-                else:
-                    if layer['mask'] is None:
-                        size = layer['size']
-                    else:
-                        size = layer['size'][layer['mask']]
-                sizes.append(size)
-
-                # Error bar and colors
-                if layer['errors'] is not None:
-                    for error_set in layer['errors']:
-                        if layer['mask'] is None:
-                            out = error_set
-                        else:
-                            out = error_set[layer['mask']]
-                        out = out.reshape((-1, 3))
-                        lines.append(out)
-                        line_colors.append(np.repeat(rgba, 2, axis=0))
-
-                if layer['vectors'] is not None:
-                    if layer['mask'] is None:
-                        out = layer['vectors']
-                    else:
-                        out = layer['vectors'][layer['mask']]
-                    lines.append(out.reshape((-1, 3)))
-                    line_colors.append(np.repeat(rgba, 2, axis=0))
-                    if layer['draw_arrows']:
-                        arrows.append(out)
-                        arrow_colors.append(rgba)
-
-        if len(data) == 0:
-            self.visible = False
+            line_colors.extend([np.repeat(rgba, 2, axis=0)] * n_sets)
+
+        arrow_colors = np.vstack(arrow_colors) if len(arrow_colors) else np.array([])
+
+        return line_colors, arrow_colors
+
+    def _update_line_colors(self):
+
+        if self._error_vector_widget is None or not self._error_vector_widget.visible:
             return
-        else:
-            self.visible = True
 
-        data = np.vstack(data)
-        colors = np.vstack(colors)
-        sizes = np.hstack(sizes)
+        line_colors, arrow_colors = self._line_colors()
+        self._error_vector_widget.set_data(color=np.vstack(line_colors))
+        self._error_vector_widget.arrow_color = arrow_colors
+
+    def _update_lines(self):
+
+        # The error bars and vectors are drawn with a single visual for all
+        # layers, so these are combined here.
+
+        lines = []
+        arrows = []
+
+        for layer in self._line_layers():
 
-        self.set_data(data, edge_color=colors, face_color=colors, size=sizes)
+            if layer['errors'] is not None:
+                for error_set in layer['errors']:
+                    out = self._masked(layer, error_set)
+                    out = out.reshape((-1, 3))
+                    lines.append(out)
+
+            if layer['vectors'] is not None:
+                out = self._masked(layer, layer['vectors'])
+                lines.append(out.reshape((-1, 3)))
+                if layer['draw_arrows']:
+                    arrows.append(out)
 
         if len(lines) == 0:
             if self._error_vector_widget is not None:
@@ -203,26 +639,182 @@ class MultiColorScatter(scene.visuals.Markers):
                 widget = Arrow(parent=self, connect="segments")
                 widget.set_gl_state(depth_test=False, blend=True,
                                     blend_func=('src_alpha', 'one_minus_src_alpha'))
+                widget.attach(self._line_clipper)
                 self._error_vector_widget = widget
             self._error_vector_widget.visible = True
 
+        line_colors, arrow_colors = self._line_colors()
+
         lines = np.vstack(lines)
         line_colors = np.vstack(line_colors)
         self._error_vector_widget.set_data(pos=lines, color=line_colors)
 
         arrows = np.vstack(arrows) if len(arrows) > 0 else np.array([])
-        arrow_colors = np.vstack(arrow_colors) if len(arrow_colors) else np.array([])
         self._error_vector_widget.set_data(arrows=arrows)
         self._error_vector_widget.arrow_color = arrow_colors
 
-    def draw(self, *args, **kwargs):
-        if len(self.layers) == 0:
+    def _upload(self, label):
+        """
+        Upload the attributes of a layer that changed since it was last drawn.
+        Attributes that are the same for all points are not uploaded and are
+        instead set as constant attributes when drawing.
+        """
+
+        layer = self.layers[label]
+
+        if len(layer['dirty']) == 0:
             return
+
+        start = time.perf_counter()
+        nbytes = 0
+
+        values = {}
+
+        if 'position' in layer['dirty']:
+            # The data or mask changed, so the order of the points may change
+            # and the other attributes need to be uploaded in the new order.
+            previous_order = layer['lod_order']
+            self._update_lod_order(layer)
+            if previous_order is not None or layer['lod_order'] is not None:
+                layer['dirty'].update(('color', 'size', 'cmap_values'))
+            values['position'] = self._ordered(layer, layer['data'])
+
+        if 'color' in layer['dirty'] and layer['color'].ndim > 1:
+            values['color'] = self._ordered(layer, layer['color'])
+
+        if 'size' in layer['dirty']:
+            if layer['size_values'] is not None:
+                layer['size_ref_limits'] = layer['size_limits']
+                values['size'] = self._normalize(self._ordered(layer, layer['size_values']),
+                                                 layer['size_limits'])
+            elif not np.isscalar(layer['size']):
+                values['size'] = self._ordered(layer, layer['size'])
+
+        if 'cmap_values' in layer['dirty'] and layer['cmap_values'] is not None:
+            layer['cmap_ref_limits'] = layer['cmap_limits']
+            values['cmap_values'] = self._normalize(self._ordered(layer, layer['cmap_values']),
+                                                    layer['cmap_limits'])
+
+        if 'cmap' in layer['dirty'] and layer['cmap_lut'] is not None:
+            if layer['cmap_texture'] is None:
+                layer['cmap_texture'] = Texture2D(layer['cmap_lut'][np.newaxis],
+                                                  interpolation='linear',
+                                                  wrapping='clamp_to_edge',
+                                                  internalformat='rgba32f')
+            else:
+                layer['cmap_texture'].set_data(layer['cmap_lut'][np.newaxis])
+            nbytes += layer['cmap_lut'].nbytes
+
+        for attribute, array in values.items():
+            array = np.ascontiguousarray(array, dtype=np.float32)
+            if attribute in layer['buffers']:
+                layer['buffers'][attribute].set_data(array)
+            else:
+                layer['buffers'][attribute] = VertexBuffer(array)
+            nbytes += array.nbytes
+
+        # Buffers for attributes that are now the same for all points are no
+        # longer needed
+        if layer['color'].ndim == 1:
+            layer['buffers'].pop('color', None)
+        if np.isscalar(layer['size']) and layer['size_values'] is None:
+            layer['buffers'].pop('size', None)
+        if layer['cmap_values'] is None:
+            layer['buffers'].pop('cmap_values', None)
+
+        layer['dirty'].clear()
+
+        self.stats.record('upload', time.perf_counter() - start, nbytes=nbytes, layer=label)
+
+    def _bind(self, label, lod_fraction=1.):
+        """
+        Set the buffers and uniforms of the program for a layer, and return
+        whether the layer can be drawn.
+        """
+
+        layer = self.layers[label]
+        buffers = layer['buffers']
+
+        # The sizes of the arrays can disagree if the number of points changed
+        # but not all the attributes were set again, in which case the layer
+        # can't be drawn until they are.
+        n_points = buffers['position'].size
+        for attribute in ('color', 'size', 'cmap_values'):
+            if attribute in buffers and buffers[attribute].size != n_points:
+                logger.warning("Not drawing layer {0}: the {1} attribute has {2} values but "
+                               "there are {3} points".format(label, attribute,
+                                                             buffers[attribute].size, n_points))
+                return False
+
+        # Only the first points are drawn if the visual is downsampled
+        n_drawn = min(self._n_drawn(layer, lod_fraction), n_points)
+        if n_drawn == 0:
+            return False
+        elif n_drawn < n_points:
+            buffers = {attribute: buffer[:n_drawn] for attribute, buffer in buffers.items()}
+
+        program = self.shared_program
+        program['a_position'] = buffers['position']
+
+        if 'color' in buffers:
+            program['a_color'] = buffers['color']
+        else:
+            program['a_color'] = tuple(layer['color'][:3]) + (1.,)
+
+        if 'size' in buffers:
+            program['a_size'] = buffers['size']
+        else:
+            program['a_size'] = float(layer['size'])
+        program['u_size_transform'] = self._size_transform(layer)
+
+        if 'cmap_values' in buffers and layer['cmap_texture'] is not None:
+            program['a_cmap_value'] = buffers['cmap_values']
+            program['u_colormap'] = True
+            program['u_cmap'] = layer['cmap_texture']
+            program['u_cmap_transform'] = self._cmap_transform(layer)
         else:
+            program['a_cmap_value'] = 0.
+            program['u_colormap'] = False
+            program['u_cmap'] = self._default_cmap
+            program['u_cmap_transform'] = 1., 0.
+
+        program['u_alpha'] = float(layer['alpha'])
+
+        return True
+
+    def _prepare_transforms(self, view):
+        view.view_program.vert['transform'] = view.get_transform()
+
+    def _prepare_draw(self, view):
+        view.view_program['u_px_scale'] = view.transforms.pixel_scale
+
+    def _compute_bounds(self, axis, view):
+        bounds = [(layer['data'][:, axis].min(), layer['data'][:, axis].max())
+                  for layer in self.layers.values() if self._is_shown(layer)]
+        if len(bounds) == 0:
+            return None
+        return (min(bound[0] for bound in bounds), max(bound[1] for bound in bounds))
+
+    def draw(self):
+        if len(self.layers) == 0:
+            return
+        start = time.perf_counter()
+        for label in self._sorted_layers():
+            if self._is_shown(self.layers[label]):
+                self._upload(label)
+        lod_fraction = self._lod_fraction()
+        for label in self._sorted_layers():
+            if not self._is_shown(self.layers[label]):
+                continue
             try:
-                super(MultiColorScatter, self).draw(*args, **kwargs)
+                if self._bind(label, lod_fraction=lod_fraction):
+                    super(MultiColorScatterVisual, self).draw()
             except Exception:
                 pass
+        self.stats.record('draw', time.perf_counter() - start)
+
+
+MultiColorScatter = create_visual_node(MultiColorScatterVisual)
 
 
 if __name__ == "__main__":  # pragma: nocover
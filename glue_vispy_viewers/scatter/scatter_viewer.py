@@ -20,6 +20,11 @@ class VispyScatterViewer(BaseVispyViewer):
     _data_artist_cls = ScatterLayerArtist
     _subset_artist_cls = ScatterLayerArtist
 
+    def _downsample_target(self):
+        # While interacting with the viewer, we only draw a random sample of
+        # the points of large datasets.
+        return getattr(self._vispy_widget, '_multiscat', None)
+
     def add_data(self, data):
 
         first_layer_artist = len(self._layer_artist_container) == 0
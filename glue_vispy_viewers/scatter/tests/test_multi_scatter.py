@@ -0,0 +1,285 @@
+import numpy as np
+
+from mock import patch
+
+from ..multi_scatter import FRAG_SHADER, VERT_SHADER, MultiColorScatter, lod_ranks
+
+
+def make_scatter(n_points=100):
+
+    multiscat = MultiColorScatter()
+
+    x, y, z = np.random.random((3, n_points))
+
+    multiscat.allocate('a')
+    multiscat.set_data_values('a', x, y, z)
+
+    multiscat.allocate('b')
+    multiscat.set_data_values('b', x, y, z)
+    multiscat.set_color('b', np.random.random((n_points, 4)))
+
+    return multiscat
+
+
+def uploaded_bytes(multiscat, label):
+    multiscat.stats.reset()
+    multiscat.stats.start_frame()
+    multiscat._upload(label)
+    multiscat.stats.end_frame()
+    count, time, nbytes = multiscat.stats.last_frame.get(('upload', label), (0, 0., 0))
+    return nbytes
+
+
+def test_incremental_upload():
+
+    multiscat = make_scatter()
+
+    # Fixed colors and sizes are not uploaded as arrays
+    assert uploaded_bytes(multiscat, 'a') == 1200
+    assert set(multiscat.layers['a']['buffers']) == {'position'}
+
+    assert uploaded_bytes(multiscat, 'b') == 1200 + 1600
+    assert set(multiscat.layers['b']['buffers']) == {'position', 'color'}
+
+    # Changing the alpha, visibility or zorder doesn't require any uploads
+    multiscat.set_alpha('a', 0.5)
+    multiscat.set_visible('b', False)
+    multiscat.set_visible('b', True)
+    multiscat.set_zorder('b', lambda: 2)
+    assert uploaded_bytes(multiscat, 'a') == 0
+    assert uploaded_bytes(multiscat, 'b') == 0
+
+    # Only the attributes that changed are uploaded, and only for the layer
+    # they changed for.
+    multiscat.set_size('b', np.ones(100))
+    assert uploaded_bytes(multiscat, 'a') == 0
+    assert uploaded_bytes(multiscat, 'b') == 400
+
+    # Changing the mask changes the number of points so all arrays need to be
+    # uploaded again.
+    mask = np.zeros(100, dtype=bool)
+    mask[:10] = True
+    multiscat.set_mask('b', mask)
+    assert uploaded_bytes(multiscat, 'b') == 120 + 160 + 40
+    assert multiscat.layers['b']['buffers']['color'].size == 10
+
+    # Going back to a fixed size removes the buffer for the sizes
+    multiscat.set_size('b', 5)
+    assert uploaded_bytes(multiscat, 'b') == 0
+    assert set(multiscat.layers['b']['buffers']) == {'position', 'color'}
+
+
+def test_visibility():
+
+    multiscat = MultiColorScatter()
+    multiscat.allocate('a')
+    multiscat.set_data_values('a', [1, 2], [3, 4], [5, 6])
+    assert multiscat.visible
+
+    multiscat.set_visible('a', False)
+    assert not multiscat.visible
+
+    multiscat.set_visible('a', True)
+    multiscat.set_mask('a', np.array([False, False]))
+    assert not multiscat.visible
+
+
+def test_line_updates(monkeypatch):
+
+    multiscat = make_scatter()
+
+    calls = []
+
+    for method in ['_update_lines', '_update_line_colors']:
+        def record(self, method=method, original=getattr(MultiColorScatter, method)):
+            calls.append(method)
+            original(self)
+        monkeypatch.setattr(MultiColorScatter, method, record)
+
+    # The lines are only updated for layers with error bars or vectors
+
+    multiscat.set_alpha('a', 0.5)
+    multiscat.set_visible('b', False)
+    multiscat.set_visible('b', True)
+    assert calls == []
+
+    multiscat.set_errors('a', [np.random.random((100, 2, 3))])
+    assert calls == ['_update_lines']
+    assert multiscat._error_vector_widget.pos.shape == (200, 3)
+
+    # Changing the sizes or the limits used for the sizes doesn't change the
+    # lines, while changing the alpha or colormap limits only changes their
+    # colors.
+
+    del calls[:]
+    multiscat.set_size('a', 5)
+    multiscat.set_size_values('a', np.ones(100))
+    multiscat.set_size_limits('a', 0, 2)
+    assert calls == []
+
+    multiscat.set_alpha('a', 0.2)
+    multiscat.set_cmap_limits('a', 0, 2)
+    assert calls == ['_update_line_colors'] * 2
+    np.testing.assert_allclose(multiscat._error_vector_widget.color[:, 3], 0.2)
+
+    # Changing which points or layers are shown changes the lines
+
+    del calls[:]
+    multiscat.set_mask('a', np.arange(100) < 10)
+    assert calls == ['_update_lines']
+    assert multiscat._error_vector_widget.pos.shape == (20, 3)
+
+    multiscat.set_errors('a', None)
+    assert calls == ['_update_lines'] * 2
+    assert not multiscat._error_vector_widget.visible
+
+
+def test_cmap_upload():
+
+    multiscat = make_scatter()
+    uploaded_bytes(multiscat, 'a')
+
+    values = np.linspace(0, 1, 100)
+    values[0] = np.nan
+    multiscat.set_cmap_limits('a', 0, 1)
+    multiscat.set_cmap('a', 'viridis')
+    multiscat.set_cmap_values('a', values)
+
+    # The values and the lookup table are uploaded
+    assert uploaded_bytes(multiscat, 'a') == 400 + 256 * 4 * 4
+    normalized = multiscat.layers['a']['buffers']['cmap_values']
+    assert normalized.size == 100
+
+    # Changing the limits only changes the uniforms
+    multiscat.set_cmap_limits('a', 0.2, 0.5)
+    assert uploaded_bytes(multiscat, 'a') == 0
+
+    # Changing the colormap only uploads the lookup table
+    multiscat.set_cmap('a', 'gray')
+    assert uploaded_bytes(multiscat, 'a') == 256 * 4 * 4
+
+    # Going back to a fixed color removes the buffer for the values
+    multiscat.set_color('a', (1, 0, 0))
+    assert uploaded_bytes(multiscat, 'a') == 0
+    assert 'cmap_values' not in multiscat.layers['a']['buffers']
+
+
+def test_size_mapping():
+
+    multiscat = make_scatter()
+    uploaded_bytes(multiscat, 'a')
+
+    values = np.linspace(0, 1, 100)
+    values[0] = np.nan
+    multiscat.set_size_limits('a', 0, 1)
+    multiscat.set_size_values('a', values)
+    assert uploaded_bytes(multiscat, 'a') == 400
+
+    def sizes():
+        layer = multiscat.layers['a']
+        normalized = multiscat._normalize(values, layer['size_ref_limits'])
+        scale, offset = multiscat._size_transform(layer)
+        return np.where(normalized < -1e29, 0, normalized * scale + offset)
+
+    # Changing the limits and scaling only changes the uniforms
+    multiscat.set_size_limits('a', 0.2, 0.6)
+    multiscat.set_size_scaling('a', 2)
+    assert uploaded_bytes(multiscat, 'a') == 0
+    expected = 20 * (values - 0.2) / 0.4 * 2
+    expected[0] = 0
+    np.testing.assert_allclose(sizes(), expected, atol=1e-10)
+
+    multiscat.set_size_limits('a', 0.5, 0.5)
+    np.testing.assert_allclose(sizes()[1:], 20)
+
+    # Going back to a fixed size removes the buffer for the sizes
+    multiscat.set_size('a', 5)
+    assert uploaded_bytes(multiscat, 'a') == 0
+    assert 'size' not in multiscat.layers['a']['buffers']
+    assert multiscat._size_transform(multiscat.layers['a']) == (2, 0)
+
+
+def test_clip():
+
+    multiscat = make_scatter()
+    uploaded_bytes(multiscat, 'a')
+
+    # The clipping box is applied in the shaders so no data is uploaded, and
+    # the limits can be given in either order.
+    multiscat.set_clip((0.2, 0.8, 0.9, 0.1, 0, 1))
+    assert uploaded_bytes(multiscat, 'a') == 0
+    assert multiscat.shared_program['u_clip']
+    np.testing.assert_allclose(multiscat.shared_program['u_clip_min'], (0.2, 0.1, 0))
+    np.testing.assert_allclose(multiscat.shared_program['u_clip_max'], (0.8, 0.9, 1))
+    assert multiscat._line_clipper.clipping_planes.shape == (6, 2, 3)
+
+    multiscat.set_clip(None)
+    assert not multiscat.shared_program['u_clip']
+    assert len(multiscat._line_clipper.clipping_planes) == 0
+
+
+def test_lod():
+
+    multiscat = MultiColorScatter(lod_points=30)
+
+    x, y, z = np.random.random((3, 100))
+    ranks = lod_ranks(100)
+    mask = x > 0.5
+
+    multiscat.allocate('data')
+    multiscat.set_data_values('data', x, y, z)
+    multiscat.set_lod_ranks('data', ranks, 100)
+
+    multiscat.allocate('subset')
+    multiscat.set_data_values('subset', x[mask], y[mask], z[mask])
+    multiscat.set_lod_ranks('subset', ranks[mask], 100)
+
+    # The points are uploaded in order of rank
+    uploaded_bytes(multiscat, 'data')
+    uploaded_bytes(multiscat, 'subset')
+    order = multiscat.layers['data']['lod_order']
+    np.testing.assert_equal(ranks[order], np.arange(100))
+
+    assert multiscat._lod_fraction() == 1
+
+    multiscat.downsample()
+    fraction = multiscat._lod_fraction()
+    n_data = multiscat._n_drawn(multiscat.layers['data'], fraction)
+    n_subset = multiscat._n_drawn(multiscat.layers['subset'], fraction)
+    assert n_data < 30 and n_subset < np.sum(mask)
+
+    # The points drawn for the subset are also drawn for the dataset
+    drawn = set(order[:n_data])
+    drawn_subset = np.nonzero(mask)[0][multiscat.layers['subset']['lod_order'][:n_subset]]
+    assert drawn.issuperset(drawn_subset)
+
+    multiscat.upsample()
+    assert multiscat._lod_fraction() == 1
+
+
+def test_shader_version():
+    # Both stages of the program should use the same GLSL version
+    assert VERT_SHADER.splitlines()[0] == FRAG_SHADER.splitlines()[0] == '#version 120'
+
+
+def test_bind_size_mismatch():
+
+    multiscat = make_scatter()
+
+    # Changing the number of points without setting the colors again means
+    # that the layer can't be drawn, which should be reported.
+    x, y, z = np.random.random((3, 50))
+    multiscat.set_data_values('b', x, y, z)
+    multiscat._upload('b')
+
+    with patch('glue_vispy_viewers.scatter.multi_scatter.logger') as logger:
+        assert not multiscat._bind('b')
+    logger.warning.assert_called_once_with("Not drawing layer b: the color attribute has "
+                                           "100 values but there are 50 points")
+
+    multiscat.set_color('b', np.random.random((50, 4)))
+    multiscat._upload('b')
+
+    with patch('glue_vispy_viewers.scatter.multi_scatter.logger') as logger:
+        assert multiscat._bind('b')
+    logger.warning.assert_not_called()
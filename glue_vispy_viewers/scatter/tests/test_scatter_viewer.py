@@ -426,6 +426,7 @@ def test_layer_visibility_after_session(tmpdir):
     ga2.show()
 
     scatter_r = ga2.viewers[0][0]
+    scatter_r._update_scheduler.flush()
     viewer_state = scatter_r.state
     layer_state = viewer_state.layers[0]
     assert not layer_state.visible
@@ -435,3 +436,49 @@ def test_layer_visibility_after_session(tmpdir):
     assert not layer_artist._multiscat.layers[layer_artist.id]['visible']
 
     ga2.close()
+
+
+def test_downsample():
+
+    data = make_test_data()
+    subset = data.new_subset(label='subset')
+    subset.subset_state = data.id['a'] > 0.5
+
+    dc = DataCollection([data])
+    ga = GlueApplication(dc)
+    ga.show()
+
+    scatter = ga.new_data_viewer(VispyScatterViewer)
+    scatter.add_data(data)
+    scatter._update_scheduler.flush()
+
+    # Only datasets with more points than lod_points are downsampled
+    layer_artist, subset_artist = scatter.layers
+    multiscat = layer_artist._multiscat
+    assert multiscat.layers[layer_artist.id]['lod_ranks'] is None
+    multiscat.lod_points = 20
+    layer_artist.update()
+    subset_artist.update()
+
+    # The random ordering of the points of the dataset is also used for the
+    # subset
+    ranks = multiscat.layers[layer_artist.id]['lod_ranks']
+    subset_ranks = multiscat.layers[subset_artist.id]['lod_ranks']
+    assert len(ranks) == 100
+    np.testing.assert_equal(subset_ranks, ranks[subset.to_mask()])
+
+    scatter.mouse_press()
+    assert multiscat._downsampled
+    scatter.mouse_release()
+    assert not multiscat._downsampled
+
+    # Disabling downsampling during an interaction shouldn't leave the points
+    # downsampled, and nothing is then downsampled.
+    scatter.mouse_press()
+    scatter.state.downsample = False
+    scatter.mouse_release()
+    assert not multiscat._downsampled
+    scatter.mouse_press()
+    assert not multiscat._downsampled
+
+    ga.close()
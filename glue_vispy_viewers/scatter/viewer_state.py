@@ -1,3 +1,4 @@
+from echo import CallbackProperty
 from glue.core.data_combo_helper import ComponentIDComboHelper
 from glue_vispy_viewers.common.viewer_state import Vispy3DViewerState
 
@@ -6,6 +7,8 @@ __all__ = ['Vispy3DScatterViewerState']
 
 class Vispy3DScatterViewerState(Vispy3DViewerState):
 
+    downsample = CallbackProperty(True)
+
     def __init__(self, **kwargs):
 
         super(Vispy3DScatterViewerState, self).__init__()
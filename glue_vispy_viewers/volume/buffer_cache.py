@@ -0,0 +1,162 @@
+from threading import Lock
+from collections import OrderedDict
+
+from glue.core.hub import HubListener
+from glue.core.message import (NumericalDataChangedMessage, ComponentsChangedMessage,
+                               ExternallyDerivableComponentsChangedMessage,
+                               SubsetUpdateMessage, SubsetDeleteMessage,
+                               DataCollectionDeleteMessage)
+
+__all__ = ['BufferCache', 'BUFFER_CACHE']
+
+
+class BufferCache(HubListener):
+    """
+    A cache of fixed resolution buffers that can be shared between layer
+    artists and viewers.
+
+    The total size of the cached buffers is kept below ``max_bytes`` by
+    removing the least recently used buffers. The first element of each key
+    should be the layer (dataset or subset) the buffer was computed for, and
+    the second element the reference data if any, so that buffers can be
+    removed when a layer changes or is deleted. Once registered to a hub with
+    `register_to_hub`, this is done automatically, whether or not any viewer
+    is open.
+
+    Buffers can be computed in worker threads so all access to the cache is
+    protected by a lock.
+    """
+
+    def __init__(self, max_bytes=512 * 1024 ** 2):
+        self._buffers = OrderedDict()
+        self._nbytes = 0
+        self._max_bytes = max_bytes
+        self._lock = Lock()
+
+        # This is incremented whenever buffers are invalidated, so that
+        # buffers that were being computed at the time aren't added.
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._buffers)
+
+    def __contains__(self, key):
+        return key in self._buffers
+
+    @property
+    def nbytes(self):
+        """
+        The total size of the cached buffers, in bytes.
+        """
+        return self._nbytes
+
+    @property
+    def max_bytes(self):
+        """
+        The maximum total size of the cached buffers, in bytes.
+        """
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, value):
+        with self._lock:
+            self._max_bytes = value
+            self._evict()
+
+    def get(self, key):
+        """
+        Return the buffer for ``key``, or `None` if it isn't in the cache.
+        """
+        with self._lock:
+            if key in self._buffers:
+                self._buffers.move_to_end(key)
+                return self._buffers[key]
+
+    def set(self, key, buffer, generation=None):
+        """
+        Add a buffer to the cache. Buffers larger than the maximum size of the
+        cache are not added. If ``generation`` is given, the buffer is only
+        added if no buffers were invalidated since the value was returned by
+        `generation`.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            if key in self._buffers:
+                self._nbytes -= self._buffers.pop(key).nbytes
+            if buffer.nbytes > self._max_bytes:
+                return
+            self._buffers[key] = buffer
+            self._nbytes += buffer.nbytes
+            self._evict()
+
+    def compute(self, key, function, *args, **kwargs):
+        """
+        Return the buffer for ``key``, calling ``function`` with the remaining
+        arguments to compute it if it isn't in the cache.
+        """
+        buffer = self.get(key)
+        if buffer is None:
+            generation = self.generation()
+            buffer = function(*args, **kwargs)
+            self.set(key, buffer, generation=generation)
+        return buffer
+
+    def generation(self):
+        """
+        Return a value that changes whenever buffers are invalidated.
+        """
+        with self._lock:
+            return self._generation
+
+    def invalidate(self, layer):
+        """
+        Remove all buffers computed for ``layer``, or using it as reference
+        data. If ``layer`` is a dataset, buffers for subsets of the dataset
+        are removed too.
+        """
+        with self._lock:
+            self._generation += 1
+            for key in list(self._buffers):
+                if any(item is layer or getattr(item, 'data', None) is layer
+                       for item in key[:2]):
+                    self._nbytes -= self._buffers.pop(key).nbytes
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._nbytes = 0
+
+    def register_to_hub(self, hub):
+        """
+        Remove buffers when the data or subsets they were computed for change
+        or are deleted. This can safely be called several times for the same
+        hub, and should be called before any viewers using the cache are
+        registered to the hub so that the buffers are removed before the
+        viewers are updated.
+        """
+
+        for message_class in (NumericalDataChangedMessage, ComponentsChangedMessage,
+                              ExternallyDerivableComponentsChangedMessage,
+                              DataCollectionDeleteMessage):
+            hub.subscribe(self, message_class, handler=self._data_changed)
+
+        hub.subscribe(self, SubsetUpdateMessage, handler=self._subset_changed,
+                      filter=lambda message: message.attribute != 'style')
+
+        hub.subscribe(self, SubsetDeleteMessage, handler=self._subset_changed)
+
+    def _data_changed(self, message):
+        self.invalidate(message.data)
+
+    def _subset_changed(self, message):
+        self.invalidate(message.subset)
+
+    def _evict(self):
+        while self._nbytes > self._max_bytes:
+            key, buffer = self._buffers.popitem(last=False)
+            self._nbytes -= buffer.nbytes
+
+
+# The cache shared by all volume viewers
+BUFFER_CACHE = BufferCache()
@@ -1,5 +1,9 @@
+import numpy as np
+
 from vispy.color import BaseColormap
 
+__all__ = ['get_translucent_cmap']
+
 
 def get_translucent_cmap(r, g, b):
 
@@ -10,4 +14,10 @@ def get_translucent_cmap(r, g, b):
         }}
         """.format(r, g, b)
 
+        def map(self, t):
+            rgba = np.empty(np.shape(t)[:1] + (4,), dtype=np.float32)
+            rgba[:, :3] = r, g, b
+            rgba[:, 3] = np.ravel(t)
+            return rgba
+
     return TranslucentCmap()
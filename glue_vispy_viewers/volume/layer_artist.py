@@ -6,7 +6,7 @@ from matplotlib.colors import ColorConverter
 from glue.core.data import Subset, Data
 from glue.core.exceptions import IncompatibleAttribute
 from glue.utils import broadcast_to
-from glue.core.fixed_resolution_buffer import ARRAY_CACHE, PIXEL_CACHE
+from .buffer_cache import BUFFER_CACHE
 from .colors import get_translucent_cmap
 from .layer_state import VolumeLayerState
 from ..common.layer_artist import VispyLayerArtist
@@ -17,6 +17,7 @@ class DataProxy(object):
     def __init__(self, viewer_state, layer_artist):
         self._viewer_state = weakref.ref(viewer_state)
         self._layer_artist = weakref.ref(layer_artist)
+        self._disabled_reason = None
 
     @property
     def layer_artist(self):
@@ -42,37 +43,64 @@ class DataProxy(object):
 
     def compute_fixed_resolution_buffer(self, bounds=None):
 
+        # Note that this can be called from a worker thread, so we don't
+        # enable/disable the layer artist here, and instead keep track of
+        # whether the layer could be computed - the status is then applied to
+        # the layer artist in apply_status.
+
         shape = [bound[2] for bound in bounds]
 
         if self.layer_artist is None or self.viewer_state is None:
             return broadcast_to(0, shape)
 
-        if isinstance(self.layer_artist.layer, Subset):
+        # The buffers are cached in a cache shared between viewers, so the
+        # key should identify everything the buffer depends on.
+
+        layer = self.layer_artist.layer
+        reference_data = self.layer_artist._viewer_state.reference_data
+        bounds = tuple(tuple(bound) for bound in bounds)
+
+        if isinstance(layer, Subset):
             try:
-                subset_state = self.layer_artist.layer.subset_state
-                result = self.layer_artist.layer.data.compute_fixed_resolution_buffer(
-                    target_data=self.layer_artist._viewer_state.reference_data,
-                    bounds=bounds, subset_state=subset_state,
-                    cache_id=self.layer_artist.id)
+                subset_state = layer.subset_state
+                result = BUFFER_CACHE.compute((layer, reference_data, subset_state, bounds),
+                                              layer.data.compute_fixed_resolution_buffer,
+                                              target_data=reference_data,
+                                              bounds=list(bounds), subset_state=subset_state)
             except IncompatibleAttribute:
-                self.layer_artist.disable_incompatible_subset()
+                self._disabled_reason = 'Subset cannot be shown'
                 return broadcast_to(0, shape)
-            else:
-                self.layer_artist.enable()
         else:
             try:
-                result = self.layer_artist.layer.compute_fixed_resolution_buffer(
-                    target_data=self.layer_artist._viewer_state.reference_data,
-                    bounds=bounds, target_cid=self.layer_artist.state.attribute,
-                    cache_id=self.layer_artist.id)
+                attribute = self.layer_artist.state.attribute
+                result = BUFFER_CACHE.compute((layer, reference_data, attribute.uuid, bounds),
+                                              layer.compute_fixed_resolution_buffer,
+                                              target_data=reference_data,
+                                              bounds=list(bounds), target_cid=attribute)
             except IncompatibleAttribute:
-                self.layer_artist.disable('Layer data is not fully linked to reference data')
+                self._disabled_reason = 'Layer data is not fully linked to reference data'
                 return broadcast_to(0, shape)
-            else:
-                self.layer_artist.enable()
+
+        self._disabled_reason = None
 
         return result
 
+    def apply_status(self):
+        """
+        Enable or disable the layer artist depending on whether the last buffer
+        could be computed. This should be called from the main thread.
+        """
+
+        if self.layer_artist is None:
+            return
+
+        if self._disabled_reason is None:
+            self.layer_artist.enable()
+        elif isinstance(self.layer_artist.layer, Subset):
+            self.layer_artist.disable_incompatible_subset()
+        else:
+            self.layer_artist.disable(self._disabled_reason)
+
 
 class VolumeLayerArtist(VispyLayerArtist):
     """
@@ -107,17 +135,17 @@ class VolumeLayerArtist(VispyLayerArtist):
         self._multivol = self.vispy_widget._multivol
         self._multivol.allocate(self.id)
 
-        self._viewer_state.add_global_callback(self._update_volume)
-        self.state.add_global_callback(self._update_volume)
+        # Changes to the viewer and layer state are collected by the viewer
+        # and passed on in one go when the event loop next runs.
+        self._scheduler = vispy_viewer._update_scheduler
+        self._scheduler.register(self, self.state, self._update_volume)
 
-        self.reset_cache()
+        # Whether all properties should be updated the next time the layer
+        # can be shown, which is the case if it couldn't be shown before.
+        self._full_update = True
 
         self._data_proxy = None
 
-    def reset_cache(self):
-        self._last_viewer_state = {}
-        self._last_layer_state = {}
-
     @property
     def visual(self):
         return self._multivol
@@ -150,9 +178,11 @@ class VolumeLayerArtist(VispyLayerArtist):
         """
         Remove the layer artist for good
         """
+        # Note that we don't remove the buffers for the layer from the cache
+        # since they may be needed again e.g. if the data is shown in another
+        # viewer.
+        self._scheduler.unregister(self)
         self._multivol.deallocate(self.id)
-        ARRAY_CACHE.pop(self.id, None)
-        PIXEL_CACHE.pop(self.id, None)
 
     def _update_cmap_from_color(self):
         cmap = get_translucent_cmap(*ColorConverter().to_rgb(self.state.color))
@@ -198,32 +228,14 @@ class VolumeLayerArtist(VispyLayerArtist):
     def set_clip(self, limits):
         pass
 
-    def _update_volume(self, force=False, **kwargs):
+    def _update_volume(self, changed=frozenset(), force=False):
 
         if self.state.attribute is None or self.state.layer is None:
+            self._full_update = True
             return
 
-        # Figure out which attributes are different from before. Ideally we shouldn't
-        # need this but currently this method is called multiple times if an
-        # attribute is changed due to x_att changing then hist_x_min, hist_x_max, etc.
-        # If we can solve this so that _update_histogram is really only called once
-        # then we could consider simplifying this. Until then, we manually keep track
-        # of which properties have changed.
-
-        changed = set()
-
-        if not force:
-
-            for key, value in self._viewer_state.as_dict().items():
-                if value != self._last_viewer_state.get(key, None):
-                    changed.add(key)
-
-            for key, value in self.state.as_dict().items():
-                if value != self._last_layer_state.get(key, None):
-                    changed.add(key)
-
-        self._last_viewer_state.update(self._viewer_state.as_dict())
-        self._last_layer_state.update(self.state.as_dict())
+        force = force or self._full_update
+        self._full_update = False
 
         if force or 'color' in changed:
             self._update_cmap_from_color()
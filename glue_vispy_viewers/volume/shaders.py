@@ -63,17 +63,41 @@ void main() {
 }
 """
 
+# Shaders used to stretch volumes rendered to a smaller framebuffer onto the
+# canvas.
+UPSCALE_VERT_SHADER = """
+attribute vec2 a_position;
+varying vec2 v_texcoord;
+void main() {
+    v_texcoord = (a_position + 1.) / 2.;
+    gl_Position = vec4(a_position, 0., 1.);
+}
+"""
+
+UPSCALE_FRAG_SHADER = """
+uniform sampler2D u_texture;
+varying vec2 v_texcoord;
+void main() {
+    gl_FragColor = texture2D(u_texture, v_texcoord);
+}
+"""
+
 # Fragment shader
 FRAG_SHADER = """
 // uniforms
 {declarations}
 uniform vec3 u_shape;
+uniform vec3 u_tex_offset;
 uniform float u_downsample;
 uniform vec4 u_bgcolor;
 
 uniform vec3 u_clip_min;
 uniform vec3 u_clip_max;
 
+// colormaps, with one row per volume slot
+uniform sampler2D u_cmaps;
+uniform vec2 u_cmaps_shape;
+
 //varyings
 // varying vec3 v_texcoord;
 varying vec3 v_position;
@@ -91,6 +115,13 @@ const float u_shininess = 40.0;
 // global holding view direction in local coordinates
 vec3 view_ray;
 
+vec4 colormap(float index, float value) {{
+    // Values of 0 and 1 map to the centers of the first and last texels
+    float x = (clamp(value, 0., 1.) * (u_cmaps_shape.x - 1.) + 0.5) / u_cmaps_shape.x;
+    return texture2D(u_cmaps, vec2(x, (index + 0.5) / u_cmaps_shape.y));
+}}
+
+{functions}
 
 // for some reason, this has to be the last function in order for the
 // filters to be inserted in the correct place...
@@ -121,24 +152,37 @@ void main() {{
     distance = max(distance, min((-0.5 - v_position.z) / view_ray.z,
                             (u_shape.z - 0.5 - v_position.z) / view_ray.z));
 
-    // Now we have the starting position on the front surface
+    // Now we have the starting position on the front surface, and the ray
+    // ends at the back surface
     vec3 front = v_position + view_ray * distance;
+    vec3 back = v_position;
+    float ray_length = -distance;
+
+    {clip_ray}
 
     // Decide how many steps to take
-    int nsteps = int(-distance / u_downsample + 0.5);
+    int nsteps = int(ray_length / u_downsample + 0.5);
     if(nsteps < 1) discard;
 
     // Get starting location and step vector in texture coordinates
-    vec3 step = ((v_position - front) / u_shape) / nsteps;
+    vec3 step = ((back - front) / u_shape) / nsteps;
     vec3 start_loc = front / u_shape;
 
     float val;
+    float val_other;
 
     // This outer loop seems necessary on some systems for large
     // datasets. Ugly, but it works ...
     vec3 loc = start_loc;
     int iter = 0;
 
+    // The textures wrap around, so the location in the textures is offset
+    // from the location in the volume, and we need to make sure we don't
+    // interpolate between the first and last voxels of the volume.
+    vec3 texloc;
+    vec3 texloc_min = 0.5 / u_shape;
+    vec3 texloc_max = 1. - 0.5 / u_shape;
+
     {before_loop}
 
     // We avoid putting this if statement in the loop for performance
@@ -222,23 +266,108 @@ void main() {{
 """
 
 
-def get_frag_shader(volumes, clipped=False, n_volume_max=5):
+# Code used to restrict the ray to the part inside the clipping box, which is
+# given in the same normalized coordinates as the texture locations.
+CLIP_RAY = """
+// Restrict the ray to the part inside the clipping box
+vec3 clip_t1 = (u_clip_min * u_shape - front) / view_ray;
+vec3 clip_t2 = (u_clip_max * u_shape - front) / view_ray;
+vec3 clip_tmin = min(clip_t1, clip_t2);
+vec3 clip_tmax = max(clip_t1, clip_t2);
+float clip_start = max(0., max(clip_tmin.x, max(clip_tmin.y, clip_tmin.z)));
+float clip_end = min(ray_length, min(clip_tmax.x, min(clip_tmax.y, clip_tmax.z)));
+if (clip_end <= clip_start) discard;
+back = front + view_ray * clip_end;
+front += view_ray * clip_start;
+ray_length = clip_end - clip_start;
+"""
+
+
+# Function used to skip over macrocells that can't contain visible values. The
+# u_macrocells texture indicates which macrocells are occupied, and the
+# function returns the number of steps needed to exit the macrocell containing
+# ``texloc`` if the macrocell is empty, or zero otherwise.
+MACROCELL_FUNCTION = """
+uniform sampler3D u_macrocells;
+uniform vec3 u_macrocell_shape;
+uniform float u_macrocell_size;
+
+int macrocell_steps(vec3 texloc, vec3 ray_step) {
+    vec3 voxel = fract(texloc) * u_shape;
+    vec3 cell = floor(voxel / u_macrocell_size);
+    if (texture3D(u_macrocells, (cell + 0.5) / u_macrocell_shape).r > 0.) {
+        return 0;
+    }
+    vec3 lower = cell * u_macrocell_size;
+    vec3 upper = min(lower + u_macrocell_size, u_shape);
+    vec3 voxel_step = ray_step * u_shape;
+    vec3 dist = mix(voxel - lower, upper - voxel, step(0., voxel_step));
+    vec3 nsteps = dist / max(abs(voxel_step), 1e-10);
+    return max(int(ceil(min(nsteps.x, min(nsteps.y, nsteps.z)))), 1);
+}
+"""
+
+
+def get_frag_shader(volumes, clipped=False, n_volume_max=5, packed=False,
+                    skip_empty=False, sampler_type='sampler3D'):
     """
     Get the fragment shader code - we use the shader_program object to determine
     which layers are enabled and therefore what to include in the shader code.
+
+    The 'storage' key of each volume should give the index of the texture in
+    which the volume is stored and the channel in the texture. If ``packed`` is
+    `True`, the textures are RGBA textures which are sampled once per step for
+    all volumes in the texture. If ``skip_empty`` is `True`, the ray skips over
+    macrocells marked as empty in the u_macrocells texture. ``sampler_type``
+    should be ``sampler2D`` if 3D textures are emulated.
     """
 
     declarations = ""
+    functions = ""
     before_loop = ""
     in_loop = ""
     after_loop = ""
 
-    for index in range(n_volume_max):
-        declarations += "uniform $sampler_type u_volumetex_{0:d};\n".format(index)
-        before_loop += "dummy = $sample(u_volumetex_{0:d}, loc).g;\n".format(index)
-
-    declarations += "uniform $sampler_type dummy1;\n"
-    declarations += "float dummy;\n"
+    def sampled_value(label):
+        tex_index, channel = volumes[label]['storage']
+        if packed:
+            return "sample_{0:d}.{1}".format(tex_index, 'rgba'[channel])
+        else:
+            return "$sample(u_volumetex_{0:d}, texloc).r".format(tex_index)
+
+    def scaled_value(name, label):
+        # NaN values are stored as NAN_VALUE in the textures, and need to be
+        # rejected before the limits are applied since otherwise changing the
+        # limits could bring them into view.
+        return ("{0} < -1e29 ? 0. : {0} * u_clim_{1:d}.x + u_clim_{1:d}.y"
+                .format(name, volumes[label]['index']))
+
+    # Only the textures that contain data are declared. Each of these stores
+    # at least one volume which is sampled in the loop, so we don't need to
+    # sample the textures anywhere else to keep the samplers active.
+    textures = sorted(set(volumes[label]['storage'][0]
+                          for label in volumes if 'storage' in volumes[label]))
+
+    for tex_index in textures:
+        declarations += "uniform {0} u_volumetex_{1:d};\n".format(sampler_type, tex_index)
+
+    if textures:
+        in_loop += "texloc = clamp(loc, texloc_min, texloc_max) + u_tex_offset;\n"
+        if skip_empty:
+            functions += MACROCELL_FUNCTION
+            in_loop += ("\n// Skip over empty macrocells\n"
+                        "int skip = macrocell_steps(texloc, step);\n"
+                        "if (skip > 0) {\n"
+                        "    loc += float(skip) * step;\n"
+                        "    iter += skip - 1;\n"
+                        "    continue;\n"
+                        "}\n")
+        if packed:
+            for tex_index in textures:
+                before_loop += "vec4 sample_{0:d};\n".format(tex_index)
+                in_loop += ("sample_{0:d} = $sample(u_volumetex_{0:d}, texloc);\n"
+                            .format(tex_index))
+        in_loop += "\n"
 
     for label in sorted(volumes):
 
@@ -247,44 +376,56 @@ def get_frag_shader(volumes, clipped=False, n_volume_max=5):
         # Global declarations
         declarations += "uniform float u_weight_{0:d};\n".format(index)
         declarations += "uniform int u_enabled_{0:d};\n".format(index)
+        declarations += "uniform vec2 u_clim_{0:d};\n".format(index)
 
         # Declarations before the raytracing loop
         before_loop += "float max_val_{0:d} = 0;\n".format(index)
 
-        # Calculation inside the main raytracing loop
+        # Calculation inside the main raytracing loop - volumes for which no
+        # data has been uploaded yet don't need to be sampled.
+
+        if 'storage' not in volumes[label]:
+            in_loop += "// No data for layer {0}\n\n".format(label)
+        else:
+            in_loop += "if(u_enabled_{0:d} == 1) {{\n\n".format(index)
+
+            # The textures contain values normalized once at upload time, and
+            # u_clim_N converts these to values normalized with the current
+            # limits
+            in_loop += "// Sample texture for layer {0}\n".format(label)
+            in_loop += "val = {0};\n".format(sampled_value(label))
+            in_loop += "val = {0};\n".format(scaled_value('val', label))
+
+            label_other = volumes[label].get('multiply')
+            if label_other is not None:
+                if 'storage' in volumes[label_other]:
+                    in_loop += ("if (val != 0) {{\n"
+                                "    val_other = {0};\n"
+                                "    val *= {1};\n"
+                                "}}\n".format(sampled_value(label_other),
+                                              scaled_value('val_other', label_other)))
+                else:
+                    in_loop += "val = 0.;\n"
+
+            in_loop += "max_val_{0:d} = max(val, max_val_{0:d});\n\n".format(index)
 
-        in_loop += "if(u_enabled_{0:d} == 1) {{\n\n".format(index)
-
-        if clipped:
-            in_loop += ("if(loc.r > u_clip_min.r && loc.r < u_clip_max.r &&\n"
-                        "   loc.g > u_clip_min.g && loc.g < u_clip_max.g &&\n"
-                        "   loc.b > u_clip_min.b && loc.b < u_clip_max.b) {\n\n")
-
-        in_loop += "// Sample texture for layer {0}\n".format(label)
-        in_loop += "val = $sample(u_volumetex_{0:d}, loc).g;\n".format(index)
-
-        if volumes[label].get('multiply') is not None:
-            index_other = volumes[volumes[label]['multiply']]['index']
-            in_loop += ("if (val != 0) {{ val *= $sample(u_volumetex_{0:d}, loc).g; }}\n"
-                        .format(index_other))
-
-        in_loop += "max_val_{0:d} = max(val, max_val_{0:d});\n\n".format(index)
-
-        if clipped:
             in_loop += "}\n\n"
 
-        in_loop += "}\n\n"
-
         # Calculation after the main loop
 
         after_loop += "// Compute final color for layer {0}\n".format(label)
-        after_loop += ("color = $cmap{0:d}(max_val_{0:d});\n"
+        after_loop += ("color = colormap({0:d}., max_val_{0:d});\n"
                        "color.a *= u_weight_{0:d};\n"
                        "total_color += color.a * color;\n"
                        "max_alpha = max(color.a, max_alpha);\n"
                        "count += color.a;\n\n").format(index)
 
-    if not clipped:
+    # When clipping, the ray is restricted to the clipping box before the
+    # main loop rather than checking each sample against the box.
+    if clipped:
+        clip_ray = CLIP_RAY
+    else:
+        clip_ray = ""
         before_loop += "\nfloat val3 = u_clip_min.g + u_clip_max.g;\n\n"
 
     # Code esthetics
@@ -292,7 +433,11 @@ def get_frag_shader(volumes, clipped=False, n_volume_max=5):
     in_loop = indent(in_loop, " " * 16).strip()
     after_loop = indent(after_loop, " " * 4).strip()
 
+    clip_ray = indent(clip_ray, " " * 4).strip()
+
     return FRAG_SHADER.format(declarations=declarations,
+                              functions=functions,
+                              clip_ray=clip_ray,
                               before_loop=before_loop,
                               in_loop=in_loop,
                               after_loop=after_loop)
@@ -301,11 +446,11 @@ def get_frag_shader(volumes, clipped=False, n_volume_max=5):
 def main():
 
     volumes = {}
-    volumes['banana'] = {'index': 3, 'enabled': True}
-    volumes['apple'] = {'index': 1, 'multiply': None, 'enabled': True}
-    volumes['apple'] = {'index': 1, 'multiply': 'banana', 'enabled': True}
+    volumes['banana'] = {'index': 3, 'storage': (0, 0), 'enabled': True}
+    volumes['apple'] = {'index': 1, 'storage': (0, 1), 'multiply': None, 'enabled': True}
+    volumes['apple'] = {'index': 1, 'storage': (0, 1), 'multiply': 'banana', 'enabled': True}
 
-    print(get_frag_shader(volumes))
+    print(get_frag_shader(volumes, packed=True))
 
 
 if __name__ == "__main__":  # pragma: nocover
@@ -0,0 +1,147 @@
+import numpy as np
+
+from glue.core import Data, DataCollection
+
+from ..buffer_cache import BufferCache
+
+
+def test_lru_eviction():
+
+    cache = BufferCache(max_bytes=3000)
+
+    data = Data(x=[1, 2, 3])
+
+    for index in range(3):
+        cache.set((data, index), np.zeros(100))
+
+    assert len(cache) == 3
+    assert cache.nbytes == 2400
+
+    # Accessing a buffer makes it the most recently used one, so adding a new
+    # buffer should then remove the second buffer.
+    assert cache.get((data, 0)) is not None
+    cache.set((data, 3), np.zeros(100))
+
+    assert (data, 0) in cache
+    assert (data, 1) not in cache
+    assert cache.nbytes == 2400
+
+    # Reducing the budget removes buffers straight away
+    cache.max_bytes = 1000
+    assert len(cache) == 1
+    assert (data, 3) in cache
+
+    # Buffers that don't fit in the cache aren't added
+    cache.set((data, 4), np.zeros(1000))
+    assert (data, 4) not in cache
+    assert cache.nbytes == 800
+
+
+def test_compute():
+
+    cache = BufferCache()
+
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return np.ones(10) * value
+
+    data = Data(x=[1, 2, 3])
+
+    assert cache.compute((data, 1), compute, 1)[0] == 1
+    assert cache.compute((data, 1), compute, 1)[0] == 1
+    assert cache.compute((data, 2), compute, 2)[0] == 2
+
+    assert calls == [1, 2]
+
+
+def test_invalidate():
+
+    cache = BufferCache()
+
+    data1 = Data(x=[1, 2, 3])
+    data2 = Data(x=[1, 2, 3])
+    subset = data1.new_subset()
+
+    cache.set((data1, 1), np.zeros(10))
+    cache.set((data2, 1), np.zeros(10))
+    cache.set((subset, 1), np.zeros(10))
+
+    # Invalidating a subset only removes the buffers for the subset, but
+    # invalidating a dataset also removes the buffers for its subsets.
+
+    cache.invalidate(subset)
+    assert len(cache) == 2
+
+    cache.set((subset, 1), np.zeros(10))
+
+    cache.invalidate(data1)
+    assert len(cache) == 1
+    assert (data2, 1) in cache
+    assert cache.nbytes == 80
+
+
+def test_invalidate_during_compute():
+
+    cache = BufferCache()
+
+    data = Data(x=[1, 2, 3])
+
+    # Buffers computed while the data changed shouldn't be added since they
+    # might have been computed from the old values.
+
+    def compute():
+        cache.invalidate(data)
+        return np.zeros(10)
+
+    cache.compute((data, 1), compute)
+    assert (data, 1) not in cache
+
+    cache.compute((data, 1), np.zeros, 10)
+    assert (data, 1) in cache
+
+
+def test_register_to_hub():
+
+    cache = BufferCache()
+
+    data1 = Data(x=[1, 2, 3], label='data1')
+    data2 = Data(x=[1, 2, 3], label='data2')
+
+    dc = DataCollection([data1, data2])
+    cache.register_to_hub(dc.hub)
+    cache.register_to_hub(dc.hub)
+
+    subset = dc.new_subset_group(subset_state=data1.id['x'] > 1).subsets[0]
+
+    # Changing the values of a dataset removes the buffers for the dataset
+    # and for data using it as reference data.
+
+    cache.set((data1, None, 1), np.zeros(10))
+    cache.set((data2, data1, 1), np.zeros(10))
+    cache.set((subset, data2, 1), np.zeros(10))
+
+    data1.update_components({data1.id['x']: np.array([3, 2, 1])})
+    assert len(cache) == 0
+
+    # Style changes of subsets are ignored, but not changes in the selection
+
+    cache.set((subset, None, 1), np.zeros(10))
+
+    subset.style.color = '#ff0000'
+    assert len(cache) == 1
+
+    subset.subset_state = data1.id['x'] > 2
+    assert len(cache) == 0
+
+    # Deleted subsets and datasets are removed from the cache
+
+    cache.set((subset, None, 1), np.zeros(10))
+    cache.set((data2, None, 1), np.zeros(10))
+
+    dc.remove_subset_group(dc.subset_groups[0])
+    assert len(cache) == 1
+
+    dc.remove(data2)
+    assert len(cache) == 0
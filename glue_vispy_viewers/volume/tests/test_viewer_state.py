@@ -0,0 +1,26 @@
+import pytest
+
+from ..viewer_state import compute_resolution_shape
+
+
+@pytest.mark.parametrize(('extents', 'resolution', 'shape'),
+                         [((1000, 1000, 1000), 256, (256, 256, 256)),
+                          ((64, 2048, 2048), 256, (25, 813, 813)),
+                          ((300, 200, 100), 64, (106, 70, 35)),
+                          # Axes are kept above a minimum size
+                          ((20, 2048, 2048), 256, (16, 1024, 1024)),
+                          ((20, 20, 1e6), 64, (16, 16, 1024)),
+                          # ...and below the number of pixels, with the
+                          # remaining voxels given to the other axes
+                          ((100, 100, 100), 256, (100, 100, 100)),
+                          ((10, 2048, 2048), 256, (10, 1295, 1295)),
+                          ((1, 2048, 2048), 256, (1, 2048, 2048)),
+                          ((3841, 48, 46), 256, (2048, 48, 46)),
+                          # ...and below a maximum size
+                          ((64, 10000, 10000), 2048, (64, 2048, 2048)),
+                          ((10, 1000, 4000), 256, (10, 819, 2048)),
+                          ((4000, 1000, 100), 512, (2048, 810, 81)),
+                          # Reversed limits give negative extents
+                          ((64, -2048, 2048), 256, (25, 813, 813))])
+def test_compute_resolution_shape(extents, resolution, shape):
+    assert compute_resolution_shape(extents, resolution) == shape
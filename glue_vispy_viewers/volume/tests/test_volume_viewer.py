@@ -7,6 +7,7 @@ from glue.core.link_helpers import LinkSame
 from glue.core.fixed_resolution_buffer import PIXEL_CACHE, ARRAY_CACHE
 
 from ..volume_viewer import VispyVolumeViewer
+from ..buffer_cache import BUFFER_CACHE
 
 
 def teardown_function(function):
@@ -15,6 +16,7 @@ def teardown_function(function):
         raise Exception("Pixel cache contains {0} elements".format(len(PIXEL_CACHE)))
     if len(ARRAY_CACHE) > 0:
         raise Exception("Array cache contains {0} elements".format(len(ARRAY_CACHE)))
+    BUFFER_CACHE.clear()
 
 
 def make_test_data(dimensions=(10, 10, 10)):
@@ -127,6 +129,11 @@ def test_array_shape(tmpdir):
 
     layer_state.attribute = data.id['b']
 
+    # The textures should follow the shape of the data rather than being cubes,
+    # without using more voxels than there are pixels
+    assert viewer_state.resolution_shape == (2048, 48, 46)
+    assert volume._vispy_widget._multivol._vol_shape == (2048, 48, 46)
+
     ga.close()
 
 
@@ -188,12 +195,16 @@ def test_layer_visibility_clip():
     assert volume.layers[0].visible
     assert volume.layers[0]._multivol.enabled[0]
 
+    # Changes to the state are passed on to the layer artists when the event
+    # loop next runs, so we apply them straight away here.
     volume.layers[0].visible = False
+    volume._update_scheduler.flush()
 
     assert not volume.layers[0].visible
     assert not volume.layers[0]._multivol.enabled[0]
 
     volume.state.clip_data = True
+    volume._update_scheduler.flush()
 
     assert not volume.layers[0].visible
     assert not volume.layers[0]._multivol.enabled[0]
@@ -201,6 +212,191 @@ def test_layer_visibility_clip():
     ga.close()
 
 
+def test_shared_buffer_cache():
+
+    data = make_test_data()
+
+    dc = DataCollection([data])
+    ga = GlueApplication(dc)
+    ga.show()
+
+    volume1 = ga.new_data_viewer(VispyVolumeViewer)
+    volume1.add_data(data)
+
+    # We don't show the second viewer to avoid drawing it
+    volume2 = VispyVolumeViewer(ga.session)
+    volume2.add_data(data)
+
+    bounds = [(-0.5, 2.5, 3), (-0.5, 4.5, 5), (-0.5, 3.5, 4)]
+
+    # Buffers computed for one viewer should be re-used by other viewers
+    buffer = volume1.layers[0]._data_proxy.compute_fixed_resolution_buffer(bounds)
+    assert volume2.layers[0]._data_proxy.compute_fixed_resolution_buffer(bounds) is buffer
+
+    # Changing the values should cause the buffer to be computed again
+    data.update_components({data.id['a']: data['a'] * 2})
+    assert volume2.layers[0]._data_proxy.compute_fixed_resolution_buffer(bounds) is not buffer
+
+    volume2.close()
+    ga.close()
+
+
+def test_downsample():
+
+    data = make_test_data()
+
+    dc = DataCollection([data])
+    ga = GlueApplication(dc)
+    ga.show()
+
+    volume = ga.new_data_viewer(VispyVolumeViewer)
+    volume.add_data(data)
+    volume._update_scheduler.flush()
+
+    multivol = volume._vispy_widget._multivol
+
+    # While interacting, the volumes are rendered at a lower resolution
+
+    volume.mouse_press()
+    assert multivol._downsampled
+    assert multivol._render_scale == volume.interaction_render_scale
+
+    volume.mouse_release()
+    assert not multivol._downsampled
+    assert multivol._render_scale == 1
+
+    # Disabling downsampling during an interaction shouldn't leave the volumes
+    # downsampled, and nothing is then downsampled.
+
+    volume.mouse_press()
+    volume.state.downsample = False
+    volume.mouse_release()
+    assert not multivol._downsampled
+    assert multivol._render_scale == 1
+
+    volume.mouse_press()
+    assert not multivol._downsampled
+    assert multivol._render_scale == 1
+
+    ga.close()
+
+
+def test_target_fps():
+
+    data = make_test_data()
+
+    dc = DataCollection([data])
+    ga = GlueApplication(dc)
+
+    volume = ga.new_data_viewer(VispyVolumeViewer)
+    volume.add_data(data)
+
+    sampling = volume._vispy_widget._multivol._sampling
+    assert sampling.target_fps == 30
+
+    volume.state.target_fps = 10
+    assert sampling.target_fps == 10
+
+    # The frame rate can be changed in the options, but only while
+    # downsampling is enabled.
+
+    options = volume.options_widget()
+    options.ui.value_target_fps.setValue(60)
+    assert volume.state.target_fps == 60
+    assert sampling.target_fps == 60
+
+    volume.state.downsample = False
+    assert not options.ui.value_target_fps.isEnabled()
+
+    ga.close()
+
+
+def test_packed():
+
+    data = make_test_data()
+
+    dc = DataCollection([data])
+    ga = GlueApplication(dc)
+
+    volume = ga.new_data_viewer(VispyVolumeViewer)
+    volume.add_data(data)
+
+    dc.new_subset_group(subset_state=data.id['a'] > 0.5, label='subset 1')
+    dc.new_subset_group(subset_state=data.id['b'] > 0.5, label='subset 2')
+
+    volume._update_scheduler.flush()
+
+    multivol = volume._vispy_widget._multivol
+    multivol.wait()
+
+    assert not multivol._packed
+    assert 'sample_1' not in multivol._shader
+    assert multivol.textures[1].internalformat == 'r8'
+    assert volume.state.texture_memory() == 1000 * (4 + 1 + 1)
+
+    # The two subsets should then share a texture, which is sampled once
+    # before the values for both subsets are extracted
+
+    volume.state.packed = True
+    multivol.wait()
+
+    assert multivol._packed
+    storage = sorted(multivol.volumes[label]['storage'] for label in multivol.volumes)
+    assert storage == [(0, 0), (1, 0), (1, 1)]
+    assert multivol.textures[1].internalformat == 'rgba8'
+    assert 'sample_1 = $sample(u_volumetex_1, texloc);' in multivol._shader
+    assert 'sample_1.g' in multivol._shader
+
+    # Packed textures always have four channels
+    assert volume.state.texture_memory() == 1000 * (4 * 4 + 4 * 1)
+
+    volume.state.packed = False
+    multivol.wait()
+
+    assert 'sample_1' not in multivol._shader
+
+    ga.close()
+
+
+def test_auto_resolution():
+
+    data = make_test_data((128, 128, 128))
+
+    dc = DataCollection([data])
+    ga = GlueApplication(dc)
+
+    volume = ga.new_data_viewer(VispyVolumeViewer)
+    volume.add_data(data)
+
+    state = volume.state
+    state.memory_budget = 100
+    state.auto_resolution = True
+
+    # The textures don't have more voxels than the data, so higher resolutions
+    # don't use more memory. A float32 texture at a resolution of 128 uses
+    # 8 MB.
+    assert state.resolution == 128
+    assert state.texture_memory() == 128 ** 3 * 4
+    assert volume._vispy_widget._multivol._vol_shape == (128, 128, 128)
+    assert volume.statusBar().currentMessage() == ('Resolution: 128 (128x128x128 voxels), '
+                                                   'estimated GPU memory: 8 MB')
+
+    # Subsets are stored as 8-bit textures
+    dc.new_subset_group(subset_state=data.id['a'] > 0.5, label='subset')
+    assert state.texture_memory() == 128 ** 3 * 5
+    assert volume.statusBar().currentMessage().endswith('10 MB')
+
+    # The resolution should be reduced when the volumes no longer fit
+    state.memory_budget = 8
+    assert state.resolution == 64
+    assert volume._vispy_widget._multivol._vol_shape == (64, 64, 64)
+
+    state.precision = 'uint8'
+    assert state.resolution == 128
+
+    ga.close()
+
+
 def test_remove_subset_group():
 
     # Regression test for a bug that meant that removing a subset caused an
@@ -0,0 +1,815 @@
+from threading import Event, current_thread, main_thread
+
+import pytest
+import numpy as np
+from numpy.testing import assert_allclose, assert_equal
+
+from matplotlib import cm
+
+from vispy import scene
+from vispy.gloo import gl
+
+from ...utils import NestedSTTransform
+from ..colors import get_translucent_cmap
+from .. import volume_visual
+from ..shaders import get_frag_shader
+from ..volume_visual import (MultiVolume, MultiVolumeVisual, NAN_VALUE, SamplingController,
+                             compute_block_max, compute_scaled_buffer, current_framebuffer,
+                             subtract_box, wrapped_views)
+
+
+class SimpleProxy(object):
+    """
+    A minimal stand-in for DataProxy that keeps track of how many times the
+    fixed resolution buffer was computed.
+    """
+
+    def __init__(self, array):
+        self.array = array
+        self.n_computed = 0
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def compute_fixed_resolution_buffer(self, bounds=None):
+        self.n_computed += 1
+        shape = [bound[2] for bound in bounds]
+        return np.broadcast_to(self.array.mean(), shape)
+
+
+class BlockingProxy(SimpleProxy):
+    """
+    A proxy that blocks when computing the first buffer until ``release`` is
+    set, and keeps track of the number of buffers that were uploaded.
+    """
+
+    def __init__(self, array):
+        super(BlockingProxy, self).__init__(array)
+        self.started = Event()
+        self.release = Event()
+        self.n_applied = 0
+
+    def compute_fixed_resolution_buffer(self, bounds=None):
+        if self.n_computed == 0:
+            self.started.set()
+            self.release.wait(10)
+        return super(BlockingProxy, self).compute_fixed_resolution_buffer(bounds=bounds)
+
+    def apply_status(self):
+        self.n_applied += 1
+
+
+def make_multivol(resolution=8, threaded=False, **kwargs):
+    # The volume visual expects to be given a nested transform when it is
+    # added to the vispy widget, so we mimic this here.
+    multivol = MultiVolumeVisual(resolution=resolution, threaded=threaded, **kwargs)
+    multivol.transform = NestedSTTransform()
+    multivol._update_slice_transform(0, 1, 0, 1, 0, 1)
+    return multivol
+
+
+def test_set_clim_no_upload():
+
+    multivol = make_multivol()
+
+    proxy = SimpleProxy(np.ones((4, 4, 4)))
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', proxy)
+
+    assert proxy.n_computed == 1
+    assert_allclose(multivol.shared_program['u_clim_0'], (1., 0.))
+
+    multivol.set_clim('a', (1, 3))
+
+    assert proxy.n_computed == 1
+    assert_allclose(multivol.shared_program['u_clim_0'], (1., -0.5))
+
+
+def test_threaded_drop_stale():
+
+    multivol = make_multivol(threaded=True, preview_factor=1)
+
+    proxy = BlockingProxy(np.ones((4, 4, 4)))
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', proxy)
+
+    # Change the slice while the first buffer is still being computed - the
+    # first buffer should then never be uploaded.
+    proxy.started.wait(10)
+    multivol._update_slice_transform(0, 2, 0, 2, 0, 2)
+    proxy.release.set()
+
+    multivol.wait()
+
+    assert proxy.n_computed == 2
+    assert proxy.n_applied == 1
+    assert 'job' not in multivol.volumes['a']
+
+
+def test_deallocate_running_job():
+
+    multivol = make_multivol(threaded=True, preview_factor=1)
+
+    proxy = BlockingProxy(np.ones((4, 4, 4)))
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', proxy)
+
+    # Deallocating shouldn't wait for the buffer being computed, and the
+    # buffer should never be uploaded, even if the label is re-used.
+    proxy.started.wait(10)
+    multivol.deallocate('a')
+    assert proxy.n_computed == 0
+
+    new_proxy = BlockingProxy(np.zeros((4, 4, 4)))
+    new_proxy.release.set()
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', new_proxy)
+
+    proxy.release.set()
+    multivol.wait()
+
+    assert new_proxy.n_applied == 1
+    assert proxy.n_applied == 0
+
+
+class RecordingProxy(SimpleProxy):
+    """
+    A proxy that keeps track of the bounds of the buffers that were computed.
+    """
+
+    def __init__(self, array):
+        super(RecordingProxy, self).__init__(array)
+        self.bounds = []
+
+    def compute_fixed_resolution_buffer(self, bounds=None):
+        self.bounds.append(bounds)
+        return super(RecordingProxy, self).compute_fixed_resolution_buffer(bounds=bounds)
+
+
+def test_threaded_preview():
+
+    # While the buffer for the slice is computed, a low resolution version of
+    # the slice should be shown.
+
+    multivol = make_multivol(resolution=16, threaded=True)
+
+    proxy = RecordingProxy(np.ones((4, 4, 4)))
+    release = Event()
+    compute = proxy.compute_fixed_resolution_buffer
+
+    def compute_blocking(bounds=None):
+        if bounds[0][2] == 16:
+            release.wait(10)
+        return compute(bounds=bounds)
+
+    proxy.compute_fixed_resolution_buffer = compute_blocking
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', proxy)
+
+    multivol.volumes['a']['preview'].result(10)
+    multivol._process_pending()
+
+    # The voxels of the preview should be at the same normalized positions in
+    # the texture as the matching voxels of the full texture.
+    assert_allclose(proxy.bounds[0], [(3.5 / 15, 11.5 / 15, 2)] * 3)
+    assert multivol.textures[0].shape[:3] == (2, 2, 2)
+    assert 'valid' not in multivol.volumes['a']
+
+    release.set()
+    multivol.wait()
+
+    assert multivol.textures[0].shape[:3] == (16, 16, 16)
+    assert multivol.volumes['a']['blocks'] is not None
+    assert 'preview' not in multivol.volumes['a']
+
+    # Panning re-uses the texture so no preview is needed
+    multivol._update_slice_transform(1 / 15, 16 / 15, 0, 1, 0, 1)
+    assert 'preview' not in multivol.volumes['a']
+    multivol.wait()
+
+
+def test_subtract_box():
+
+    boxes = subtract_box(((0, 0, 0), (4, 4, 4)), ((0, 1, 0), (4, 4, 3)))
+
+    assert boxes == [((0, 0, 0), (4, 1, 4)),
+                     ((0, 1, 3), (4, 4, 4))]
+
+    # The boxes should exactly cover the part of the window outside the box
+    covered = np.zeros((4, 4, 4), dtype=int)
+    covered[0:4, 1:4, 0:3] += 1
+    for lower, upper in boxes:
+        covered[tuple(slice(lo, hi) for lo, hi in zip(lower, upper))] += 1
+    assert np.all(covered == 1)
+
+
+def test_wrapped_views():
+
+    views = list(wrapped_views((6, 0, -1), (3, 2, 2), (8, 8, 8)))
+
+    assert views == [((slice(0, 2), slice(0, 2), slice(0, 1)), (6, 0, 7)),
+                     ((slice(0, 2), slice(0, 2), slice(1, 2)), (6, 0, 0)),
+                     ((slice(2, 3), slice(0, 2), slice(0, 1)), (0, 0, 7)),
+                     ((slice(2, 3), slice(0, 2), slice(1, 2)), (0, 0, 0))]
+
+
+def test_pan_incremental():
+
+    multivol = make_multivol(resolution=8)
+
+    proxy = RecordingProxy(np.ones((4, 4, 4)))
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', proxy)
+
+    assert proxy.bounds == [[(0, 1, 8), (0, 1, 8), (0, 1, 8)]]
+
+    # Panning by two and a bit voxels along x should snap the slice to the
+    # lattice and only compute the two newly exposed slices.
+    step = 1 / 7
+    multivol._update_slice_transform(2.1 * step, 1 + 2.1 * step, 0, 1, 0, 1)
+
+    assert len(proxy.bounds) == 2
+    assert [bound[2] for bound in proxy.bounds[1]] == [8, 8, 2]
+    assert_allclose(proxy.bounds[1][2][:2], (8 * step, 9 * step))
+    assert_allclose(multivol._data_bounds[2], (2 * step, 1 + 2 * step, 8))
+    assert_allclose(multivol.shared_program['u_tex_offset'], (0.25, 0, 0))
+
+    # Panning back should only compute the slices exposed on the other side,
+    # and changing the size of the slice requires recomputing everything.
+    multivol._update_slice_transform(0, 1, 0, 1, 0, 1)
+
+    assert len(proxy.bounds) == 3
+    assert [bound[2] for bound in proxy.bounds[2]] == [8, 8, 2]
+    assert_allclose(multivol.shared_program['u_tex_offset'], (0, 0, 0))
+
+    multivol._update_slice_transform(0, 2, 0, 1, 0, 1)
+
+    assert proxy.bounds[3] == [(0, 1, 8), (0, 1, 8), (0, 2, 8)]
+
+    # Finally a large pan also requires recomputing everything
+    multivol._update_slice_transform(3, 5, 0, 1, 0, 1)
+
+    assert proxy.bounds[4] == [(0, 1, 8), (0, 1, 8), (3, 5, 8)]
+
+
+def test_anisotropic_resolution():
+
+    # The textures don't need to be cubes - the shape is given as (nz, ny, nx)
+
+    multivol = make_multivol(resolution=(4, 8, 16))
+
+    proxy = RecordingProxy(np.ones((4, 4, 4)))
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', proxy)
+
+    assert proxy.bounds == [[(0, 1, 4), (0, 1, 8), (0, 1, 16)]]
+    assert multivol.textures[0].shape[:3] == (4, 8, 16)
+    assert_allclose(multivol.shared_program['u_shape'], (16, 8, 4))
+
+    # Panning along y should only compute the newly exposed slice
+    step = 1 / 7
+    multivol._update_slice_transform(0, 1, step, 1 + step, 0, 1)
+
+    assert proxy.bounds[1] == [(0, 1, 4), (8 * step, 8 * step, 1), (0, 1, 16)]
+    assert_allclose(multivol.shared_program['u_tex_offset'], (0, 0.125, 0))
+
+    # Changing the resolution requires recomputing everything
+    multivol.set_resolution((8, 8, 8))
+    multivol._update_slice_transform(0, 1, 0, 1, 0, 1)
+
+    assert proxy.bounds[2] == [(0, 1, 8), (0, 1, 8), (0, 1, 8)]
+    assert multivol.textures[0].shape[:3] == (8, 8, 8)
+    assert_allclose(multivol.shared_program['u_shape'], (8, 8, 8))
+
+
+def test_compute_scaled_buffer_quantized():
+
+    proxy = SimpleProxy(np.array([np.nan, -1, 0.5, 1, 3]))
+    proxy.compute_fixed_resolution_buffer = lambda bounds: proxy.array
+
+    buffer = compute_scaled_buffer(proxy, None, (0, 2), dtype=np.uint8)
+    assert buffer.dtype == np.uint8
+    assert_equal(buffer, [0, 0, 64, 128, 255])
+
+    buffer = compute_scaled_buffer(proxy, None, (0, 2))
+    assert buffer.dtype == np.float32
+    assert_equal(buffer, np.array([NAN_VALUE, -0.5, 0.25, 0.5, 1.5], dtype=np.float32))
+
+
+@pytest.mark.parametrize('precision', ['float32', 'uint8'])
+def test_set_clim_quantized(precision):
+
+    multivol = make_multivol(precision=precision)
+
+    proxy = SimpleProxy(np.ones((4, 4, 4)))
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', proxy)
+
+    # Narrowing the limits can be done in the shader in both cases
+    multivol.set_clim('a', (0.5, 1.5))
+    assert proxy.n_computed == 1
+
+    # Extending the limits beyond the original ones requires the integer
+    # textures to be updated since the values outside the limits were clipped
+    multivol.set_clim('a', (0, 3))
+
+    if precision == 'uint8':
+        assert proxy.n_computed == 2
+        assert_allclose(multivol.shared_program['u_clim_0'], (1., 0.))
+    else:
+        assert proxy.n_computed == 1
+
+    # Subset masks always use 8-bit textures
+    multivol.allocate('b')
+    multivol.set_clim('b', None)
+    multivol.set_data('b', proxy)
+    assert multivol.textures[1].internalformat == 'r8'
+
+
+def test_lazy_textures():
+
+    multivol = make_multivol()
+
+    proxy = SimpleProxy(np.ones((4, 4, 4)))
+
+    assert multivol.textures == [None] * 16
+    assert 'u_volumetex_0' not in multivol._shader
+
+    # Textures are only created once there is data to show
+
+    multivol.allocate('a')
+    multivol.allocate('b')
+
+    assert multivol.textures == [None] * 16
+
+    for label in 'ab':
+        multivol.set_clim(label, (0, 1))
+        multivol.set_data(label, proxy)
+
+    assert multivol.textures[0].shape[:3] == (8, 8, 8)
+    assert multivol.textures[1].shape[:3] == (8, 8, 8)
+    assert multivol.textures[2:] == [None] * 14
+    assert 'u_volumetex_1' in multivol._shader
+    assert 'u_volumetex_2' not in multivol._shader
+
+    # Deallocating releases the texture memory, and the texture is re-used
+    # when needed again.
+    texture = multivol.textures[0]
+    multivol.deallocate('a')
+    assert texture.shape[:3] == (1, 1, 1)
+    assert 'u_volumetex_0' not in multivol._shader
+
+    multivol.allocate('c')
+    multivol.set_clim('c', (0, 1))
+    multivol.set_data('c', proxy)
+    assert multivol.textures[0] is texture
+    assert texture.shape[:3] == (8, 8, 8)
+
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_texture_storage(packed):
+
+    multivol = make_multivol(packed=packed)
+
+    proxy = SimpleProxy(np.ones((4, 4, 4)))
+
+    # A dataset and three subset masks - the masks are stored using a
+    # different format so they can't be packed with the dataset.
+
+    multivol.allocate('data')
+    multivol.set_clim('data', (0, 1))
+    multivol.set_data('data', proxy)
+
+    for label in ['subset1', 'subset2', 'subset3']:
+        multivol.allocate(label)
+        multivol.set_clim(label, None)
+        multivol.set_data(label, proxy)
+        multivol.set_multiply(label, 'data')
+
+    storage = [multivol.volumes[label]['storage']
+               for label in ['data', 'subset1', 'subset2', 'subset3']]
+
+    if packed:
+        assert storage == [(0, 0), (1, 0), (1, 1), (1, 2)]
+        assert multivol.textures[0].internalformat == 'rgba32f'
+        assert multivol.textures[1].internalformat == 'rgba8'
+        assert multivol.textures[1].shape == (8, 8, 8, 4)
+        assert multivol.textures[2] is None
+        # The packed texture should be sampled once for all three masks
+        shader = multivol._shader
+        assert (shader.count('$sample(u_volumetex_1, texloc)') ==
+                shader.count('$sample(u_volumetex_0, texloc)'))
+        assert 'val = sample_1.b;' in multivol._shader
+    else:
+        assert storage == [(0, 0), (1, 0), (2, 0), (3, 0)]
+        assert multivol.textures[0].internalformat == 'r32f'
+        assert multivol.textures[1].internalformat == 'r8'
+        assert multivol.textures[1].shape == (8, 8, 8, 1)
+
+    # Removing a volume frees its channel for the next volume, but the texture
+    # is only released once it is empty
+    multivol.deallocate('subset2')
+
+    if packed:
+        assert multivol.textures[1].shape[:3] == (8, 8, 8)
+    else:
+        assert multivol.textures[2].shape[:3] == (1, 1, 1)
+
+    multivol.allocate('subset4')
+    multivol.set_clim('subset4', None)
+    multivol.set_data('subset4', proxy)
+
+    if packed:
+        assert multivol.volumes['subset4']['storage'] == (1, 1)
+    else:
+        assert multivol.volumes['subset4']['storage'] == (2, 0)
+
+
+class CornerProxy(SimpleProxy):
+    """
+    A proxy for data that is only non-zero for x, y, and z < 0.2
+    """
+
+    def compute_fixed_resolution_buffer(self, bounds=None):
+        self.n_computed += 1
+        coords = np.meshgrid(*[np.linspace(*bound) for bound in bounds], indexing='ij')
+        return np.all([c < 0.2 for c in coords], axis=0).astype(float)
+
+
+def test_compute_block_max():
+
+    # The values increase along each axis so the maximum in each macrocell is
+    # the last value in the macrocell.
+    buffer = np.arange(60).reshape((3, 4, 5))
+
+    offset, maxima, full = compute_block_max(buffer, (0, 2, 3), (6, 8, 10), 4)
+
+    assert offset == (0, 0, 0)
+    assert_equal(maxima, buffer[2:, [1, 3]][:, :, [0, 4]])
+
+    # The buffer only covers part of the first macrocell along the first axis
+    assert not full.any()
+
+    offset, maxima, full = compute_block_max(buffer, (3, 0, 5), (6, 4, 10), 3)
+
+    assert offset == (1, 0, 1)
+    assert_equal(maxima, buffer[2:, [2, 3]][:, :, [0, 3, 4]])
+
+    # Macrocells at the edge of the texture are smaller
+    assert_equal(full, [[[False, True, True], [False, True, True]]])
+
+
+def test_block_max_in_worker(monkeypatch):
+
+    # The macrocell maxima should be computed along with the buffers rather
+    # than in the main thread when the buffers are uploaded.
+
+    threads = []
+    original = volume_visual.compute_wrapped_block_max
+
+    def compute_wrapped_block_max(*args, **kwargs):
+        threads.append(current_thread())
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(volume_visual, 'compute_wrapped_block_max', compute_wrapped_block_max)
+
+    multivol = make_multivol(resolution=16, threaded=True)
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 2))
+    multivol.set_data('a', SimpleProxy(np.ones((4, 4, 4))))
+    multivol.wait()
+
+    assert len(threads) == 1
+    assert threads[0] is not main_thread()
+    assert_allclose(multivol.volumes['a']['blocks'], 0.5)
+
+
+def test_macrocells():
+
+    multivol = make_multivol(resolution=40)
+
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 1))
+    multivol.set_data('a', CornerProxy(np.ones((4, 4, 4))))
+
+    # Nothing is visible until the volume is enabled
+    assert not multivol._compute_macrocells().any()
+
+    multivol.enable('a')
+
+    # The data is non-zero in the first macrocell along each axis, and the
+    # neighboring macrocells are also needed due to the interpolation, and
+    # these wrap around the edges.
+    expected = np.zeros((5, 5, 5), dtype=bool)
+    expected[np.ix_([0, 1, 4], [0, 1, 4], [0, 1, 4])] = True
+    assert_equal(multivol._compute_macrocells(), expected)
+
+    # Raising the lower limit above the maximum hides all the data
+    multivol.set_clim('a', (1, 2))
+    assert not multivol._compute_macrocells().any()
+
+    # Subset masks only show where the data they are multiplied with is visible
+    multivol.set_clim('a', (0, 1))
+    multivol.allocate('b')
+    multivol.set_clim('b', None)
+    multivol.set_data('b', SimpleProxy(np.ones((4, 4, 4))))
+    multivol.set_multiply('b', 'a')
+    multivol.enable('b')
+    multivol.disable('a')
+    assert_equal(multivol._compute_macrocells(), expected)
+
+
+@pytest.mark.parametrize(('full_time', 'expected'), [(0.2, 6.), (0.01, 1.), (10, 64.)])
+def test_sampling_controller(full_time, expected):
+
+    # Simulate drawing the volumes with a time inversely proportional to the
+    # factor - the factor should converge to the one giving the target frame
+    # rate, within the allowed range.
+
+    controller = SamplingController(target_fps=30, initial_factor=12.8, max_factor=64)
+
+    for i in range(20):
+        controller.update(full_time / controller.factor)
+
+    assert_allclose(controller.factor, expected)
+
+
+def test_downsample():
+
+    multivol = make_multivol(resolution=64)
+
+    multivol.downsample()
+    assert_allclose(multivol.shared_program['u_downsample'], 3.2)
+
+    multivol._sampling.update(0.05)
+    multivol.upsample()
+    assert_allclose(multivol.shared_program['u_downsample'], 1.)
+
+    # The factor from the previous interaction is used as a starting point
+    multivol.downsample()
+    assert_allclose(multivol.shared_program['u_downsample'], 4.8)
+
+
+def test_set_cmap_no_shader_change():
+
+    # Changing the colormap should only update the lookup table texture
+    multivol = make_multivol()
+    multivol.allocate('a')
+    multivol.set_cmap('a', 'hot')
+
+    shader = multivol._shader
+
+    multivol.set_cmap('a', cm.viridis)
+    multivol.set_cmap('a', get_translucent_cmap(1, 0, 0))
+
+    assert multivol._shader is shader
+    assert 'colormap({0}., max_val_{0})'.format(multivol.volumes['a']['index']) in shader
+
+
+def test_program_cache():
+
+    multivol = make_multivol()
+    multivol.allocate('a')
+    multivol.allocate('b')
+    multivol.set_clim('a', (0, 1))
+    multivol.set_clim('b', None)
+    multivol.set_data('a', SimpleProxy(np.ones((2, 2, 2))))
+    multivol.set_data('b', SimpleProxy(np.ones((2, 2, 2))))
+
+    info = multivol.program_cache_info()
+
+    program = multivol.view_program
+    shader = multivol._shader
+
+    # Toggling clipping and subset modes back and forth should re-use the
+    # programs compiled for each layout
+
+    multivol.set_clip(False, None)
+    multivol.set_multiply('b', 'a')
+
+    assert multivol.view_program is not program
+    assert 'clip_start' not in multivol._shader
+
+    multivol.set_clip(True, [0, 0, 0, 1, 1, 1])
+    multivol.set_multiply('b', None)
+
+    assert multivol.view_program is program
+    assert multivol._shader is shader
+    assert 'clip_start' in multivol._shader
+
+    multivol.set_clip(False, None)
+    multivol.set_multiply('b', 'a')
+
+    # Note that setting the clipping before the multiplication the first time
+    # round results in an additional layout.
+    assert multivol.program_cache_info() == (info.hits + 3, info.misses + 3,
+                                             info.maxsize, info.currsize + 3)
+
+    # Setting the same layout again should not count as a hit or a miss
+    multivol.set_clip(False, None)
+    assert multivol.program_cache_info().hits == info.hits + 3
+
+    # The number of cached programs is limited
+    for index in range(10):
+        multivol.allocate(str(index))
+    assert multivol.program_cache_info().currsize == info.maxsize
+
+
+def test_render_stats():
+
+    multivol = make_multivol()
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 1))
+    multivol.set_data('a', SimpleProxy(np.ones((2, 2, 2))))
+
+    multivol.stats.start_frame()
+    multivol.stats.end_frame()
+
+    stats = multivol.stats.last_frame
+
+    # The buffer is computed for the whole 8x8x8 slice and then normalized
+    # to 32-bit floating point values before being uploaded
+    assert stats[('compute', 'a')].count == 1
+    assert stats[('normalize', 'a')].nbytes == 2048
+    assert stats[('upload', 'a')].nbytes == 2048
+    assert stats[('shader', None)].count >= 1
+
+
+def test_draw_scaled(monkeypatch):
+
+    canvas = scene.SceneCanvas(keys=None, size=(200, 100), show=True)
+    view = canvas.central_widget.add_view()
+    view.camera = scene.cameras.TurntableCamera(fov=0.)
+
+    multivol = MultiVolume(resolution=8, threaded=False, parent=view.scene)
+    multivol.transform = NestedSTTransform()
+    multivol._update_slice_transform(0, 1, 0, 1, 0, 1)
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 1))
+    multivol.set_data('a', SimpleProxy(np.ones((4, 4, 4))))
+    multivol.enable('a')
+    multivol.set_render_scale(0.5)
+
+    # Keep track of the framebuffer and viewport before and after drawing
+
+    states = []
+
+    def get_state():
+        canvas.context.flush_commands()
+        return (current_framebuffer(canvas),
+                gl.glGetParameter(gl.GL_FRAMEBUFFER_BINDING),
+                tuple(gl.glGetParameter(gl.GL_VIEWPORT)),
+                tuple(canvas.transforms.get_transform('canvas', 'render').map((10, 20))))
+
+    draw_scaled = MultiVolumeVisual._draw_scaled
+
+    def record_draw_scaled(self):
+        states.append(get_state())
+        draw_scaled(self)
+        states.append(get_state())
+
+    monkeypatch.setattr(MultiVolumeVisual, '_draw_scaled', record_draw_scaled)
+
+    canvas.render()
+
+    # The volumes should be drawn to a framebuffer with half the resolution
+    # of the one being rendered to, and the original framebuffer, viewport
+    # and transforms should then be restored.
+
+    assert len(states) == 2
+    assert multivol._fbo.shape[:2] == (50, 100)
+    assert states[1] == states[0]
+
+    canvas.close()
+
+
+def test_nan_hidden_wide_clim():
+
+    # NaN values should stay invisible however much the limits are widened
+    # after the data has been uploaded.
+
+    canvas = scene.SceneCanvas(keys=None, size=(100, 100), show=True, bgcolor='black')
+    view = canvas.central_widget.add_view()
+    view.camera = scene.cameras.TurntableCamera(fov=0., center=(0.5, 0.5, 0.5))
+
+    multivol = MultiVolume(resolution=8, threaded=False, parent=view.scene)
+    multivol.transform = NestedSTTransform()
+    multivol._update_slice_transform(0, 1, 0, 1, 0, 1)
+    multivol.allocate('a')
+    multivol.set_cmap('a', get_translucent_cmap(1, 1, 1))
+    multivol.set_clim('a', (0, 1))
+    multivol.set_data('a', SimpleProxy(np.full((4, 4, 4), np.nan)))
+    multivol.enable('a')
+
+    empty = canvas.render()
+
+    # Check that the volume is otherwise visible with these limits
+    multivol.set_data('a', SimpleProxy(np.ones((4, 4, 4))))
+    multivol.set_clim('a', (-2000, 2000))
+    assert np.any(canvas.render() != empty)
+
+    multivol.set_clim('a', (0, 1))
+    multivol.set_data('a', SimpleProxy(np.full((4, 4, 4), np.nan)))
+    multivol.set_clim('a', (-2000, 2000))
+    assert_equal(canvas.render(), empty)
+
+    canvas.close()
+
+
+def test_current_framebuffer():
+
+    class FakeCanvas(object):
+        size = (200, 100)
+
+    assert current_framebuffer(FakeCanvas()) == (None, (0, 0), (200, 100))
+
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_frag_shader_sampling(packed):
+
+    # The textures should only be sampled inside the ray casting loop (which
+    # is included twice in the shader, with and without jittering)
+
+    volumes = {'a': {'index': 0, 'storage': (0, 0)},
+               'b': {'index': 3, 'storage': (2, 0)}}
+
+    shader = get_frag_shader(volumes, packed=packed)
+
+    assert '$sample' not in shader[:shader.index('for (iter')]
+    assert shader.count('$sample(u_volumetex_0') == 2
+    assert shader.count('$sample(u_volumetex_2') == 2
+    assert 'u_volumetex_1' not in shader
+
+
+def test_frag_shader_clipping():
+
+    # The ray should be restricted to the clipping box once rather than
+    # checking each sample against the box
+
+    volumes = {'a': {'index': 0, 'storage': (0, 0)}}
+
+    shader = get_frag_shader(volumes, clipped=True)
+    setup, loop = shader.split('for (iter', 1)
+
+    assert 'u_clip_min * u_shape' in setup
+    assert 'u_clip_min' not in loop
+
+    assert 'clip_start' not in get_frag_shader(volumes, clipped=False)
+
+
+def test_clip_region():
+
+    # The textures should only cover the part of the slice inside the
+    # clipping box, and the clipping limits used in the shader should be
+    # relative to that part.
+
+    multivol = make_multivol(resolution=4)
+    multivol.allocate('a')
+    multivol.set_clim('a', (0, 1))
+    multivol.set_data('a', SimpleProxy(np.ones((2, 2, 2))))
+
+    multivol._update_slice_transform(0, 8, 0, 4, 0, 2)
+    assert multivol._data_bounds == [(0, 2, 4), (0, 4, 4), (0, 8, 4)]
+
+    multivol.set_clip(True, [0.25, 0, 0.5, 0.75, 1, 1])
+    assert multivol._data_bounds == [(1, 2, 4), (0, 4, 4), (2, 6, 4)]
+    assert_allclose(multivol.shared_program['u_clip_min'], [0, 0, 0])
+    assert_allclose(multivol.shared_program['u_clip_max'], [1, 1, 1])
+
+    # Changing the slice should keep the clipping box fixed in data coordinates
+    multivol._update_slice_transform(0, 16, 0, 4, 0, 2)
+    assert multivol._data_bounds == [(1, 2, 4), (0, 4, 4), (2, 6, 4)]
+    assert_allclose(multivol._clip_limits, [0.125, 0, 0.5, 0.375, 1, 1])
+
+    # While downsampled, the textures are only updated once upsampled
+    multivol.downsample()
+    multivol.set_clip(True, [-1, 0, 0.5, 0.5, 2, 1])
+    assert multivol._data_bounds == [(1, 2, 4), (0, 4, 4), (2, 6, 4)]
+    assert_allclose(multivol.shared_program['u_clip_min'], [-4.5, 0, 0])
+    assert_allclose(multivol.shared_program['u_clip_max'], [1.5, 2, 1])
+
+    # Limits outside the slice don't extend the textures
+    multivol.upsample()
+    assert multivol._data_bounds == [(1, 2, 4), (0, 4, 4), (0, 8, 4)]
+    assert_allclose(multivol.shared_program['u_clip_min'], [-2, 0, 0])
+    assert_allclose(multivol.shared_program['u_clip_max'], [1, 2, 1])
+
+    multivol.set_clip(False, None)
+    assert multivol._data_bounds == [(0, 2, 4), (0, 4, 4), (0, 16, 4)]
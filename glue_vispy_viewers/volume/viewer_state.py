@@ -1,3 +1,5 @@
+import numpy as np
+
 from glue.core.data import BaseData
 from echo import CallbackProperty, SelectionCallbackProperty
 from glue_vispy_viewers.common.viewer_state import Vispy3DViewerState
@@ -5,11 +7,77 @@ from glue.core.data_combo_helper import ManualDataComboHelper
 
 __all__ = ['Vispy3DVolumeViewerState']
 
+PRECISION_LABELS = {'float32': '32-bit float',
+                    'float16': '16-bit float',
+                    'uint16': '16-bit integer',
+                    'uint8': '8-bit integer'}
+
+# The maximum number of voxels along each axis of the textures
+MAX_TEXTURE_SIZE = 2048
+
+
+def compute_resolution_shape(extents, resolution, max_size=MAX_TEXTURE_SIZE):
+    """
+    Given the extent of a volume along each axis in data pixels, find the
+    shape of the textures in which the number of voxels along each axis is
+    proportional to the extent, and the total number of voxels is at most
+    ``resolution ** 3``. The number of voxels along each axis is kept below
+    both the number of pixels and ``max_size``, and above ``min(16,
+    resolution)`` unless there are fewer pixels than that.
+    """
+
+    # The extents can be negative if the limits of an axis are reversed
+    extents = [max(abs(float(x)), 1e-10) for x in extents]
+
+    # Using more voxels than pixels along an axis only adds cost
+    upper = [min(max(int(np.ceil(x)), 1), max_size) for x in extents]
+    lower = [min(16, resolution, n) for n in upper]
+
+    shape = [None] * 3
+
+    # Axes that would have fewer voxels than the minimum take some of the
+    # voxels from the other axes, and axes that would have more voxels than
+    # the maximum give the remaining voxels to the other axes.
+    while True:
+        free = [i for i in range(3) if shape[i] is None]
+        if not free:
+            break
+        budget = float(resolution) ** 3 / np.prod([n for n in shape if n is not None])
+        scale = (budget / np.prod([extents[i] for i in free])) ** (1. / len(free))
+        small = [i for i in free if extents[i] * scale < lower[i]]
+        large = [i for i in free if extents[i] * scale > upper[i]]
+        if small and len(small) < len(free):
+            for i in small:
+                shape[i] = lower[i]
+        elif large:
+            for i in large:
+                shape[i] = upper[i]
+        else:
+            for i in free:
+                shape[i] = min(max(extents[i] * scale, lower[i]), upper[i])
+            break
+
+    return tuple(int(round(n)) for n in shape)
+
 
 class Vispy3DVolumeViewerState(Vispy3DViewerState):
 
     downsample = CallbackProperty(True)
+    target_fps = CallbackProperty(30, docstring='The frame rate to aim for when the volumes '
+                                                'are downsampled while interacting with '
+                                                'the viewer')
     resolution = SelectionCallbackProperty(4)
+    auto_resolution = CallbackProperty(False, docstring='Whether to choose the highest '
+                                                        'resolution for which the volumes fit '
+                                                        'in memory_budget')
+    memory_budget = CallbackProperty(1024, docstring='The GPU memory, in megabytes, that the '
+                                                     'volumes can use when the resolution is '
+                                                     'chosen automatically')
+    precision = SelectionCallbackProperty(0, docstring='The format used to store the volumes '
+                                                       'on the GPU')
+    packed = CallbackProperty(False, docstring='Whether volumes stored using the same format '
+                                               'share RGBA textures, which reduces the number '
+                                               'of texture lookups when rendering')
     reference_data = SelectionCallbackProperty(docstring='The dataset that is used to define the '
                                                          'available pixel/world components, and '
                                                          'which defines the coordinate frame in '
@@ -25,6 +93,14 @@ class Vispy3DVolumeViewerState(Vispy3DViewerState):
 
         Vispy3DVolumeViewerState.resolution.set_choices(self, [2**i for i in range(4, 12)])
 
+        Vispy3DVolumeViewerState.precision.set_choices(self, list(PRECISION_LABELS))
+        Vispy3DVolumeViewerState.precision.set_display_func(self, PRECISION_LABELS.get)
+
+        self.add_callback('auto_resolution', self._update_auto_resolution)
+        self.add_callback('memory_budget', self._update_auto_resolution)
+        self.add_callback('precision', self._update_auto_resolution)
+        self.add_callback('packed', self._update_auto_resolution)
+
         self.update_from_dict(kwargs)
 
     def _first_3d_data(self):
@@ -36,6 +112,27 @@ class Vispy3DVolumeViewerState(Vispy3DViewerState):
         self._update_combo_ref_data()
         self._set_reference_data()
         self._update_attributes()
+        self._update_auto_resolution()
+
+    def _update_auto_resolution(self, *args):
+
+        if not self.auto_resolution:
+            return
+
+        # Find the highest resolution for which the volumes fit in the budget,
+        # falling back to the lowest resolution if none of them do. Since the
+        # textures never have more voxels than the data, higher resolutions
+        # can give the same textures, in which case we use the lowest of these.
+        choices = sorted(Vispy3DVolumeViewerState.resolution.get_choices(self))
+        budget = self.memory_budget * 1024 ** 2
+        resolution = choices[0]
+        memory = self.texture_memory(resolution)
+        for choice in choices[1:]:
+            choice_memory = self.texture_memory(choice)
+            if memory < choice_memory <= budget:
+                resolution, memory = choice, choice_memory
+
+        self.resolution = resolution
 
     def _update_combo_ref_data(self, *args):
         self.ref_data_helper.set_multiple_data(self.layers_data)
@@ -65,6 +162,53 @@ class Vispy3DVolumeViewerState(Vispy3DViewerState):
             type(self).y_att.set_choices(self, [y_cid])
             type(self).z_att.set_choices(self, [z_cid])
 
+    @property
+    def resolution_shape(self):
+        """
+        The shape of the textures used for the volumes, as ``(nz, ny, nx)``.
+        Rather than using ``resolution`` voxels along each axis, the same
+        total number of voxels is shared between the axes in proportion to the
+        extent of the data shown along each axis.
+        """
+        return self._resolution_shape(self.resolution)
+
+    def _resolution_shape(self, resolution):
+        return compute_resolution_shape((self.z_max - self.z_min,
+                                         self.y_max - self.y_min,
+                                         self.x_max - self.x_min), resolution)
+
+    def texture_memory(self, resolution=None):
+        """
+        Estimate the GPU memory, in bytes, used by the textures for the volume
+        layers at the given resolution (by default the current resolution).
+        Subsets are stored using 8-bit integers, and datasets using
+        ``precision``. If ``packed`` is `True`, volumes with the same format
+        share textures with four channels.
+        """
+
+        if resolution is None:
+            resolution = self.resolution
+
+        n_voxels = int(np.prod(self._resolution_shape(resolution)))
+
+        # Find the number of volumes stored with each format
+        counts = {}
+        for layer_state in self.layers:
+            if getattr(layer_state.layer, 'ndim', None) == 3:
+                if isinstance(layer_state.layer, BaseData):
+                    fmt = self.precision
+                else:
+                    fmt = 'uint8'
+                counts[fmt] = counts.get(fmt, 0) + 1
+
+        n_bytes = 0
+        for fmt, count in counts.items():
+            if self.packed:
+                count = 4 * -(-count // 4)
+            n_bytes += count * n_voxels * np.dtype(fmt).itemsize
+
+        return n_bytes
+
     @property
     def clip_limits_relative(self):
 
@@ -4,7 +4,8 @@ import numpy as np
 from glue.config import settings
 
 from qtpy.QtWidgets import QMessageBox
-from qtpy.QtCore import QTimer
+
+from vispy.visuals.transforms import STTransform
 
 from glue.core.data import BaseData
 from glue.core.link_helpers import LinkSame
@@ -15,6 +16,7 @@ from .layer_style_widget import VolumeLayerStyleWidget
 from .viewer_state import Vispy3DVolumeViewerState
 from .layer_state import VolumeLayerState
 from .volume_visual import MultiVolume
+from .buffer_cache import BUFFER_CACHE
 
 from ..scatter.layer_artist import ScatterLayerArtist
 from ..scatter.layer_style_widget import ScatterLayerStyleWidget
@@ -34,20 +36,14 @@ class VispyVolumeViewer(BaseVispyViewer):
     tools = BaseVispyViewer.tools + ['vispy:lasso', 'vispy:rectangle',
                                      'vispy:circle', 'volume3d:floodfill']
 
+    # The resolution, relative to the canvas, at which the volumes are
+    # rendered while interacting with the viewer
+    interaction_render_scale = 0.5
+
     def __init__(self, *args, **kwargs):
 
         super(VispyVolumeViewer, self).__init__(*args, **kwargs)
 
-        # We now make it so that is the user clicks to drag or uses the
-        # mouse wheel (or scroll on a trackpad), we downsample the volume
-        # rendering temporarily.
-
-        canvas = self._vispy_widget.canvas
-
-        canvas.events.mouse_press.connect(self.mouse_press)
-        canvas.events.mouse_wheel.connect(self.mouse_wheel)
-        canvas.events.mouse_release.connect(self.mouse_release)
-
         viewbox = self._vispy_widget.view.camera.viewbox
 
         viewbox.events.mouse_wheel.connect(self.camera_mouse_wheel)
@@ -55,17 +51,6 @@ class VispyVolumeViewer(BaseVispyViewer):
         viewbox.events.mouse_press.connect(self.camera_mouse_press)
         viewbox.events.mouse_release.connect(self.camera_mouse_release)
 
-        self._downsampled = False
-
-        # For the mouse wheel, we receive discrete events so we need to have
-        # a buffer (for now 250ms) before which we consider the mouse wheel
-        # event to have stopped.
-
-        self._downsample_timer = QTimer()
-        self._downsample_timer.setInterval(250)
-        self._downsample_timer.setSingleShot(True)
-        self._downsample_timer.timeout.connect(self.mouse_release)
-
         # We need to use MultiVolume instance to store volumes, but we should
         # only have one per canvas. Therefore, we store the MultiVolume
         # instance in the vispy viewer instance.
@@ -81,27 +66,45 @@ class VispyVolumeViewer(BaseVispyViewer):
         self._vispy_widget.add_data_visual(multivol)
         self._vispy_widget._multivol = multivol
 
+        # The resolution and estimated GPU memory usage are shown in the
+        # status bar whenever they change.
+        self._texture_memory_message = None
+        self.state.add_callback('layers', self._report_texture_memory)
+
         self.state.add_callback('resolution', self._update_resolution)
         self._update_resolution()
 
+        self.state.add_callback('precision', self._update_precision)
+        self._update_precision()
+
+        self.state.add_callback('target_fps', self._update_target_fps)
+        self._update_target_fps()
+
+        self.state.add_callback('packed', self._update_packed)
+        self._update_packed()
+
         # We do this here in addition to in the volume viewer itself as for
         # some situations e.g. reloading from session files, a clip_data event
         # isn't emitted.
         # FIXME: needs to be done after first layer added
         # self._update_clip(force=True)
 
+    def _downsample_target(self):
+        # While interacting with the viewer, we render the volumes at a lower
+        # resolution and take larger steps along each ray.
+        return getattr(self._vispy_widget, '_multivol', None)
+
     def mouse_press(self, event=None):
-        if self.state.downsample:
-            if hasattr(self._vispy_widget, '_multivol') and not self._downsampled:
-                self._vispy_widget._multivol.downsample()
-                self._downsampled = True
+        super(VispyVolumeViewer, self).mouse_press(event)
+        if self._downsampled:
+            self._vispy_widget._multivol.set_render_scale(self.interaction_render_scale)
 
     def mouse_release(self, event=None):
-        if self.state.downsample:
-            if hasattr(self._vispy_widget, '_multivol') and self._downsampled:
-                self._vispy_widget._multivol.upsample()
-                self._downsampled = False
-                self._vispy_widget.canvas.render()
+        downsampled = self._downsampled
+        super(VispyVolumeViewer, self).mouse_release(event)
+        if downsampled:
+            self._vispy_widget._multivol.set_render_scale(1)
+            self._vispy_widget.canvas.render()
 
         self._update_slice_transform()
         self._update_clip()
@@ -113,30 +116,49 @@ class VispyVolumeViewer(BaseVispyViewer):
                 dy = self.state.y_stretch * self.state.aspect[1]
                 dz = self.state.z_stretch * self.state.aspect[2]
                 coords = np.array([[-dx, -dy, -dz], [dx, dy, dz]])
-                coords = (self._vispy_widget._multivol.transform.imap(coords)[:, :3] /
-                          self._vispy_widget._multivol.resolution)
-                self._vispy_widget._multivol.set_clip(self.state.clip_data, coords.ravel())
+                # The clipping box should be given relative to the current
+                # slice (which is only updated once interactions are done), so
+                # we convert it to data coordinates with the outer part of the
+                # transform (the inner part depends on the clipping box).
+                multivol = self._vispy_widget._multivol
+                transform = multivol.transform
+                coords = STTransform(scale=transform.scale,
+                                     translate=transform.translate).imap(coords)[:, :3]
+                limits = np.array(multivol._slice_limits).reshape((3, 2))
+                coords = (coords - limits[:, 0]) / (limits[:, 1] - limits[:, 0])
+                multivol.set_clip(self.state.clip_data, coords.ravel())
             else:
                 self._vispy_widget._multivol.set_clip(False, [0, 0, 0, 1, 1, 1])
 
     def _update_slice_transform(self):
+        # The shape of the textures depends on the proportions of the slice
+        self._vispy_widget._multivol.set_resolution(self.state.resolution_shape)
         self._vispy_widget._multivol._update_slice_transform(self.state.x_min, self.state.x_max,
                                                              self.state.y_min, self.state.y_max,
                                                              self.state.z_min, self.state.z_max)
+        self._report_texture_memory()
+
+    def _report_texture_memory(self, *args):
+        nz, ny, nx = self.state.resolution_shape
+        message = ('Resolution: {0} ({1}x{2}x{3} voxels), estimated GPU memory: '
+                   '{4:.0f} MB'.format(self.state.resolution, nx, ny, nz,
+                                       self.state.texture_memory() / 1024 ** 2))
+        if message != self._texture_memory_message:
+            self._texture_memory_message = message
+            self.show_status(message)
 
     def _update_resolution(self, *event):
-        self._vispy_widget._multivol.set_resolution(self.state.resolution)
         self._update_slice_transform()
         self._update_clip()
 
-    def mouse_wheel(self, event=None):
-        if self.state.downsample:
-            if hasattr(self._vispy_widget, '_multivol'):
-                if not self._downsampled:
-                    self.mouse_press()
-        self._downsample_timer.start()
-        if event is not None:
-            event.handled = True
+    def _update_precision(self, *event):
+        self._vispy_widget._multivol.set_precision(self.state.precision)
+
+    def _update_target_fps(self, *event):
+        self._vispy_widget._multivol.set_target_fps(self.state.target_fps)
+
+    def _update_packed(self, *event):
+        self._vispy_widget._multivol.set_packed(self.state.packed)
 
     def resizeEvent(self, event=None):
         self.mouse_wheel()
@@ -227,6 +249,13 @@ class VispyVolumeViewer(BaseVispyViewer):
                                  buttons=QMessageBox.Ok)
             self._show_free_layer_warning = False
 
+    def register_to_hub(self, hub):
+        # The cached buffers for changed data and subsets need to be removed
+        # before the layer artists are updated, so the cache is registered
+        # first. It then stays registered once the viewer is closed.
+        BUFFER_CACHE.register_to_hub(hub)
+        super(VispyVolumeViewer, self).register_to_hub(hub)
+
     def _update_appearance_from_settings(self, message):
         super(VispyVolumeViewer, self)._update_appearance_from_settings(message)
         if hasattr(self._vispy_widget, '_multivol'):
@@ -36,27 +36,358 @@
 # This modified version is released under the BSD license given in the LICENSE
 # file in this repository.
 
+import os
+import time
 from distutils.version import LooseVersion
-from collections import defaultdict
+from itertools import count, product
+from collections import defaultdict, namedtuple, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 
 import numpy as np
 from glue.utils import iterate_chunks
 
-from vispy.gloo import Texture3D, TextureEmulated3D, VertexBuffer, IndexBuffer
+from vispy import app
+from vispy import gloo
+from vispy.gloo import (gl, Texture2D, Texture3D, TextureEmulated3D, VertexBuffer,
+                        IndexBuffer)
 from vispy.visuals import VolumeVisual, Visual
-from vispy.visuals.shaders import Function
-from vispy.color import get_colormap, Color
+from vispy.color import Color
 from vispy.scene.visuals import create_visual_node
 
-from .shaders import get_frag_shader, VERT_SHADER
+from ..common.colors import CMAP_LUT_SIZE, clim_transform, get_colormap_lut
+from ..common.render_stats import RenderStats
+from .shaders import get_frag_shader, VERT_SHADER, UPSCALE_VERT_SHADER, UPSCALE_FRAG_SHADER
 
 NUMPY_LT_1_13 = LooseVersion(np.__version__) < LooseVersion('1.13')
 
+# Value used in the textures in place of NaN values. Since the contrast limits
+# are applied in the shader, values below -1e29 are explicitly rejected there
+# before applying the limits, as for the sizes and colormap values in the
+# scatter shaders.
+NAN_VALUE = -1e30
+
+# The formats that can be used to store the volumes on the GPU, given as the
+# type of the data that is uploaded and the internal format of the texture.
+# Note that half-float data can't be uploaded with VisPy so we upload
+# 32-bit floats in that case and let OpenGL convert the values.
+TEXTURE_FORMATS = {'float32': (np.float32, 'r32f'),
+                   'float16': (np.float32, 'r16f'),
+                   'uint16': (np.uint16, 'r16'),
+                   'uint8': (np.uint8, 'r8')}
+
+# The maximum number of compiled programs kept for each volume visual
+PROGRAM_CACHE_SIZE = 8
+
+ProgramCacheInfo = namedtuple('ProgramCacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# The size of the macrocells, in voxels, used to skip over parts of the volumes
+# that can't be visible when rendering.
+MACROCELL_SIZE = 8
+
+# The executor used to compute the fixed resolution buffers in the background.
+# This is shared between all viewers and is only created when first needed.
+_EXECUTOR = None
+
+
+def get_executor():
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1),
+                                       thread_name_prefix='glue-vispy-volume')
+    return _EXECUTOR
+
 
 class NoFreeSlotsError(Exception):
     pass
 
 
+class SamplingController(object):
+    """
+    Keep track of how long drawing the volumes takes and determine the factor
+    by which to increase the step size along the rays so that the frame rate
+    stays close to ``target_fps``.
+
+    The time needed to draw the volumes is assumed to be inversely
+    proportional to the factor, and we keep a running average of the time that
+    would be needed to draw the volumes at full quality.
+    """
+
+    def __init__(self, target_fps=30, initial_factor=1., max_factor=None, smoothing=0.5):
+        self.target_fps = target_fps
+        self.factor = initial_factor
+        self.max_factor = max_factor
+        self.smoothing = smoothing
+        self._full_time = None
+
+    def update(self, draw_time):
+        """
+        Update the factor given the time in seconds it took to draw the last
+        frame with the current factor, and return the new factor.
+        """
+
+        full_time = draw_time * self.factor
+
+        if self._full_time is None:
+            self._full_time = full_time
+        else:
+            self._full_time = (self.smoothing * self._full_time +
+                               (1 - self.smoothing) * full_time)
+
+        factor = max(self._full_time * self.target_fps, 1.)
+        if self.max_factor is not None:
+            factor = min(factor, self.max_factor)
+
+        self.factor = factor
+
+        return factor
+
+
+def texture_shape(resolution):
+    """
+    Return the shape of the textures, as ``(nz, ny, nx)``, for a resolution
+    given either as a single number of voxels along each axis or as a shape.
+    """
+    if np.isscalar(resolution):
+        return (int(resolution),) * 3
+    else:
+        return tuple(int(n) for n in resolution)
+
+
+def compute_scaled_buffer(data, bounds, clim, dtype=np.float32, stats=None, label=None):
+    """
+    Compute the fixed resolution buffer for ``data`` over ``bounds`` and
+    normalize it using ``clim``, returning an array of type ``dtype`` that can
+    be uploaded to a texture. For integer types, the normalized values are
+    clipped to the [0:1] range and quantized, and NaN values are set to zero.
+    If ``stats`` is given, the time taken by each step is recorded there
+    for the layer ``label``.
+
+    This doesn't make any OpenGL calls so can safely be called from a worker
+    thread.
+    """
+
+    start = time.perf_counter()
+
+    sliced_data = data.compute_fixed_resolution_buffer(bounds)
+
+    if stats is not None:
+        stats.record('compute', time.perf_counter() - start,
+                     nbytes=sliced_data.nbytes, layer=label)
+        start = time.perf_counter()
+
+    buffer = np.empty(sliced_data.shape, dtype=dtype)
+
+    quantized = np.issubdtype(dtype, np.integer)
+    if quantized:
+        scratch = np.empty([min(x, 128) for x in sliced_data.shape], dtype=np.float32)
+
+    # We do the copy and renormalization in chunks to avoid excessive memory
+    # usage from temporary arrays.
+
+    chunk_shape = [min(x, 128) for x in sliced_data.shape]
+
+    for view in iterate_chunks(sliced_data.shape, chunk_shape=chunk_shape):
+
+        if buffer[view].size == 0:
+            continue
+
+        if quantized:
+            chunk = scratch[tuple(slice(0, s.stop - s.start) for s in view)]
+        else:
+            chunk = buffer[view]
+
+        chunk[...] = sliced_data[view]
+
+        if clim is not None:
+            chunk -= clim[0]
+            chunk *= 1 / (clim[1] - clim[0])
+
+        # PERF: nan_to_num doesn't actually help memory usage as it runs
+        # isnan internally, and it's slower, so we just use the following
+        # methind. In future we could do this directly with a C extension.
+        if quantized:
+            chunk[np.isnan(chunk)] = 0
+            np.clip(chunk, 0, 1, out=chunk)
+            chunk *= np.iinfo(dtype).max
+            np.rint(chunk, out=chunk)
+            buffer[view] = chunk
+        else:
+            chunk[np.isnan(chunk)] = NAN_VALUE
+
+    if stats is not None:
+        stats.record('normalize', time.perf_counter() - start, nbytes=buffer.nbytes, layer=label)
+
+    return buffer
+
+
+def compute_scaled_regions(data, regions, clim, dtype=np.float32, stats=None, label=None,
+                           size=None, block_size=None):
+    """
+    Compute normalized buffers for several regions of the data. ``regions``
+    should be a list of ``(start, bounds)`` tuples, and a list of ``(start,
+    buffer, blocks)`` tuples is returned. If ``size`` and ``block_size`` are
+    given, ``blocks`` gives the maxima of the buffer in the macrocells of a
+    texture of shape ``size`` (see `compute_wrapped_block_max`), and is
+    otherwise `None`.
+    """
+    results = []
+    for start, bounds in regions:
+        buffer = compute_scaled_buffer(data, bounds, clim, dtype=dtype, stats=stats, label=label)
+        if size is None or block_size is None:
+            blocks = None
+        else:
+            begin = time.perf_counter()
+            blocks = compute_wrapped_block_max(buffer, start, size, block_size)
+            if stats is not None:
+                stats.record('blocks', time.perf_counter() - begin,
+                             nbytes=buffer.nbytes, layer=label)
+        results.append((start, buffer, blocks))
+    return results
+
+
+def compute_block_max(buffer, offset, size, block_size):
+    """
+    Compute the maximum of ``buffer`` in each macrocell of ``block_size``
+    voxels, for a buffer placed at ``offset`` in a texture of shape ``size``.
+    This returns the position of the first macrocell covered by the buffer, the
+    maxima, and a boolean array indicating which macrocells are fully covered
+    by the buffer.
+    """
+
+    if np.issubdtype(buffer.dtype, np.integer):
+        fill = np.iinfo(buffer.dtype).min
+    else:
+        fill = -np.inf
+
+    # We pad the buffer so that it covers whole macrocells, with values that
+    # don't change the maxima, so that the maxima can be found by reshaping.
+    padded_shape = []
+    target = []
+    full = []
+
+    for start, length, n in zip(offset, buffer.shape, size):
+
+        lower = start - start % block_size
+        upper = -(-(start + length) // block_size) * block_size
+        padded_shape.append(upper - lower)
+        target.append(slice(start - lower, start - lower + length))
+
+        # Macrocells at the edge of the texture are smaller
+        block_lower = np.arange(lower, upper, block_size)
+        block_upper = np.minimum(block_lower + block_size, n)
+        full.append((block_lower >= start) & (block_upper <= start + length))
+
+    if tuple(padded_shape) == buffer.shape:
+        padded = buffer
+    else:
+        padded = np.full(padded_shape, fill, dtype=buffer.dtype)
+        padded[tuple(target)] = buffer
+
+    nz, ny, nx = (n // block_size for n in padded_shape)
+    # Reducing along the outer axes first is much faster since each step then
+    # operates on large contiguous parts of the array.
+    maxima = padded.reshape((nz, block_size, ny, block_size, nx, block_size))
+    maxima = maxima.max(axis=1).max(axis=2).max(axis=3)
+
+    full = full[0][:, None, None] & full[1][None, :, None] & full[2][None, None, :]
+
+    return tuple(start // block_size for start in offset), maxima, full
+
+
+def compute_wrapped_block_max(buffer, start, size, block_size):
+    """
+    Compute the maxima in each macrocell for a buffer that starts at the
+    lattice indices ``start``, in a texture of shape ``size`` in which the
+    lattice indices wrap around. This returns a list with the output of
+    `compute_block_max` for each of the parts given by `wrapped_views`, with
+    the maxima of integer buffers normalized to the [0:1] range in the same
+    way as when the texture is sampled.
+
+    This doesn't make any OpenGL calls so can safely be called from a worker
+    thread.
+    """
+    blocks = []
+    for view, offset in wrapped_views(start, buffer.shape, size):
+        block_offset, maxima, full = compute_block_max(buffer[view], offset, size, block_size)
+        if np.issubdtype(maxima.dtype, np.integer):
+            maxima = maxima / np.iinfo(maxima.dtype).max
+        blocks.append((block_offset, maxima, full))
+    return blocks
+
+
+def subtract_box(window, box):
+    """
+    Split the part of ``window`` not covered by ``box`` into boxes. Both
+    should be given as ``(lower, upper)`` tuples of integer indices, and
+    ``box`` should be contained in ``window``.
+    """
+
+    (wlo, whi), (blo, bhi) = window, box
+
+    boxes = []
+
+    for axis in range(len(wlo)):
+
+        # Along the axes already processed we only need to cover the inside of
+        # the box, and along the remaining axes we need to cover the full
+        # window.
+        lower = list(blo[:axis]) + list(wlo[axis:])
+        upper = list(bhi[:axis]) + list(whi[axis:])
+
+        if wlo[axis] < blo[axis]:
+            upper_slab = list(upper)
+            upper_slab[axis] = blo[axis]
+            boxes.append((tuple(lower), tuple(upper_slab)))
+
+        if bhi[axis] < whi[axis]:
+            lower_slab = list(lower)
+            lower_slab[axis] = bhi[axis]
+            boxes.append((tuple(lower_slab), tuple(upper)))
+
+    return boxes
+
+
+def wrapped_views(start, shape, size):
+    """
+    Given a buffer of a given ``shape`` that starts at the lattice indices
+    ``start``, yield ``(view, offset)`` tuples giving the parts of the buffer
+    and where they should go in a texture of the given ``size`` in which the
+    lattice indices wrap around.
+    """
+
+    pieces = []
+
+    for index, length, n in zip(start, shape, size):
+        offset = index % n
+        if offset + length <= n:
+            pieces.append([(slice(0, length), offset)])
+        else:
+            pieces.append([(slice(0, n - offset), offset),
+                           (slice(n - offset, length), 0)])
+
+    for combination in product(*pieces):
+        view = tuple(piece[0] for piece in combination)
+        offset = tuple(piece[1] for piece in combination)
+        yield view, offset
+
+
+def current_framebuffer(canvas):
+    """
+    Return ``(fbo, offset, csize)`` for the framebuffer the ``canvas`` is
+    drawing to, where ``fbo`` is `None` for the canvas itself, ``offset`` is
+    the origin of the framebuffer and ``csize`` the size of the region of the
+    canvas it covers.
+    """
+
+    # The framebuffer stack of scene canvases isn't part of the public API,
+    # so if it isn't available we assume we are drawing to the whole canvas.
+    get_current = getattr(canvas, '_current_framebuffer', None)
+    if get_current is None:
+        return None, (0, 0), tuple(canvas.size)
+    else:
+        return get_current()
+
+
 class MultiVolumeVisual(VolumeVisual):
     """
     Displays multiple 3D volumes simultaneously.
@@ -72,30 +403,151 @@ class MultiVolumeVisual(VolumeVisual):
         but has lower performance on desktop platforms.
     n_volume_max : int
         Absolute maximum number of volumes that can be shown.
+    threaded : bool
+        Whether to compute the fixed resolution buffers in a background thread.
+        If `True`, the textures are updated once the buffers are ready rather
+        than straight away.
+    precision : {'float32', 'float16', 'uint16', 'uint8'}
+        The format used to store the volumes on the GPU. Volumes without
+        limits, such as subset masks, are always stored using 8-bit integers.
+    packed : bool
+        If `True`, volumes stored using the same format share RGBA textures,
+        with up to four volumes per texture. This reduces the number of
+        texture lookups when rendering, but a copy of the textures needs to be
+        kept in memory since individual channels can't be updated on the GPU.
+    target_fps : float
+        The frame rate to aim for while the volumes are downsampled during
+        interaction.
+    resolution : int or tuple
+        The number of voxels along each axis of the textures, or the shape of
+        the textures as ``(nz, ny, nx)``.
+    preview_factor : int
+        When the whole slice needs to be computed in the background, a buffer
+        with this many times fewer voxels along each axis is computed and
+        shown first. Set this to 1 to disable the previews.
+
+    Notes
+    -----
+    Unless textures are emulated, the volumes are split into macrocells for
+    which we keep track of the maximum values, and the shader skips over
+    macrocells in which none of the enabled volumes can be visible.
     """
 
-    def __init__(self, n_volume_max=16, emulate_texture=False, bgcolor='white', resolution=256):
+    def __init__(self, n_volume_max=16, emulate_texture=False, bgcolor='white', resolution=256,
+                 threaded=True, precision='float32', packed=False, target_fps=30,
+                 preview_factor=8):
 
         # Choose texture class
-        tex_cls = TextureEmulated3D if emulate_texture else Texture3D
+        self._tex_cls = TextureEmulated3D if emulate_texture else Texture3D
+
+        # When panning, the textures are treated as ring buffers so that only
+        # the newly exposed parts need to be computed and uploaded. This relies
+        # on the texture wrapping, so isn't possible with emulated textures.
+        self._emulate_texture = emulate_texture
+        self._wrapping = 'clamp_to_edge' if emulate_texture else 'repeat'
 
         self._n_volume_max = n_volume_max
-        self._vol_shape = (resolution, resolution, resolution)
+        self._vol_shape = texture_shape(resolution)
         self._need_vertex_update = True
         self._data_bounds = None
 
+        # The lattice on which the textures are computed, given as the
+        # coordinates of the first point, the step size along each axis, and
+        # the number of points along each axis, as well as the position of the
+        # current slice on the lattice (in units of the step size).
+        self._lattice = None
+        self._lattice_shift = None
+
         self.resolution = resolution
 
+        self.threaded = threaded
+        self._upload_timer = None
+
+        # Each allocated volume gets a new generation, so that results of
+        # jobs submitted for a volume that has since been deallocated are
+        # never uploaded, even if a volume with the same label is allocated.
+        self._generations = count()
+        self._preview_factor = preview_factor
+
+        if precision not in TEXTURE_FORMATS:
+            raise ValueError("precision should be one of {0}".format(sorted(TEXTURE_FORMATS)))
+        self._precision = precision
+
+        self._packed = packed
+
+        # While interacting with the viewer, the step size along the rays is
+        # increased by a factor determined from the time taken to draw the
+        # previous frames. The factor is kept between interactions.
+        self._sampling = SamplingController(target_fps=target_fps,
+                                            initial_factor=max(self._vol_shape) / 20,
+                                            max_factor=max(max(self._vol_shape) / 4, 1))
+        self._downsampled = False
+
+        # The volumes can also be rendered to a smaller framebuffer which is
+        # then stretched onto the canvas - this reduces the number of rays
+        # rather than the number of steps along each ray.
+        self._render_scale = 1.
+        self._fbo = None
+        self._upscale_program = None
+
+        # Empty space skipping uses an additional 3D texture which indicates
+        # which macrocells are occupied. This texture is updated before drawing
+        # if anything that affects it has changed.
+        self._skip_empty = not emulate_texture
+        self._macrocells = None
+        self._macrocells_dirty = True
+
+        # The colormaps are stored as lookup tables in a single 2D texture,
+        # with one row per slot, so that changing a colormap only requires
+        # uploading one row of the texture rather than changing the shader.
+        self._cmaps = Texture2D(np.zeros((n_volume_max, CMAP_LUT_SIZE, 4), dtype=np.float32),
+                                interpolation='linear', wrapping='clamp_to_edge',
+                                internalformat='rgba32f')
+
         # We deliberately don't use super here because we don't want to call
         # VolumeVisual.__init__
         Visual.__init__(self, vcode=VERT_SHADER, fcode="")
 
         self.volumes = defaultdict(dict)
 
+        # The textures are only created once data is uploaded. The volumes
+        # are identified in the shader by their slot index, which is separate
+        # from where the data is stored - the 'storage' key of each volume
+        # gives the index of the texture and the channel in the texture. For
+        # each texture, we keep track of the format, the volumes stored in each
+        # channel, and for packed textures a copy of the data.
+        self.textures = [None] * n_volume_max
+        self._storage = [None] * n_volume_max
+
+        # The fragment shader depends on the layout of the volumes (which slots
+        # and textures are used, which volumes are multiplied, and whether
+        # the data is clipped). Rather than changing the shader of a single
+        # program, we keep the programs compiled for recent layouts so that
+        # going back to a previous layout doesn't need a recompilation.
+        self._programs = OrderedDict()
+        self._layout = None
+        self._shader = None
+        self._program_cache_hits = 0
+        self._program_cache_misses = 0
+
+        # Timings and sizes of the operations needed to render the volumes -
+        # this is replaced by the statistics for the whole canvas when the
+        # visual is added to a viewer.
+        self.stats = RenderStats()
+
         # We turn on clipping straight away - the following variable is needed
         # by _update_shader
         self._clip_data = True
 
+        # The clipping limits are given relative to the slice passed to
+        # _update_slice_transform, but the textures only cover the part of
+        # the slice inside the clipping box (the clipping region), so we keep
+        # track of the slice limits in order to update the textures when the
+        # clipping changes. By default the clipping box is the whole slice.
+        self._clip_limits = None
+        self._clip_region = (0., 0., 0.), (1., 1., 1.)
+        self._slice_limits = None
+
         # Set up initial shader so that we can start setting shader variables
         # that don't depend on what volumes are actually active.
         self._update_shader()
@@ -126,52 +578,100 @@ class MultiVolumeVisual(VolumeVisual):
 
         # Only show back faces of cuboid. This is required because if we are
         # inside the volume, then the front faces are outside of the clipping
-        # box and will not be drawn.
-        self.set_gl_state('translucent', cull_face=False)
+        # box and will not be drawn. We also make sure that the alpha values
+        # are kept when rendering to a separate framebuffer.
+        self.set_gl_state('translucent', cull_face=False,
+                          blend_func=('src_alpha', 'one_minus_src_alpha',
+                                      'one', 'one_minus_src_alpha'))
 
         # Set up the underlying volume shape and define textures
 
-        self._vol_shape = (resolution, resolution, resolution)
-        self.shared_program['u_shape'] = self._vol_shape
+        self.shared_program['u_shape'] = self._vol_shape[::-1]
 
-        self.textures = []
         for i in range(n_volume_max):
 
-            # Set up texture object
-            self.textures.append(tex_cls(self._vol_shape, interpolation='linear',
-                                         wrapping='clamp_to_edge'))
-
-            # Pass texture object to shader program
-            self.shared_program['u_volumetex_{0}'.format(i)] = self.textures[i]
-
             # Make sure all textures are disabled
             self.shared_program['u_enabled_{0}'.format(i)] = 0
             self.shared_program['u_weight_{0}'.format(i)] = 1
+            self.shared_program['u_clim_{0}'.format(i)] = (1., 0.)
+
+        # Position in the textures of the first voxel of the current slice
+        self.shared_program['u_tex_offset'] = (0., 0., 0.)
 
         # Don't use downsampling initially (1 means show 1:1 resolution)
         self.shared_program['u_downsample'] = 1.
 
-        # Set up texture sampler
-        self.shared_program.frag['sampler_type'] = self.textures[0].glsl_sampler_type
-        self.shared_program.frag['sample'] = self.textures[0].glsl_sample
-
         # Set initial background color
         self.shared_program['u_bgcolor'] = Color(bgcolor).rgba
 
+        self.shared_program['u_cmaps'] = self._cmaps
+        self.shared_program['u_cmaps_shape'] = CMAP_LUT_SIZE, n_volume_max
+
         # Prevent additional attributes from being added
         try:
             self.freeze()
         except AttributeError:  # Older versions of VisPy
             pass
 
-    def _update_shader(self, force=False):
-        shader = get_frag_shader(self.volumes, clipped=self._clip_data,
-                                 n_volume_max=self._n_volume_max)
-        # We only actually update the shader in OpenGL if the code has changed
-        # to avoid any overheads in uploading the new shader code
-        if force or getattr(self, '_shader_cache', None) != shader:
-            self.shared_program.frag = shader
-            self._shader_cache = shader
+    def _layout_key(self):
+        # All the information get_frag_shader uses to generate the shader
+        volumes = tuple(sorted((label, volume['index'], volume.get('storage'),
+                                volume.get('multiply'))
+                               for label, volume in self.volumes.items()))
+        return volumes, bool(self._clip_data), self._packed, self._skip_empty
+
+    def _update_shader(self):
+
+        layout = self._layout_key()
+
+        if layout == self._layout:
+            return
+
+        program, shader = self._programs.pop(layout, (None, None))
+
+        if program is None:
+            start = time.perf_counter()
+            self._program_cache_misses += 1
+            sampler_type = 'sampler2D' if self._emulate_texture else 'sampler3D'
+            shader = get_frag_shader(self.volumes, clipped=self._clip_data,
+                                     n_volume_max=self._n_volume_max, packed=self._packed,
+                                     skip_empty=self._skip_empty, sampler_type=sampler_type)
+            # New programs are given all the variables set so far on the
+            # shared program, and any variables set from now on.
+            program = self.shared_program.add_program()
+            program.frag = shader
+            # The sampling function can only be set once the shader declares
+            # at least one texture.
+            for texture, storage in zip(self.textures, self._storage):
+                if storage is not None:
+                    program.frag['sample'] = texture.glsl_sample
+                    break
+            if len(self._programs) >= PROGRAM_CACHE_SIZE:
+                self._programs.popitem(last=False)
+            # Note that the program is only compiled when it is first drawn
+            self.stats.record('shader', time.perf_counter() - start)
+        else:
+            self._program_cache_hits += 1
+
+        self._programs[layout] = program, shader
+        self._layout = layout
+        self._shader = shader
+
+        # Make the program the one used for drawing
+        self._program = program
+        self._prepare_transforms(self)
+
+        self._macrocells_dirty = True
+
+    def program_cache_info(self):
+        """
+        Return the number of times a compiled program could be re-used when
+        the layout of the volumes changed (hits) and the number of times a new
+        program had to be compiled (misses), as well as the maximum and
+        current number of cached programs.
+        """
+        return ProgramCacheInfo(self._program_cache_hits, self._program_cache_misses,
+                                PROGRAM_CACHE_SIZE, len(self._programs))
 
     # The following methods change things which require the shader code to be updated
 
@@ -181,22 +681,157 @@ class MultiVolumeVisual(VolumeVisual):
         index = self._free_slot_index
         self.volumes[label] = {}
         self.volumes[label]['index'] = index
+        self.volumes[label]['generation'] = next(self._generations)
         self.shared_program['u_enabled_{0}'.format(index)] = 0
+        self.shared_program['u_clim_{0}'.format(index)] = (1., 0.)
         self._update_shader()
 
+    @property
+    def _channels(self):
+        return 4 if self._packed else 1
+
+    def _texture_shape(self):
+        if self._packed:
+            return self._vol_shape + (4,)
+        else:
+            return self._vol_shape
+
+    def _internalformat(self, fmt):
+        internalformat = TEXTURE_FORMATS[fmt][1]
+        if self._packed:
+            internalformat = 'rgba' + internalformat[1:]
+        return internalformat
+
+    def _assign_storage(self, label):
+        """
+        Find a texture and channel in which to store the data for a volume
+        with the format given by the 'format' key of the volume.
+        """
+
+        volume = self.volumes[label]
+        fmt = volume['format']
+
+        if 'storage' in volume:
+            if self._storage[volume['storage'][0]]['format'] == fmt:
+                return
+            self._free_storage(label)
+
+        # Find an existing texture with the same format and a free channel,
+        # or otherwise a free texture.
+        for tex_index, storage in enumerate(self._storage):
+            if storage is not None and storage['format'] == fmt and None in storage['labels']:
+                break
+        else:
+            tex_index = self._storage.index(None)
+            self._storage[tex_index] = {'format': fmt,
+                                        'labels': [None] * self._channels,
+                                        'mirror': None}
+            self._create_texture(tex_index, fmt)
+
+        storage = self._storage[tex_index]
+        channel = storage['labels'].index(None)
+        storage['labels'][channel] = label
+        volume['storage'] = tex_index, channel
+
+        # The texture may not have been used in the shader before, in which
+        # case it was removed from the program variables.
+        self.shared_program['u_volumetex_{0}'.format(tex_index)] = self.textures[tex_index]
+
+    def _create_texture(self, tex_index, fmt):
+
+        texture = self.textures[tex_index]
+        shape = self._texture_shape()
+        internalformat = self._internalformat(fmt)
+
+        if texture is None:
+            texture = self._tex_cls(shape, interpolation='linear',
+                                    wrapping=self._wrapping,
+                                    internalformat=internalformat)
+            self.textures[tex_index] = texture
+        else:
+            texture.resize(shape, internalformat=internalformat)
+            texture.wrapping = self._wrapping
+
+        # FIXME: shouldn't be needed!
+        zeros = np.zeros(shape, dtype=TEXTURE_FORMATS[fmt][0])
+        texture.set_data(zeros)
+
+        if self._packed:
+            self._storage[tex_index]['mirror'] = zeros
+
+    def _free_storage(self, label):
+
+        tex_index, channel = self.volumes[label].pop('storage')
+
+        storage = self._storage[tex_index]
+        storage['labels'][channel] = None
+
+        if any(label is not None for label in storage['labels']):
+            return
+
+        self._storage[tex_index] = None
+
+        # The texture remains bound to a texture unit in the OpenGL program, so
+        # rather than deleting it (which would leave an invalid texture bound)
+        # we shrink it to a single voxel, which releases the memory, and
+        # re-use it later if needed.
+        self.textures[tex_index].resize((1, 1, 1) + self._texture_shape()[3:])
+
     def deallocate(self, label):
         if label not in self.volumes:
             return  # layer already deallocated
         self.disable(label)
+        # Jobs that are already running are left to finish in the background
+        # rather than blocking, and their results are dropped.
+        self._cancel_job(label)
+        if 'storage' in self.volumes[label]:
+            self._free_storage(label)
         self.volumes.pop(label)
         self._update_shader()
 
     def set_clip(self, clip_data, clip_limits):
+        """
+        Set whether to clip the volumes, and the clipping box given relative to
+        the current slice as ``(x_min, y_min, z_min, x_max, y_max, z_max)``.
+        When the slice changes, the clipping box is kept fixed in data
+        coordinates.
+        """
         self._clip_data = int(clip_data)
         if clip_data:
+            self._clip_limits = tuple(clip_limits)
+        self._update_shader()
+        # While interacting with the viewer, the clipping box typically
+        # changes with every event, so we only update the textures once the
+        # interaction is done.
+        if not self._downsampled:
+            self._update_clip_region()
+        self._update_clip_uniforms()
+
+    def _find_clip_region(self):
+        # The part of the slice inside the clipping box, in x, y, z order
+        if self._clip_data and self._clip_limits is not None:
+            lower = tuple(min(max(x, 0.), 1.) for x in self._clip_limits[:3])
+            upper = tuple(min(max(x, 0.), 1.) for x in self._clip_limits[3:])
+            if all(hi > lo for lo, hi in zip(lower, upper)):
+                return lower, upper
+        return (0., 0., 0.), (1., 1., 1.)
+
+    def _update_clip_region(self):
+        # We ignore rounding errors from the transforms used to find the
+        # clipping box, since updating the region means updating the textures
+        if (self._slice_limits is not None and
+                not np.allclose(self._find_clip_region(), self._clip_region, atol=1e-6)):
+            self._update_slice_transform(*self._slice_limits)
+
+    def _update_clip_uniforms(self):
+        # The shader expects the clipping limits relative to the textures
+        if self._clip_data:
+            lower, upper = self._clip_region
+            clip_limits = [(x - lo) / (hi - lo)
+                           for x, lo, hi in zip(self._clip_limits or (0, 0, 0, 1, 1, 1),
+                                                lower * 2, upper * 2)]
             self.shared_program['u_clip_min'] = clip_limits[:3]
             self.shared_program['u_clip_max'] = clip_limits[3:]
-        self._update_shader()
 
     def set_multiply(self, label, label_other):
         self.volumes[label]['multiply'] = label_other
@@ -208,40 +843,128 @@ class MultiVolumeVisual(VolumeVisual):
     def enable(self, label):
         index = self.volumes[label]['index']
         self.shared_program['u_enabled_{0}'.format(index)] = 1
+        self._macrocells_dirty = True
 
     def disable(self, label):
         index = self.volumes[label]['index']
         self.shared_program['u_enabled_{0}'.format(index)] = 0
+        self._macrocells_dirty = True
 
     def downsample(self):
-        min_dimension = min(self._vol_shape)
-        self.shared_program['u_downsample'] = min_dimension / 20
+        self._downsampled = True
+        self.shared_program['u_downsample'] = self._sampling.factor
 
     def upsample(self):
+        self._downsampled = False
         self.shared_program['u_downsample'] = 1.
+        self._update_clip_region()
+        self._update_clip_uniforms()
+
+    def set_target_fps(self, target_fps):
+        self._sampling.target_fps = target_fps
+
+    def set_render_scale(self, scale):
+        """
+        Set the resolution of the framebuffer the volumes are rendered to,
+        relative to the canvas. Values below 1 are intended for use while
+        interacting with the viewer.
+        """
+        self._render_scale = scale
 
     def set_background(self, color):
         self.shared_program['u_bgcolor'] = Color(color).rgba
 
+    def set_precision(self, precision):
+        if precision not in TEXTURE_FORMATS:
+            raise ValueError("precision should be one of {0}".format(sorted(TEXTURE_FORMATS)))
+        if precision == self._precision:
+            return
+        self._precision = precision
+        for label in self.volumes:
+            if 'data' in self.volumes[label]:
+                self._update_scaled_data(label)
+
+    def set_packed(self, packed):
+        """
+        Set whether volumes stored using the same format share RGBA textures.
+        Since this changes where every volume is stored, the data for all
+        volumes is uploaded again.
+        """
+        if packed == self._packed:
+            return
+        # The textures need to be released before changing the number of
+        # channels, since this determines the shape of the released textures.
+        for label in self.volumes:
+            if 'storage' in self.volumes[label]:
+                self._free_storage(label)
+        self._packed = packed
+        self._update_shader()
+        for label in self.volumes:
+            if 'data' in self.volumes[label]:
+                self._update_scaled_data(label)
+
+    def _texture_format(self, label):
+        # Volumes without limits are subset masks which don't need more than
+        # 8 bits.
+        if self.volumes[label].get('clim', None) is None:
+            return 'uint8'
+        else:
+            return self._precision
+
     def set_resolution(self, resolution):
+        """
+        Set the number of voxels along each axis of the textures, or the shape
+        of the textures as ``(nz, ny, nx)``. The textures are only updated
+        once the slice is next updated.
+        """
         self.resolution = resolution
-        self._vol_shape = (resolution, resolution, resolution)
-        self.shared_program['u_shape'] = self._vol_shape[::-1]
+        shape = texture_shape(resolution)
+        if shape == self._vol_shape:
+            return
+        self._vol_shape = shape
+        self._need_vertex_update = True
+        self._sampling.max_factor = max(max(shape) / 4, 1)
+        self.shared_program['u_shape'] = shape[::-1]
 
     def set_cmap(self, label, cmap):
-        if isinstance(cmap, str):
-            cmap = get_colormap(cmap)
+        """
+        Set the colormap for a volume. This can be the name of a VisPy
+        colormap, a VisPy or Matplotlib colormap, or an array of RGBA colors.
+        """
+        lut = get_colormap_lut(cmap, size=CMAP_LUT_SIZE)
         self.volumes[label]['cmap'] = cmap
         index = self.volumes[label]['index']
-        self.shared_program.frag['cmap{0:d}'.format(index)] = Function(cmap.glsl_map)
+        self._cmaps.set_data(lut[np.newaxis], offset=(index, 0))
 
     def set_clim(self, label, clim):
         # Avoid setting the same limits again
         if 'clim' in self.volumes[label] and self.volumes[label]['clim'] == clim:
             return
         self.volumes[label]['clim'] = clim
-        if 'data' in self.volumes[label]:
+        # The data is normalized once when it is uploaded, and any subsequent
+        # changes in the limits are applied in the shader, so we don't need to
+        # re-upload the data here.
+        self._update_clim(label)
+
+    def _update_clim(self, label):
+
+        ref_clim = self.volumes[label].get('ref_clim', None)
+        clim = self.volumes[label].get('clim', None)
+        scale, offset = clim_transform(ref_clim, clim)
+
+        # For integer textures, the values are clipped to the limits used when
+        # uploading the data, so if the limits now extend beyond these, or
+        # are so narrow that the quantization would be visible, we need to
+        # upload the data again.
+        if (self._texture_format(label).startswith('uint') and
+                'data' in self.volumes[label] and 'job' not in self.volumes[label] and
+                (offset > 0 or scale + offset < 1 or scale > 4)):
             self._update_scaled_data(label)
+            return
+
+        index = self.volumes[label]['index']
+        self.shared_program['u_clim_{0:d}'.format(index)] = scale, offset
+        self._macrocells_dirty = True
 
     def set_weight(self, label, weight):
         index = self.volumes[label]['index']
@@ -258,61 +981,428 @@ class MultiVolumeVisual(VolumeVisual):
 
         self.volumes[label]['data'] = data
         self.volumes[label]['layer'] = layer
-        self._update_scaled_data(label)
-
-    def _update_scaled_data(self, label):
+        self._update_scaled_data(label, preview=True)
+
+    def _update_scaled_data(self, label, reuse=False, preview=False):
+        """
+        Compute and upload the data for the current slice. If ``reuse`` is
+        `True`, only the parts of the slice that aren't already present in the
+        texture are computed. If ``preview`` is `True` and the data is computed
+        in the background, a low resolution version of the slice is shown
+        while the data is being computed - this should only be used if the
+        texture doesn't already contain data for the current slice.
+        """
 
         # If the data slice hasn't been set yet, we should stop here
         if self._data_bounds is None:
             return
 
-        index = self.volumes[label]['index']
-        clim = self.volumes[label].get('clim', None)
-        data = self.volumes[label]['data']
+        volume = self.volumes[label]
+
+        # Any buffer still being computed for this layer is now out of date
+        self._cancel_job(label)
+
+        data = volume['data']
+        window = self._window
+
+        # Find out which part of the texture is still valid - the 'valid' key
+        # gives the part of the lattice for which the texture contains data.
+        valid = volume.pop('valid', None)
+        if valid is not None and reuse:
+            valid = (tuple(max(a, b) for a, b in zip(valid[0], window[0])),
+                     tuple(min(a, b) for a, b in zip(valid[1], window[1])))
+            if any(lo >= hi for lo, hi in zip(*valid)):
+                valid = None
+        else:
+            valid = None
+
+        if valid is None:
+            clim = volume.get('clim', None)
+            volume['format'] = self._texture_format(label)
+            regions = [(window[0], self._data_bounds)]
+        else:
+            # Newly computed parts need to be normalized in the same way as
+            # the data already in the texture.
+            clim = volume['ref_clim']
+            volume['valid'] = valid
+            regions = [(lower, self._lattice_bounds(lower, upper))
+                       for lower, upper in subtract_box(window, valid)]
+            if len(regions) == 0:
+                return
+
+        key = self._job_key(label)
+        dtype = TEXTURE_FORMATS[volume['format']][0]
+
+        # The macrocell maxima are computed along with the buffers, for the
+        # current shape of the textures.
+        if self._skip_empty:
+            block_kwargs = dict(size=self._vol_shape, block_size=MACROCELL_SIZE)
+        else:
+            block_kwargs = {}
+
+        if self.threaded:
+            preview_bounds = self._preview_bounds() if preview and valid is None else None
+            if preview_bounds is not None:
+                volume['preview'] = get_executor().submit(compute_scaled_regions, data,
+                                                          [(window[0], preview_bounds)],
+                                                          clim, dtype, stats=self.stats,
+                                                          label=label)
+            future = get_executor().submit(compute_scaled_regions, data, regions, clim, dtype,
+                                           stats=self.stats, label=label, **block_kwargs)
+            volume['job'] = (key, clim, future)
+            if self._upload_timer is None:
+                self._upload_timer = app.Timer(interval=0.05, connect=self._process_pending)
+            if not self._upload_timer.running:
+                self._upload_timer.start()
+        else:
+            self._upload(label, compute_scaled_regions(data, regions, clim, dtype,
+                                                       stats=self.stats, label=label,
+                                                       **block_kwargs), clim)
+
+    def _job_key(self, label):
+        # Buffers computed in the background are only used if the volume
+        # hasn't been re-allocated and the slice and the shape of the textures
+        # are still the same once they are ready.
+        volume = self.volumes.get(label)
+        generation = None if volume is None else volume['generation']
+        return generation, self._data_bounds, self._lattice_shift, self._vol_shape
+
+    def _cancel_job(self, label):
+
+        # Jobs that are already running can't be cancelled, so we keep track
+        # of these until they are done in case `wait` is called.
+        running = [future for future in self.volumes[label].pop('running', [])
+                   if not future.done()]
+
+        job = self.volumes[label].pop('job', None)
+        if job is not None and not job[2].cancel():
+            running.append(job[2])
+
+        preview = self.volumes[label].pop('preview', None)
+        if preview is not None and not preview.cancel():
+            running.append(preview)
+
+        if running:
+            self.volumes[label]['running'] = running
+
+    def _process_pending(self, event=None):
+        """
+        Upload any buffers that have finished being computed in the background.
+        This should only be called from the main thread.
+        """
+
+        pending = False
+        uploaded = False
+
+        for label in list(self.volumes):
+
+            volume = self.volumes[label]
+
+            if 'job' not in volume:
+                continue
+
+            key, clim, future = volume['job']
+
+            # The preview is only needed if it is ready before the full buffer
+            if 'preview' in volume and (future.done() or volume['preview'].done()):
+                preview = volume.pop('preview')
+                if future.done() or preview.cancelled() or key != self._job_key(label):
+                    if not preview.cancel():
+                        volume.setdefault('running', []).append(preview)
+                else:
+                    self._upload_preview(label, preview.result()[0][1], clim)
+                    uploaded = True
+
+            if not future.done():
+                pending = True
+                continue
+
+            volume.pop('job')
+
+            # Drop results that were computed for a previous slice or
+            # allocation of the volume
+            if future.cancelled() or key != self._job_key(label):
+                continue
+
+            self._upload(label, future.result(), clim)
+
+            uploaded = True
+
+            # Uploading the data can cause the data to be computed again if
+            # the limits have changed in the mean time.
+            if 'job' in volume:
+                pending = True
+
+        if not pending and self._upload_timer is not None:
+            self._upload_timer.stop()
+
+        if uploaded:
+            self.update()
+
+    def wait(self):
+        """
+        Block until all buffers being computed in the background are ready, and
+        upload them.
+        """
+        futures = []
+        for volume in self.volumes.values():
+            futures.extend(volume.get('running', []))
+            if 'job' in volume:
+                futures.append(volume['job'][2])
+        wait(futures)
+        self._process_pending()
+
+    def _preview_bounds(self):
+        """
+        Return the fixed resolution buffer bounds for a low resolution version
+        of the current slice, or `None` if previews can't be used.
+        """
+
+        # The preview replaces the whole texture, so can't be used if other
+        # volumes share the texture, or if the slice doesn't start at the
+        # origin of the texture.
+        if (self._preview_factor is None or self._preview_factor <= 1 or
+                self._packed or self._emulate_texture or
+                any(k % n for k, n in zip(self._lattice_shift, self._lattice[2]))):
+            return None
+
+        bounds = []
+
+        for lo, hi, n in self._data_bounds:
+            if n < 2:
+                return None
+            m = max(n // self._preview_factor, 2)
+            # Textures are sampled using normalized coordinates, so we choose
+            # the bounds such that each voxel of the preview is at the same
+            # normalized position as the matching point in the full texture.
+            step = (hi - lo) / (n - 1)
+            ratio = n / m
+            bounds.append((lo + (0.5 * ratio - 0.5) * step,
+                           lo + ((m - 0.5) * ratio - 0.5) * step, m))
+
+        if all(m == n for (_, _, m), (_, _, n) in zip(bounds, self._data_bounds)):
+            return None
+
+        return bounds
+
+    def _upload_preview(self, label, buffer, clim):
+        """
+        Upload a low resolution version of the current slice for a layer. The
+        texture is resized to the shape of the buffer, and is then shown in
+        place of the full resolution data until that is uploaded.
+        """
+
+        volume = self.volumes[label]
+
+        start = time.perf_counter()
+
+        self._assign_storage(label)
+        self._update_shader()
+
+        # The preview doesn't wrap around, and since each voxel covers several
+        # voxels of the full texture, wrapping would be visible at the edges.
+        texture = self.textures[volume['storage'][0]]
+        texture.resize(buffer.shape, internalformat=self._internalformat(volume['format']))
+        texture.wrapping = 'clamp_to_edge'
+        texture.set_data(np.ascontiguousarray(buffer))
+
+        self.stats.record('upload', time.perf_counter() - start,
+                          nbytes=buffer.nbytes, layer=label)
+
+        # We don't know which macrocells of the full texture are empty, so
+        # none of them are skipped until the full data is uploaded.
+        volume['blocks'] = None
+        volume['ref_clim'] = clim
+        self._update_clim(label)
+        self._macrocells_dirty = True
+
+    def _upload(self, label, regions, clim):
+        """
+        Upload buffers to the texture for a layer. ``regions`` should be a list
+        of ``(start, buffer, blocks)`` tuples where ``start`` gives the position
+        of the buffer on the lattice and ``blocks`` the macrocell maxima
+        computed with `compute_wrapped_block_max`.
+        """
+
+        volume = self.volumes[label]
+
+        start_time = time.perf_counter()
+        nbytes = 0
+
+        # When uploading the whole volume, the format may have changed so we
+        # need to make sure the volume is stored in a suitable texture.
+        if 'valid' not in volume:
+            self._assign_storage(label)
+            self._update_shader()
+
+        # The 'blocks' key gives the maximum normalized value in each
+        # macrocell of the texture. When only part of the texture is updated,
+        # this is an upper limit for macrocells only partly updated.
+        if self._skip_empty and ('valid' not in volume or volume.get('blocks') is None or
+                                 volume['blocks'].shape != self._macrocell_shape):
+            volume['blocks'] = np.full(self._macrocell_shape, -np.inf, dtype=np.float32)
+
+        tex_index, channel = volume['storage']
+        texture = self.textures[tex_index]
+        mirror = self._storage[tex_index]['mirror']
+
+        # If the resolution has changed we need to resize the texture - for
+        # packed textures, the data for the other volumes in the texture is
+        # then lost but will be uploaded again since the slice has changed.
+        if texture.shape[:3] != self._vol_shape:
+            self._create_texture(tex_index, volume['format'])
+            mirror = self._storage[tex_index]['mirror']
 
         # With certain graphics cards, sending the data in one chunk to OpenGL
         # causes artifacts in the rendering - see e.g.
         # https://github.com/vispy/vispy/issues/1412
-        # To avoid this, we process the data in chunks. Since we need to do
-        # this, we can also do the copy and renormalization on the chunk to
-        # avoid excessive memory usage.
+        # To avoid this, we upload the data in chunks.
 
-        # To start off we need to tell the texture about the new shape
-        self.shared_program['u_volumetex_{0:d}'.format(index)].resize(data.shape)
+        for start, buffer, blocks in regions:
 
-        # Determine the chunk shape - the value of 128 as the minimum value
-        # is arbitrary but appears to work nicely. We can reduce that in future
-        # if needed.
+            if self._skip_empty:
+                for block_offset, maxima, full in blocks:
+                    self._update_blocks(label, block_offset, maxima, full)
 
-        sliced_data = data.compute_fixed_resolution_buffer(self._data_bounds)
+            # The position of the buffer in the texture wraps around, so the
+            # buffer may need to be split into several parts.
+            for wrapped_view, wrapped_offset in wrapped_views(start, buffer.shape,
+                                                              self._vol_shape):
 
-        chunk_shape = [min(x, 128, self.resolution) for x in sliced_data.shape]
+                wrapped_buffer = buffer[wrapped_view]
 
-        # FIXME: shouldn't be needed!
-        zeros = np.zeros(self._vol_shape, dtype=np.float32)
-        self.shared_program['u_volumetex_{0:d}'.format(index)].set_data(zeros)
+                # For packed textures, we update the copy of the texture and
+                # then upload all channels for the region.
+                if mirror is not None:
+                    target = tuple(slice(o, o + n)
+                                   for o, n in zip(wrapped_offset, wrapped_buffer.shape))
+                    mirror[target + (channel,)] = wrapped_buffer
+                    wrapped_buffer = mirror[target]
+
+                # Determine the chunk shape - the value of 128 as the minimum
+                # value is arbitrary but appears to work nicely. We can reduce
+                # that in future if needed.
+
+                chunk_shape = [min(x, 128, n)
+                               for x, n in zip(wrapped_buffer.shape[:3], self._vol_shape)]
+
+                # Now loop over chunks
+
+                for view in iterate_chunks(wrapped_buffer.shape[:3], chunk_shape=chunk_shape):
+
+                    chunk = wrapped_buffer[view]
+
+                    if chunk.size == 0:
+                        continue
+
+                    offset = tuple([o + s.start for o, s in zip(wrapped_offset, view)])
+
+                    texture.set_data(np.ascontiguousarray(chunk), offset=offset)
+                    nbytes += chunk.nbytes
+
+        self.stats.record('upload', time.perf_counter() - start_time,
+                          nbytes=nbytes, layer=label)
+
+        # Keep track of the limits used to normalize the data in the texture
+        # so that the shader can convert these to the current limits, and of
+        # which part of the lattice the texture now contains.
+        self.volumes[label]['ref_clim'] = clim
+        self.volumes[label]['valid'] = self._window
+        self._update_clim(label)
+        self._macrocells_dirty = True
+
+        # The data may have been computed in a different thread, in which case
+        # the data object may need to update the layer status from here.
+        data = self.volumes[label]['data']
+        if hasattr(data, 'apply_status'):
+            data.apply_status()
+
+    @property
+    def _macrocell_shape(self):
+        return tuple(-(-n // MACROCELL_SIZE) for n in self._vol_shape)
 
-        # Now loop over chunks
+    def _update_blocks(self, label, block_offset, maxima, full):
+        blocks = self.volumes[label]['blocks']
+        target = tuple(slice(o, o + n) for o, n in zip(block_offset, maxima.shape))
+        blocks[target] = np.where(full, maxima, np.maximum(blocks[target], maxima))
 
-        for view in iterate_chunks(sliced_data.shape, chunk_shape=chunk_shape):
+    def _visible_blocks(self, label):
 
-            chunk = sliced_data[view]
-            chunk = chunk.astype(np.float32)
-            if clim is not None:
-                chunk -= clim[0]
-                chunk *= 1 / (clim[1] - clim[0])
+        volume = self.volumes[label]
 
-            # PERF: nan_to_num doesn't actually help memory usage as it runs
-            # isnan internally, and it's slower, so we just use the following
-            # methind. In future we could do this directly with a C extension.
-            chunk[np.isnan(chunk)] = 0.
+        if volume.get('blocks') is None or volume['blocks'].shape != self._macrocell_shape:
+            return np.ones(self._macrocell_shape, dtype=bool)
 
-            offset = tuple([s.start for s in view])
+        # We use the limits currently used by the shader, which may be
+        # different from the current limits if the data is being updated.
+        scale, offset = self.shared_program['u_clim_{0:d}'.format(volume['index'])]
 
-            if chunk.size == 0:
+        # Values at or below the lower limit aren't visible
+        if scale <= 0:
+            return np.ones(self._macrocell_shape, dtype=bool)
+        else:
+            return volume['blocks'] > -offset / scale
+
+    def _compute_macrocells(self):
+        """
+        Determine which macrocells may contain visible values for any of the
+        enabled volumes.
+        """
+
+        occupied = np.zeros(self._macrocell_shape, dtype=bool)
+
+        enabled = self.enabled
+
+        for label, volume in self.volumes.items():
+
+            if not enabled[volume['index']] or 'storage' not in volume:
                 continue
 
-            self.shared_program['u_volumetex_{0:d}'.format(index)].set_data(chunk, offset=offset)
+            visible = self._visible_blocks(label)
+
+            label_other = volume.get('multiply')
+            if label_other is not None:
+                if 'storage' in self.volumes[label_other]:
+                    visible &= self._visible_blocks(label_other)
+                else:
+                    continue
+
+            occupied |= visible
+
+        # Values are interpolated between neighboring voxels, so we also need
+        # to include macrocells next to occupied ones. The textures wrap around
+        # so the macrocells at the edges are neighbors too.
+        for axis in range(3):
+            occupied = occupied | np.roll(occupied, 1, axis) | np.roll(occupied, -1, axis)
+
+        return occupied
+
+    def _update_macrocells(self):
+
+        self._macrocells_dirty = False
+
+        # The macrocell texture is only used in the shader if some of the
+        # volumes have been uploaded.
+        if not any(storage is not None for storage in self._storage):
+            return
+
+        start = time.perf_counter()
+
+        occupied = self._compute_macrocells().astype(np.uint8) * 255
+
+        if self._macrocells is None:
+            self._macrocells = Texture3D(occupied.shape, interpolation='nearest',
+                                         wrapping='repeat', internalformat='r8')
+        elif self._macrocells.shape[:3] != occupied.shape:
+            self._macrocells.resize(occupied.shape, internalformat='r8')
+
+        self._macrocells.set_data(occupied)
+
+        self.shared_program['u_macrocells'] = self._macrocells
+        self.shared_program['u_macrocell_shape'] = occupied.shape[::-1]
+        self.shared_program['u_macrocell_size'] = float(MACROCELL_SIZE)
+
+        self.stats.record('macrocells', time.perf_counter() - start, nbytes=occupied.nbytes)
 
     def label_for_layer(self, layer):
         for label in self.volumes:
@@ -337,30 +1427,113 @@ class MultiVolumeVisual(VolumeVisual):
                 return index
         raise NoFreeSlotsError("No free slots")
 
-    def _update_slice_transform(self, x_min, x_max, y_min, y_max, z_min, z_max):
+    @property
+    def _window(self):
+        # The part of the lattice covered by the current slice
+        return (self._lattice_shift,
+                tuple(k + n for k, n in zip(self._lattice_shift, self._lattice[2])))
+
+    def _lattice_bounds(self, lower, upper):
+        # The fixed resolution buffer bounds for part of the lattice
+        origin, step, _ = self._lattice
+        return [(o + lo * s, o + (hi - 1) * s, hi - lo)
+                for o, s, lo, hi in zip(origin, step, lower, upper)]
 
-        # TODO: simplify this to get bounds, for FRB
+    def _snap_to_lattice(self, limits):
+        """
+        If the new limits are a translation of the current slice by less than
+        the slice size, return the position of the nearest slice on the current
+        lattice, otherwise return `None`.
+        """
 
-        x_step = (x_max - x_min) / self.resolution
-        y_step = (y_max - y_min) / self.resolution
-        z_step = (z_max - z_min) / self.resolution
+        if self._emulate_texture or self._lattice is None:
+            return None
+
+        origin, step, shape = self._lattice
+
+        if shape != self._vol_shape or min(shape) < 2:
+            return None
+
+        shift = []
+
+        for (lo, hi), o, s, k, n in zip(limits, origin, step, self._lattice_shift, shape):
+            if s == 0 or abs((hi - lo) - s * (n - 1)) > 1e-6 * abs(s * (n - 1)):
+                return None
+            k_new = int(round((lo - o) / s))
+            if abs(k_new - k) >= n:
+                return None
+            shift.append(k_new)
+
+        return tuple(shift)
+
+    def _update_slice_transform(self, x_min, x_max, y_min, y_max, z_min, z_max):
 
-        data_bounds = [(z_min, z_max, self.resolution),
-                       (y_min, y_max, self.resolution),
-                       (x_min, x_max, self.resolution)]
+        slice_limits = x_min, x_max, y_min, y_max, z_min, z_max
+
+        # Keep the clipping box fixed in data coordinates
+        if self._slice_limits is not None and self._clip_data and self._clip_limits is not None:
+            old_lo, old_hi = self._slice_limits[::2], self._slice_limits[1::2]
+            new_lo, new_hi = slice_limits[::2], slice_limits[1::2]
+            self._clip_limits = tuple((o_lo + x * (o_hi - o_lo) - n_lo) / (n_hi - n_lo)
+                                      for x, o_lo, o_hi, n_lo, n_hi
+                                      in zip(self._clip_limits, old_lo * 2, old_hi * 2,
+                                             new_lo * 2, new_hi * 2))
+
+        self._slice_limits = slice_limits
+
+        # The full resolution of the textures is used for the part of the
+        # slice inside the clipping box, since nothing outside it is shown.
+        self._clip_region = lower, upper = self._find_clip_region()
+        self._update_clip_uniforms()
+
+        limits = [(lo + (hi - lo) * r_lo, lo + (hi - lo) * r_hi)
+                  for (lo, hi), r_lo, r_hi in zip([(z_min, z_max), (y_min, y_max), (x_min, x_max)],
+                                                  lower[::-1], upper[::-1])]
+
+        # If the slice has just been translated, we snap it to the lattice the
+        # textures are computed on so that we can re-use most of the textures
+        # and only compute the newly exposed parts. Otherwise we start from a
+        # new lattice.
+
+        shift = self._snap_to_lattice(limits)
+
+        if shift is None:
+            shape = self._vol_shape
+            lattice = ([lo for lo, hi in limits],
+                       [(hi - lo) / max(n - 1, 1) for (lo, hi), n in zip(limits, shape)], shape)
+            shift = (0, 0, 0)
+            data_bounds = [(lo, hi, n) for (lo, hi), n in zip(limits, shape)]
+        else:
+            lattice = self._lattice
+            data_bounds = self._lattice_bounds(shift, [k + n for k, n in zip(shift, lattice[2])])
 
         # We should stop at this point if the bounds are the same as before
         if data_bounds == self._data_bounds:
             return
-        else:
-            self._data_bounds = data_bounds
+
+        reuse = lattice is self._lattice
+
+        self._data_bounds = data_bounds
+        self._lattice = lattice
+        self._lattice_shift = shift
+
+        # The textures wrap around so the start of the slice can be anywhere in
+        # the texture - note that the shader expects the offset in x, y, z order
+        self.shared_program['u_tex_offset'] = [(k % n) / n
+                                               for k, n in zip(shift[::-1], lattice[2][::-1])]
+
+        (z_min, z_max, nz), (y_min, y_max, ny), (x_min, x_max, nx) = data_bounds
+
+        x_step = (x_max - x_min) / nx
+        y_step = (y_max - y_min) / ny
+        z_step = (z_max - z_min) / nz
 
         self.transform.inner.scale = [x_step, y_step, z_step]
         self.transform.inner.translate = [x_min, y_min, z_min]
 
         # We need to update the data in OpenGL if the slice has changed
         for label in self.volumes:
-            self._update_scaled_data(label)
+            self._update_scaled_data(label, reuse=reuse, preview=not reuse)
 
         # The following is needed to make sure that VisPy recognizes the changes
         # to the transforms.
@@ -389,10 +1562,72 @@ class MultiVolumeVisual(VolumeVisual):
         if not any(self.enabled):
             return
         else:
+            if self._skip_empty and self._macrocells_dirty:
+                self._update_macrocells()
+            start = time.perf_counter()
             try:
-                super(MultiVolumeVisual, self).draw()
+                if self._downsampled:
+                    # We wait for the drawing to finish so that the time
+                    # includes the time taken on the GPU.
+                    self._draw_scaled()
+                    gl.glFinish()
+                    factor = self._sampling.update(time.perf_counter() - start)
+                    self.shared_program['u_downsample'] = factor
+                else:
+                    self._draw_scaled()
             except Exception:
                 pass
+            self.stats.record('draw', time.perf_counter() - start)
+
+    def _draw_scaled(self):
+
+        # The canvas is only available when the visual is used as a node in a
+        # scene.
+        canvas = getattr(self, 'canvas', None)
+
+        if self._render_scale >= 1 or canvas is None:
+            super(MultiVolumeVisual, self).draw()
+            return
+
+        # Find the framebuffer we are drawing to and the region of the canvas
+        # it covers, which is normally the whole canvas.
+        fbo, offset, csize = current_framebuffer(canvas)
+        if fbo is None:
+            size = canvas.physical_size
+        else:
+            size = fbo.color_buffer.shape[1::-1]
+
+        shape = tuple(max(int(x * self._render_scale), 1) for x in size[::-1])
+
+        if self._fbo is None:
+            self._fbo = gloo.FrameBuffer(color=gloo.Texture2D(shape + (4,), interpolation='linear'),
+                                         depth=gloo.RenderBuffer(shape))
+            self._upscale_program = gloo.Program(UPSCALE_VERT_SHADER, UPSCALE_FRAG_SHADER)
+            self._upscale_program['a_position'] = np.array([[-1, -1], [1, -1], [-1, 1], [1, 1]],
+                                                           dtype=np.float32)
+            self._upscale_program['u_texture'] = self._fbo.color_buffer
+        elif self._fbo.shape[:2] != shape:
+            self._fbo.resize(shape)
+
+        # Render the volumes to the smaller framebuffer. Note that push_fbo
+        # assumes that the framebuffer has the same size as the canvas region
+        # it covers, so we need to set up the transforms to take into account
+        # the actual size of the framebuffer.
+        canvas.push_fbo(self._fbo, offset, csize)
+        try:
+            scale = canvas.pixel_scale
+            canvas.transforms.configure(viewport=(0, 0) + shape[::-1], fbo_size=shape[::-1],
+                                        fbo_rect=tuple(x * scale for x in offset + csize))
+            canvas.context.clear(color=(0, 0, 0, 0), depth=True)
+            super(MultiVolumeVisual, self).draw()
+        finally:
+            canvas.pop_fbo()
+
+        # Now stretch the result onto the original framebuffer - the colors
+        # in the framebuffer are premultiplied by the alpha values.
+        gloo.set_state(blend=True, blend_func=('one', 'one_minus_src_alpha'),
+                       depth_test=False, cull_face=False)
+        self._upscale_program.draw('triangle_strip')
 
 
 MultiVolume = create_visual_node(MultiVolumeVisual)